@@ -0,0 +1,84 @@
+"""
+Benchmark of the whole-event waveform binning
+against the per-sensor groupby histogram it replaces.
+
+usage: python detsim/benchmarks/binning.py [n_sensors] [n_samples]
+"""
+
+import sys
+
+import numpy  as np
+import pandas as pd
+
+from timeit import repeat
+
+from detsim.simulation.buffer_functions import        bin_sensors
+from detsim.simulation.buffer_functions import weighted_histogram
+
+
+def fake_sensor_response(n_sensors: int           ,
+                         n_samples: int           ,
+                         time_span: float = 1.0e6 ,
+                         seed     : int   =     0 ) -> pd.DataFrame:
+    """
+    Random sensor response with the layout of
+    the event DataFrames given by load_sensors.
+
+    n_sensors : int
+                Number of sensors with signal
+    n_samples : int
+                Total number of (time, charge) samples
+    time_span : float
+                Time range of the samples in ns
+    seed      : int
+                Seed for the random generator
+    """
+    rng     = np.random.default_rng(seed)
+    ids     = np.sort(rng.integers(0, n_sensors, n_samples))
+    times   = rng.uniform(0, time_span, n_samples)
+    charges = rng.integers(1, 5, n_samples)
+    return pd.DataFrame(dict(time = times, charge = charges),
+                        index = pd.Index(ids, name = 'sensor_id'))
+
+
+def groupby_binning(sensors: pd.DataFrame, bins: np.ndarray) -> pd.Series:
+    return sensors.groupby('sensor_id').apply(weighted_histogram, bins)
+
+
+def flat_binning(sensors: pd.DataFrame, bins: np.ndarray) -> np.ndarray:
+    return bin_sensors(sensors.index.get_level_values('sensor_id'),
+                       sensors.time  .values                     ,
+                       sensors.charge.values                     ,
+                       bins                                      )[1]
+
+
+def benchmark_binning(n_sensors: int   =    1792,
+                      n_samples: int   = 1000000,
+                      bin_width: float =  1000.0,
+                      n_repeat : int   =       3) -> dict:
+    """
+    Best time in seconds of each binning method
+    for one fake event. Also checks that both
+    give the same binned charge.
+    """
+    sensors  = fake_sensor_response(n_sensors, n_samples)
+    bins     = np.arange(0, sensors.time.max() + bin_width, bin_width)
+
+    grouped  = np.array(groupby_binning(sensors, bins).tolist())
+    flat     = flat_binning(sensors, bins)
+    assert np.all(grouped == flat)
+
+    timings  = {}
+    for name, binning in (('groupby', groupby_binning),
+                          ('flat'   ,    flat_binning)):
+        timings[name] = min(repeat(lambda: binning(sensors, bins),
+                                   number = 1, repeat = n_repeat))
+    return timings
+
+
+if __name__ == "__main__":
+    args    = [int(arg) for arg in sys.argv[1:3]]
+    timings = benchmark_binning(*args)
+    for name, t in timings.items():
+        print(f"{name:>8}: {t:8.4f} s")
+    print(f" speedup: {timings['groupby'] / timings['flat']:8.1f}")
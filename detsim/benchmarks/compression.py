@@ -0,0 +1,100 @@
+"""
+Write throughput and compression ratio of buffer_writer
+for a representative buffer file with each codec and
+chunkshape setting.
+
+usage: python detsim/benchmarks/compression.py [n_buffers] [compression ...]
+"""
+
+import      os
+import     sys
+import tempfile
+
+import numpy  as np
+import tables as tb
+
+from time import perf_counter
+
+from detsim.io.hdf5_io import  buffer_writer
+from detsim.io.hdf5_io import output_filters
+
+default_settings = (('ZLIB4'        , None, None),
+                    ('blosc:lz4-5'  , None, None),
+                    ('blosc:zstd-5' , None, None),
+                    ('blosc2:lz4-5' , None, None),
+                    ('blosc2:zstd-5', None, None),
+                    ('blosc:zstd-5' , (1, 12, 32000), (1, 1792, 800)))
+
+
+def fake_buffers(n_buffers: int         ,
+                 n_pmt    : int =     12,
+                 n_sipm   : int =   1792,
+                 pmt_len  : int =  32000,
+                 sipm_len : int =    800,
+                 seed     : int =      0) -> list:
+    """
+    Random (pmt, sipm) buffers with low occupancy,
+    5% of the SiPMs with charge.
+    """
+    rng     = np.random.default_rng(seed)
+    buffers = []
+    for _ in range(n_buffers):
+        sipms = np.zeros((n_sipm, sipm_len), int)
+        rows  = rng.choice(n_sipm, n_sipm // 20, replace=False)
+        sipms[rows] = rng.poisson(0.3, (len(rows), sipm_len))
+        buffers.append((rng.poisson(0.05, (n_pmt, pmt_len)), sipms))
+    return buffers
+
+
+def benchmark_compression(n_buffers: int   =               20,
+                          settings : tuple = default_settings) -> dict:
+    """
+    Write MB/s (of uncompressed int16 buffers) and
+    compression ratio for each (compression,
+    pmt chunkshape, sipm chunkshape) in settings.
+    Settings with unavailable codecs are skipped.
+    """
+    buffers = fake_buffers(n_buffers)
+    n_pmt , pmt_len  = buffers[0][0].shape
+    n_sipm, sipm_len = buffers[0][1].shape
+    data_mb = n_buffers * (buffers[0][0].size + buffers[0][1].size) * 2 / 2**20
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compression, pmt_chunks, sipm_chunks in settings:
+            try:
+                output_filters(compression)
+            except ValueError:
+                continue
+
+            file_name = os.path.join(tmpdir, 'buffers.h5')
+            with tb.open_file(file_name, 'w') as h5out:
+                writer = buffer_writer(h5out                        ,
+                                       n_sens_eng     =       n_pmt,
+                                       n_sens_trk     =      n_sipm,
+                                       length_eng     =     pmt_len,
+                                       length_trk     =    sipm_len,
+                                       compression    = compression,
+                                       detector_order =        True,
+                                       batch_size     =          10,
+                                       chunks_eng     =  pmt_chunks,
+                                       chunks_trk     = sipm_chunks)
+                t0 = perf_counter()
+                writer(0, list(range(n_buffers)), buffers)
+                writer.flush()
+                h5out.flush()
+                t_write = perf_counter() - t0
+
+            file_mb = os.path.getsize(file_name) / 2**20
+            key     = compression
+            if pmt_chunks is not None:
+                key = f'{compression} {pmt_chunks} {sipm_chunks}'
+            results[key] = (data_mb / t_write, data_mb / file_mb)
+    return results
+
+
+if __name__ == "__main__":
+    n_buffers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    settings  = tuple((c, None, None) for c in sys.argv[2:]) or default_settings
+    for name, (rate, ratio) in benchmark_compression(n_buffers, settings).items():
+        print(f"{name:>40}: {rate:8.1f} MB/s {ratio:8.1f} ratio")
@@ -0,0 +1,55 @@
+"""
+Ionisation, drift and diffusion of the hits of a
+MeV scale event with binned electron clouds against
+sampling every electron.
+
+usage: python detsim/benchmarks/drift.py [n_hits] [energy_mev]
+"""
+
+import sys
+
+import numpy as np
+
+from timeit import repeat
+
+from detsim.simulation.ionisation_functions import electron_clouds
+
+from invisible_cities.core.system_of_units_c import units
+
+
+def fake_hits(n_hits : int     ,
+              energy : float   ,
+              seed   : int = 0 ) -> tuple:
+    """
+    Hits of a track in the NEW active volume
+    sharing the energy equally.
+    """
+    rng = np.random.default_rng(seed)
+    x, y = np.cumsum(rng.normal(0, 1, (2, n_hits)), axis=1)
+    z    = rng.uniform(0, 500, n_hits)
+    return x, y, z, np.zeros(n_hits), np.full(n_hits, energy / n_hits)
+
+
+def benchmark_drift(n_hits   : int   =   300,
+                    energy   : float =   2.5,
+                    n_repeat : int   =     3) -> dict:
+    """
+    Best time in seconds and number of output
+    entries for binned clouds and single electrons.
+    """
+    hits    = fake_hits(n_hits, energy * units.MeV)
+    results = {}
+    for name, min_cloud in (('binned', 125), ('electrons', np.iinfo(int).max)):
+        clouds = electron_clouds(1 * units.mm / units.mus, 10 * units.ms,
+                                 1 * units.mm, 0.3 * units.mm, min_cloud = min_cloud)
+        rng    = np.random.default_rng(1)
+        t_best = min(repeat(lambda: clouds(*hits, rng), number = 1, repeat = n_repeat))
+        results[name] = t_best, len(clouds(*hits, rng)[0])
+    return results
+
+
+if __name__ == "__main__":
+    n_hits = int  (sys.argv[1]) if len(sys.argv) > 1 else 300
+    energy = float(sys.argv[2]) if len(sys.argv) > 2 else 2.5
+    for name, (t_best, n_out) in benchmark_drift(n_hits, energy).items():
+        print(f"{name:>10}: {t_best:8.3f} s, {n_out:10d} entries")
@@ -0,0 +1,82 @@
+"""
+Throughput of merge_buffers against a plain copy
+of the same files as reference for the disk bandwidth.
+
+usage: python detsim/benchmarks/merging.py [n_files] [n_buffers]
+"""
+
+import      os
+import     sys
+import  shutil
+import tempfile
+
+import numpy  as np
+import tables as tb
+
+from time import perf_counter
+
+from detsim.io.hdf5_io    import buffer_writer
+from detsim.io.hdf5_io    import save_run_info
+from detsim.merge_buffers import merge_buffers
+
+
+def fake_buffer_file(file_name: str        ,
+                     n_buffers: int        ,
+                     n_pmt    : int =    12,
+                     n_sipm   : int =  1792,
+                     pmt_len  : int = 32000,
+                     sipm_len : int =   800,
+                     seed     : int =     0) -> None:
+    """
+    Buffer file with low occupancy random buffers
+    in the layout written by position_signal.
+    """
+    rng = np.random.default_rng(seed)
+    with tb.open_file(file_name, 'w') as h5out:
+        save_run_info(h5out, -6400)
+        writer = buffer_writer(h5out, n_sens_eng=n_pmt, n_sens_trk=n_sipm,
+                               length_eng=pmt_len, length_trk=sipm_len,
+                               detector_order=True)
+        for evt in range(n_buffers):
+            pmts  = rng.poisson(0.05, ( n_pmt,  pmt_len))
+            sipms = rng.poisson(0.01, (n_sipm, sipm_len))
+            writer(evt, [0], [(pmts, sipms)])
+
+
+def benchmark_merging(n_files  : int = 8,
+                      n_buffers: int = 5) -> dict:
+    """
+    Seconds and MB/s (of input file size and of
+    uncompressed buffers) to merge n_files files
+    and to copy them with shutil.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files_in = [os.path.join(tmpdir, f'buffers_{i}.h5') for i in range(n_files)]
+        for i, file_name in enumerate(files_in):
+            fake_buffer_file(file_name, n_buffers, seed=i)
+        size_mb  = sum(os.path.getsize(f) for f in files_in) / 2**20
+        data_mb  = 0
+        for file_name in files_in:
+            with tb.open_file(file_name) as h5in:
+                data_mb += (h5in.root.pmtrd .size_in_memory +
+                            h5in.root.sipmrd.size_in_memory) / 2**20
+
+        t0 = perf_counter()
+        for i, file_name in enumerate(files_in):
+            shutil.copyfile(file_name, os.path.join(tmpdir, f'copy_{i}.h5'))
+        t_copy  = perf_counter() - t0
+
+        t0 = perf_counter()
+        merge_buffers(files_in, os.path.join(tmpdir, 'merged.h5'))
+        t_merge = perf_counter() - t0
+
+    return dict(copy  = (t_copy , size_mb / t_copy , data_mb / t_copy ),
+                merge = (t_merge, size_mb / t_merge, data_mb / t_merge))
+
+
+if __name__ == "__main__":
+    args    = [int(arg) for arg in sys.argv[1:3]]
+    timings = benchmark_merging(*args)
+    for name, (t, rate, data_rate) in timings.items():
+        print(f"{name:>6}: {t:8.3f} s {rate:8.1f} MB/s (file) "
+              f"{data_rate:8.1f} MB/s (buffers)")
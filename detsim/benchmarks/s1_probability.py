@@ -0,0 +1,112 @@
+"""
+S1 detection probability of each (hit, PMT) with the
+per hit scalar path, the batched matrix kernel and the
+interpolated lookup table, with the accuracy of the
+table against the direct evaluation.
+
+usage: python detsim/benchmarks/s1_probability.py [n_hits] [n_pmts]
+"""
+
+import      sys
+import tempfile
+
+import numpy as np
+
+from timeit import repeat
+
+from detsim.simulation.scintillation_functions import s1_detection_probability
+from detsim.simulation.scintillation_functions import    s1_probability_matrix
+from detsim.simulation.scintillation_functions import     s1_probability_table
+
+
+def fake_hits(n_hits : int     ,
+              n_pmts : int     ,
+              seed   : int = 0 ) -> tuple:
+    """
+    Random relative (r, phi) per (hit, PMT), hit z
+    and PMT rings for a NEW like detector.
+    """
+    rng  = np.random.default_rng(seed)
+    r    = rng.uniform(0,   400, (n_hits, n_pmts))
+    phi  = rng.uniform(0, np.pi, (n_hits, n_pmts))
+    z    = rng.uniform(0,   530, n_hits)
+    ring = np.arange(n_pmts) % 2
+    return r, phi, z, ring
+
+
+def fake_parameters(n_z : int = 4,
+                    n_r : int = 5,
+                    seed: int = 1) -> np.ndarray:
+    """
+    Smooth (ring, phi bin, z power, r power)
+    parametrisation falling with r and z, of
+    the order of the NEW PMT probabilities.
+    """
+    rng    = np.random.default_rng(seed)
+    scale  = (1 / 530.)**np.arange(n_z)[:, None] * (1 / 400.)**np.arange(n_r)
+    params = rng.normal(0, 2e-4, (2, 10, n_z, n_r)) * scale
+    params[..., 0, 0] += 1e-3
+    return params
+
+
+def benchmark_s1_probability(n_hits    : int =  100000,
+                             n_pmts    : int =      12,
+                             n_scalar  : int =    1000,
+                             n_repeat  : int =       3) -> dict:
+    """
+    Hits per second of the scalar path (timed on
+    n_scalar hits), of the batched kernel and of the
+    lookup table (built beforehand).
+    """
+    parameters = fake_parameters()
+    r, phi, z, ring = fake_hits(n_hits, n_pmts)
+
+    scalar_prob  = s1_detection_probability(11, parameters)
+    batched_prob = s1_probability_matrix   (11, parameters)
+
+    def scalar_loop():
+        for r_hit, phi_hit, z_hit in zip(r[:n_scalar], phi[:n_scalar], z[:n_scalar]):
+            scalar_prob(r_hit, phi_hit, np.full(n_pmts, z_hit), ring)
+
+    t_scalar  = min(repeat(scalar_loop, number = 1, repeat = n_repeat))
+    t_batched = min(repeat(lambda: batched_prob(r, phi, z, ring),
+                           number = 1, repeat = n_repeat))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        table_prob = s1_probability_table(11, parameters, 400, 530,
+                                          cache_dir = cache_dir)
+        t_table    = min(repeat(lambda: table_prob(r, phi, z, ring),
+                                number = 1, repeat = n_repeat))
+    return dict(scalar  = n_scalar / t_scalar ,
+                batched = n_hits   / t_batched,
+                table   = n_hits   / t_table  )
+
+
+def table_accuracy(n_hits : int = 100000,
+                   n_pmts : int =     12,
+                   n_r    : int =    401,
+                   n_z    : int =    401) -> dict:
+    """
+    Maximum absolute and relative difference of the
+    lookup table to the direct evaluation, relative
+    to the maximum probability.
+    """
+    parameters = fake_parameters()
+    r, phi, z, ring = fake_hits(n_hits, n_pmts, seed = 2)
+    direct = s1_probability_matrix(11, parameters)(r, phi, z, ring)
+    table  = s1_probability_table (11, parameters, 400, 530, n_r, n_z)(r, phi, z, ring)
+    diff   = np.abs(table - direct)
+    above  = direct > 1e-3 * direct.max()
+    rel    = diff[above] / direct[above]
+    return dict(max_abs  = diff.max(),
+                max_rel  =  rel.max(),
+                mean_rel =  rel.mean())
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    for name, rate in benchmark_s1_probability(*args).items():
+        print(f"{name:>8}: {rate:12.0f} hits/s")
+    for n_grid in (101, 401, 1001):
+        accuracy = table_accuracy(*args, n_r = n_grid, n_z = n_grid)
+        print(f"{n_grid:>4} x {n_grid:<4} grid: max abs {accuracy['max_abs']:.2e}, "
+              f"max rel {accuracy['max_rel']:.2e}, mean rel {accuracy['mean_rel']:.2e}")
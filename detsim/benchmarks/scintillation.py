@@ -0,0 +1,45 @@
+"""
+Photon emission time sampling: the np.random.choice
+partial of xenon_scintillation_time against the
+inverse CDF and the analytic mixture samplers.
+
+usage: python detsim/benchmarks/scintillation.py [n_photons]
+"""
+
+import sys
+
+import numpy as np
+
+from timeit import repeat
+
+from detsim.simulation.scintillation_functions import         inverse_cdf_sampler
+from detsim.simulation.scintillation_functions import          scintillation_time
+from detsim.simulation.scintillation_functions import xenon_scintillation_sampler
+from detsim.simulation.scintillation_functions import    xenon_scintillation_time
+
+
+def benchmark_samplers(n_photons : int = 10000000,
+                       n_repeat  : int =        3) -> dict:
+    """
+    Photons per second drawn by each sampler.
+    """
+    rng        = np.random.default_rng(0)
+    time_range = np.arange(500)
+    density    = scintillation_time(time_range, 0.1, 4.5, 0.9, 100)
+    samplers   = dict(choice      = xenon_scintillation_time(time_range)  ,
+                      inverse_cdf = inverse_cdf_sampler(time_range, density),
+                      analytic    = xenon_scintillation_sampler()         )
+    rates = {}
+    for name, sampler in samplers.items():
+        if name == 'choice':
+            draw = lambda: sampler(size = n_photons)
+        else:
+            draw = lambda: sampler(n_photons, rng)
+        rates[name] = n_photons / min(repeat(draw, number = 1, repeat = n_repeat))
+    return rates
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    for name, rate in benchmark_samplers(*args).items():
+        print(f"{name:>12}: {rate / 1e6:8.1f} M photons/s")
@@ -0,0 +1,68 @@
+"""
+Time to first event of the position_signal entry point:
+module imports, job setup (detector geometry, sensor
+binning and sample numbers) and first event read, each
+measured in a fresh interpreter as a grid job would run.
+The setup is timed without disk cache and then with a
+cold and a warm setup_cache directory.
+
+usage: python detsim/benchmarks/startup.py file.sim.h5 [detector_db] [run_number]
+"""
+
+import         sys
+import        json
+import    tempfile
+import  subprocess
+
+job_script = """
+import json, sys
+from time import perf_counter
+t0 = perf_counter()
+from detsim.position_signal import job_setup
+from detsim.io.hdf5_io      import load_sensors
+t1 = perf_counter()
+file_name, detector_db, run_number, cache_dir = sys.argv[1:]
+job_setup(detector_db, int(run_number), file_name, 800, cache_dir or None)
+t2 = perf_counter()
+next(load_sensors([file_name], detector_db, int(run_number)))
+t3 = perf_counter()
+print(json.dumps(dict(imports=t1 - t0, setup=t2 - t1, first_event=t3 - t2)))
+"""
+
+
+def time_to_first_event(file_name  : str       ,
+                        detector_db: str       ,
+                        run_number : int       ,
+                        cache_dir  : str = None) -> dict:
+    """
+    Seconds spent in the imports, the job setup and
+    the first event read by a new python process.
+    """
+    result = subprocess.run([sys.executable, '-c', job_script,
+                             file_name, detector_db, str(run_number),
+                             cache_dir or ''],
+                            capture_output=True, check=True, text=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def benchmark_startup(file_name  : str        ,
+                      detector_db: str = 'new',
+                      run_number : int = -6400) -> dict:
+    results = {}
+    results['no cache'] = time_to_first_event(file_name, detector_db, run_number)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in ('cold cache', 'warm cache'):
+            results[name] = time_to_first_event(file_name, detector_db,
+                                                run_number, cache_dir)
+    return results
+
+
+if __name__ == "__main__":
+    file_name   = sys.argv[1]
+    detector_db = sys.argv[2] if len(sys.argv) > 2 else 'new'
+    run_number  = int(sys.argv[3]) if len(sys.argv) > 3 else -6400
+    for name, times in benchmark_startup(file_name, detector_db, run_number).items():
+        total = sum(times.values())
+        print(f"{name:>10}: imports {times['imports']:6.3f} s, "
+              f"setup {times['setup']:6.3f} s, "
+              f"first event {times['first_event']:6.3f} s, total {total:6.3f} s")
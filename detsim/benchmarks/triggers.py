@@ -0,0 +1,54 @@
+"""
+Throughput of the trigger algorithms of signal_finder
+on the (n_pmt, n_bins) binned PMT waveforms.
+
+usage: python detsim/benchmarks/triggers.py [n_pmts] [n_bins]
+"""
+
+import sys
+
+import numpy as np
+
+from timeit import repeat
+
+from detsim.simulation.buffer_functions import      signal_finder
+from detsim.simulation.buffer_functions import trigger_algorithms
+
+
+def fake_pmt_waveforms(n_pmts: int     ,
+                       n_bins: int     ,
+                       seed  : int = 0 ) -> np.ndarray:
+    """
+    Random binned PMT waveforms with a low
+    rate of single pe bins.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.poisson(0.05, (n_pmts, n_bins))
+
+
+def benchmark_triggers(n_pmts   : int   =       12,
+                       n_bins   : int   = 10000000,
+                       bin_width: float =     25.0,
+                       window   : float =    250.0,
+                       n_repeat : int   =        3) -> dict:
+    """
+    Best time in seconds for each trigger
+    algorithm on one fake event.
+    """
+    wfs     = fake_pmt_waveforms(n_pmts, n_bins)
+    timings = {}
+    for name in trigger_algorithms:
+        find_signal   = signal_finder(800, bin_width, 2, name,
+                                      window        = window,
+                                      n_coincidence =      3)
+        timings[name] = min(repeat(lambda: find_signal(wfs),
+                                   number = 1, repeat = n_repeat))
+    return timings
+
+
+if __name__ == "__main__":
+    args           = [int(arg) for arg in sys.argv[1:3]]
+    n_pmts, n_bins = args + [12, 10000000][len(args):]
+    timings        = benchmark_triggers(n_pmts, n_bins)
+    for name, t in timings.items():
+        print(f"{name:>12}: {t:8.4f} s {n_pmts * n_bins / t / 1e6:8.1f} Mbin/s")
@@ -1,18 +1,24 @@
+import        os
+import      json
+import   hashlib
+import posixpath
+
 import numpy  as np
 import pandas as pd
 import tables as tb
 
-from functools import     wraps
+from itertools import    islice
+from itertools import   product
 from typing    import  Callable
 from typing    import Generator
 from typing    import     Tuple
 from typing    import      List
+from typing    import NamedTuple
+from typing    import   Optional
 
-from invisible_cities.database           import                   load_db as  DB
-from invisible_cities.io      .mcinfo_io import load_mcsensor_response_df
-from invisible_cities.io      .mcinfo_io import            read_mchits_df
-from invisible_cities.io      .rwf_io    import                rwf_writer
-from invisible_cities.reco               import             tbl_functions as tbl
+from detsim.simulation.buffer_functions  import           SparseWaveforms
+from detsim.util      .util              import         detector_geometry
+from detsim.util      .util              import                 id_lookup
 
 
 class EventInfo(tb.IsDescription):
@@ -64,6 +70,56 @@ def save_run_info(h5out     : tb.file.File,
     row.append()
 
 
+class FileInfo(NamedTuple):
+    """
+    Event level information of a nexus file
+    read in one pass by file_info.
+    """
+    evt_numbers: np.ndarray
+    extents    : np.ndarray
+    timestamps : np.ndarray
+    mc_info    : Tuple
+
+
+def first_hit_times(h5in   : tb.file.File,
+                    extents:   np.ndarray) -> np.ndarray:
+    """
+    Time of the first hit of each event, read
+    with one fancy-indexed read of the hits.
+
+    h5in    : pytables file
+              The input nexus hdf5 file.
+    extents : np.ndarray
+              The MC/extents table of the file
+    """
+    if len(extents) == 0:
+        return np.zeros(0)
+    # The extents table saves the last hit index for each
+    # event, we need the first so +1
+    first_hits = np.concatenate(([0], extents['last_hit'][:-1].astype(int) + 1))
+    hits       = h5in.root.MC.hits.read_coordinates(first_hits)
+    return hits[hits.dtype.names[2]]
+
+
+def file_info(h5in: tb.file.File) -> FileInfo:
+    """
+    Reads the extents, the event timestamps
+    (the first hit times) and the MC info of
+    the file in one pass so that the per event
+    loops do not need further small reads.
+
+    h5in : pytables file
+           The input nexus hdf5 file.
+    """
+    from invisible_cities.reco import tbl_functions as tbl
+
+    extents = h5in.root.MC.extents.read()
+    return FileInfo(evt_numbers = extents['evt_number']         ,
+                    extents     = extents                       ,
+                    timestamps  = first_hit_times(h5in, extents),
+                    mc_info     = tbl.get_mc_info(h5in)         )
+
+
 def event_timestamp(h5in: tb.file.File) -> Callable:
     """
     Returns a function iterator giving access
@@ -73,53 +129,201 @@ def event_timestamp(h5in: tb.file.File) -> Callable:
     required by the IC cities.
     Generally set to zero in nexus but here for
     completeness.
+    The times are read for all events at once.
 
     h5in : pytables file
            The input nexus hdf5 file.
     """
 
-    # The extents table saves the last hit index for each
-    # event, we need the first so +1
-    hit_indx   = (int(ext[2] + 1) for ext in h5in.root.MC.extents[:-1])
-    first_hits = iter([0] + list(hit_indx))
-    max_iter   = len(h5in.root.MC.extents)
+    timestamps = first_hit_times(h5in, h5in.root.MC.extents.read())
+    max_iter   = len(timestamps)
     def get_evt_timestamp() -> float:
         get_evt_timestamp.counter += 1
         if get_evt_timestamp.counter > max_iter:
             raise IndexError('No more events')
-        return h5in.root.MC.hits[next(first_hits)][2]
+        return timestamps[get_evt_timestamp.counter - 1]
     get_evt_timestamp.counter = 0
     return get_evt_timestamp
 
 
-@wraps(rwf_writer)
+def output_filters(compression: str) -> tb.Filters:
+    """
+    Filters for the output from the IC compression
+    names ('ZLIB4', 'BLOSC5', ...) or '<complib>-<level>'
+    for any codec available in pytables, for example
+    'blosc:zstd-5' or 'blosc2:lz4-1' (with shuffle).
+    """
+    if '-' not in compression:
+        from invisible_cities.reco import tbl_functions as tbl
+        return tbl.filters(compression)
+
+    complib, level = compression.rsplit('-', 1)
+    if (complib not in tb.filters.all_complibs or
+        tb.which_lib_version(complib.split(':')[0]) is None):
+        raise ValueError(f"Compression library {complib} not available, "
+                         f"options are {tb.filters.all_complibs}")
+    return tb.Filters(complib=complib, complevel=int(level), shuffle=True)
+
+
+def buffer_group(h5out: tb.file.File, group_name: str) -> tb.Group:
+    """
+    Group for the buffers as in the IC rwf_writer,
+    the root group if group_name is None.
+    """
+    if group_name is None:
+        return h5out.root
+    try:
+        return getattr(h5out.root, group_name)
+    except tb.NoSuchNodeError:
+        return h5out.create_group(h5out.root, group_name)
+
+
+def buffer_array(h5out          : tb.file.File       ,
+                 group_name     :          str       ,
+                 table_name     :          str       ,
+                 compression    :          str       ,
+                 n_sensors      :          int       ,
+                 waveform_length:          int       ,
+                 sample_dtype   :          str       ,
+                 chunkshape     :        Tuple = None) -> tb.EArray:
+    """
+    Creates the (event, sensor, sample) EArray
+    for the buffers of one sensor type, in the
+    layout of the IC rwf_writer, with samples
+    of type sample_dtype. The chunkshape is
+    chosen by pytables if None.
+    """
+    return h5out.create_earray(buffer_group(h5out, group_name), table_name,
+                               atom       = tb.Atom.from_dtype(np.dtype(sample_dtype)),
+                               shape      = (0, n_sensors, waveform_length),
+                               filters    = output_filters(compression),
+                               chunkshape = chunkshape)
+
+
+def zs_buffer_arrays(h5out          : tb.file.File       ,
+                     group_name     :          str       ,
+                     compression    :          str       ,
+                     sensor_ids     :   np.ndarray       ,
+                     waveform_length:          int       ,
+                     sample_dtype   :          str       ,
+                     chunkshape     :        Tuple = None) -> Tuple:
+    """
+    Creates the zero suppressed tracking buffer
+    arrays in the group sipmrd_zs:
+    sensors    : SensorID of each sensor
+                 with charge in the buffer
+    samples    : (sensor, sample) waveforms of those sensors
+    counts     : number of sensors stored for each buffer
+    sensor_ids : SensorID of each detector order row
+                 of the dense buffers
+    The total number of sensors is saved as the
+    n_sensors attribute of sensors. The chunkshape,
+    if given, is that of the (sensor, sample) samples.
+    """
+    filters = output_filters(compression)
+    group   = h5out.create_group(buffer_group(h5out, group_name), 'sipmrd_zs')
+    h5out.create_array(group, 'sensor_ids', np.asarray(sensor_ids, np.int32))
+    sensors = h5out.create_earray(group, 'sensors', atom = tb.Int32Atom(),
+                                  shape = (0,), filters = filters)
+    samples = h5out.create_earray(group, 'samples',
+                                  atom       = tb.Atom.from_dtype(np.dtype(sample_dtype)),
+                                  shape      = (0, waveform_length),
+                                  filters    = filters,
+                                  chunkshape = chunkshape)
+    counts  = h5out.create_earray(group, 'counts' , atom = tb.Int32Atom(),
+                                  shape = (0,), filters = filters)
+    sensors.attrs.n_sensors = len(sensor_ids)
+    return sensors, samples, counts
+
+
+def zs_buffer_reader(h5in      : tb.file.File,
+                     group_name:          str = None) -> Callable[[int], np.ndarray]:
+    """
+    Returns a function giving the dense
+    (n_sensors, n_samples) tracking buffer
+    of written buffer number i from the zero
+    suppressed arrays of zs_buffer_arrays, the
+    rows in the order of sipmrd_zs/sensor_ids.
+    The function's n_buffers attribute gives
+    the number of buffers in the file.
+    """
+    group   = h5in.root if group_name is None else getattr(h5in.root, group_name)
+    sensors = group.sipmrd_zs.sensors
+    samples = group.sipmrd_zs.samples
+    offsets = np.concatenate(([0], np.cumsum(group.sipmrd_zs.counts.read())))
+    rows    = id_lookup(group.sipmrd_zs.sensor_ids.read())
+    shape   = (sensors.attrs.n_sensors, samples.shape[1])
+    def read_buffer(i: int) -> np.ndarray:
+        first, last = offsets[i], offsets[i + 1]
+        buffer      = np.zeros(shape, samples.dtype)
+        buffer[rows[sensors[first:last]]] = samples[first:last]
+        return buffer
+    read_buffer.n_buffers = len(offsets) - 1
+    return read_buffer
+
+
+def check_sample_range(buffers: np.ndarray, sample_dtype: str) -> None:
+    """
+    Raises ValueError if the buffer samples
+    do not fit in sample_dtype.
+    """
+    limits = np.iinfo(sample_dtype)
+    if buffers.size and (buffers.min() < limits.min or buffers.max() > limits.max):
+        raise ValueError(f"Buffer samples in [{buffers.min()}, {buffers.max()}] "
+                         f"overflow {sample_dtype}")
+
+
 def buffer_writer(h5out, *,
-                  n_sens_eng : int           ,
-                  n_sens_trk : int           ,
-                  length_eng : int           ,
-                  length_trk : int           ,
-                  group_name : str =     None,
-                  compression: str =  'ZLIB4') -> Callable[[int, List, List, List], None]:
+                  n_sens_eng    :        int           ,
+                  n_sens_trk    :        int           ,
+                  length_eng    :        int           ,
+                  length_trk    :        int           ,
+                  group_name    :        str =     None,
+                  compression   :        str =  'ZLIB4',
+                  detector_order:       bool =    False,
+                  batch_size    :        int =        1,
+                  sample_dtype  :        str =  'int16',
+                  zs_trk        :       bool =    False,
+                  trk_ids       : np.ndarray =     None,
+                  chunks_eng    :      Tuple =     None,
+                  chunks_trk    :      Tuple =     None) -> Callable[[int, List, List, List], None]:
     """
     Generalised buffer writer which defines a raw waveform writer
     for each type of sensor as well as an event info writer
     with written event, timestamp and a mapping to the
     nexus event number in case of event splitting.
+    Tracking buffers given as SparseWaveforms are
+    only expanded when filling the output buffer.
+    With detector_order the buffers are expected as
+    full detector arrays (as given by calculate_buffers
+    with the number of sensors) and are appended as they
+    are, the writer then takes (nexus_evt, timestamps, events).
+    The buffers are stored as sample_dtype, raising ValueError
+    on overflow, and appended batch_size at a time. With
+    batch_size > 1 the writer's flush() must be called after
+    the last event to write the incomplete batch.
+    With zs_trk the tracking buffers are written zero
+    suppressed with zs_buffer_arrays instead of sipmrd,
+    trk_ids giving the SensorID of each detector order
+    row of the tracking buffers (required with zs_trk).
+    The compression can be any of output_filters and
+    chunks_eng and chunks_trk set the chunkshape of the
+    buffer arrays (pytables default if None).
     """
 
-    eng_writer = rwf_writer(h5out,
-                            group_name      =  group_name,
-                            compression     = compression,
-                            table_name      =     'pmtrd',
-                            n_sensors       =  n_sens_eng,
-                            waveform_length =  length_eng)
-
-    trk_writer = rwf_writer(h5out,
-                            group_name      =  group_name,
-                            compression     = compression,
-                            table_name      =    'sipmrd',
-                            n_sensors       =  n_sens_trk,
-                            waveform_length =  length_trk)
+    eng_array = buffer_array(h5out, group_name, 'pmtrd' , compression,
+                             n_sens_eng, length_eng, sample_dtype, chunks_eng)
+    if zs_trk:
+        if trk_ids is None or len(trk_ids) != n_sens_trk:
+            raise ValueError("zs_trk needs the SensorID of each of the "
+                             f"{n_sens_trk} tracking sensors as trk_ids")
+        trk_sns, trk_array, trk_counts = zs_buffer_arrays(h5out, group_name,
+                                                          compression,
+                                                          trk_ids, length_trk,
+                                                          sample_dtype, chunks_trk)
+    else:
+        trk_array = buffer_array(h5out, group_name, 'sipmrd', compression,
+                                 n_sens_trk, length_trk, sample_dtype, chunks_trk)
 
     try:
         evt_group = getattr(h5out.root, 'Run')
@@ -129,7 +333,49 @@ def buffer_writer(h5out, *,
     nexus_evt_tbl = h5out.create_table(evt_group, "events", EventInfo,
                                        "event, timestamp & nexus evt \
                                        for each index",
-                                       tbl.filters(compression))
+                                       output_filters(compression))
+
+    eng_batch = np.zeros((batch_size, n_sens_eng, length_eng), sample_dtype)
+    trk_batch = np.zeros((batch_size, n_sens_trk, length_trk), sample_dtype)
+    evt_batch = []
+
+    def flush() -> None:
+        n_evt = len(evt_batch)
+        if n_evt == 0:
+            return
+        nexus_evt_tbl.append(evt_batch)
+        eng_array    .append(eng_batch[:n_evt])
+        if zs_trk:
+            evt_indx, sns_indx = np.nonzero(trk_batch[:n_evt].any(axis=2))
+            trk_sns   .append(np.asarray(trk_ids)[sns_indx])
+            trk_array .append(trk_batch[evt_indx, sns_indx])
+            trk_counts.append(np.bincount(evt_indx, minlength=n_evt))
+        else:
+            trk_array .append(trk_batch[:n_evt])
+        evt_batch.clear()
+
+    def write_event(nexus_evt: int       ,
+                    t_stamp  : int       ,
+                    eng      : np.ndarray,
+                    trk      : np.ndarray) -> None:
+        check_sample_range(eng, sample_dtype)
+        check_sample_range(trk, sample_dtype)
+
+        eng_batch[len(evt_batch)] = eng
+        trk_batch[len(evt_batch)] = trk
+        evt_batch.append((write_event.counter, t_stamp, nexus_evt))
+        if len(evt_batch) == batch_size:
+            flush()
+
+        write_event.counter += 1
+    write_event.counter = 0
+
+    def write_ordered_buffers(nexus_evt : int        ,
+                              timestamps: List[  int],
+                              events    : List[Tuple]) -> None:
+
+        for t_stamp, (eng, trk) in zip(timestamps, events):
+            write_event(nexus_evt, t_stamp, eng, trk)
 
     def write_buffers(nexus_evt     :        int ,
                       eng_sens_order: List[  int],
@@ -138,33 +384,355 @@ def buffer_writer(h5out, *,
                       events        : List[Tuple]) -> None:
 
         for t_stamp, (eng, trk) in zip(timestamps, events):
-            row = nexus_evt_tbl.row
-            row["event_number"] = write_buffers.counter
-            row["timestamp"]    = t_stamp
-            row["nexus_evt"]    = nexus_evt
-            row.append()
-
-            e_sens = np.zeros((n_sens_eng, length_eng), np.int)
-            t_sens = np.zeros((n_sens_trk, length_trk), np.int)
+            e_sens = np.zeros((n_sens_eng, length_eng), int)
+            t_sens = np.zeros((n_sens_trk, length_trk), int)
 
             e_sens[eng_sens_order] = eng
-            eng_writer(e_sens)
+            if isinstance(trk, SparseWaveforms):
+                trk.to_dense(out=t_sens, rows=trk_sens_order)
+            else:
+                t_sens[trk_sens_order] = trk
+
+            write_event(nexus_evt, t_stamp, e_sens, t_sens)
+
+    writer       = write_ordered_buffers if detector_order else write_buffers
+    writer.flush = flush
+    return writer
+
+
+## Columns of MC/extents with the last row
+## of each event in the other MC tables
+extent_tables = dict(last_hit      =      'hits',
+                     last_particle = 'particles',
+                     last_sns_data = 'waveforms')
+
+## MC tables copied by copy_mc_info, those of
+## mc_info_writer, the sensor waveforms being
+## left in the nexus files
+mc_info_tables = dict(last_hit      =      'hits',
+                      last_particle = 'particles')
+
+
+def check_buffer_shapes(file_names: List[str]) -> None:
+    """
+    Checks that the buffer arrays of all the files
+    have the same number of sensors and samples
+    and the same sample type. The zero suppressed
+    arrays are checked for the same n_sensors.
+    """
+    shapes = {}
+    for file_name in file_names:
+        with tb.open_file(file_name, 'r') as h5in:
+            for node in h5in.walk_nodes('/', classname='EArray'):
+                layout = (node.shape[1:], node.dtype,
+                          getattr(node.attrs, 'n_sensors', None))
+                shape  = shapes.setdefault(node._v_pathname, layout)
+                if layout != shape:
+                    raise ValueError(f"{file_name}: {node._v_pathname} with "
+                                     f"(sensors, samples), type and n_sensors {layout}, "
+                                     f"expected {shape}")
+
+
+def copy_raw_chunks(node_in: tb.Leaf, node_out: tb.Leaf) -> bool:
+    """
+    Appends node_in to node_out copying the stored
+    chunks without decompressing them when pytables
+    has direct chunk access (pytables >= 3.10), both
+    nodes have the same filters and chunkshape and
+    node_out ends on a chunk boundary.
+    Returns whether the rows were copied.
+    """
+    chunk_rows = node_in.chunkshape[0]
+    if not (hasattr(node_in, 'read_chunk')               and
+            node_in.filters    == node_out.filters       and
+            node_in.chunkshape == node_out.chunkshape    and
+            node_out.nrows % chunk_rows == 0             ):
+        return False
+
+    first_row  = node_out.nrows
+    node_out.truncate(first_row + node_in.nrows)
+    chunk_grid = [range(0, n, c) for n, c in zip(node_in.shape[1:],
+                                                 node_in.chunkshape[1:])]
+    for row in range(0, node_in.nrows, chunk_rows):
+        for coords in product(*chunk_grid):
+            info = node_in.chunk_info((row,) + coords)
+            if info.offset is None:
+                ## Chunk never written, nothing to copy
+                continue
+            node_out.write_chunk((first_row + row,) + coords,
+                                 node_in.read_chunk((row,) + coords),
+                                 info.filter_mask)
+    return True
+
+
+def append_rows(node_in    : tb.Leaf,
+                node_out   : tb.Leaf,
+                buffer_size:     int,
+                offsets    :    dict) -> None:
+    """
+    Appends the rows of node_in to node_out adding
+    the offsets to the given columns. The stored
+    chunks are copied as they are if possible,
+    otherwise the rows are read and appended in
+    blocks of whole chunks of about buffer_size bytes.
+    """
+    if not offsets and copy_raw_chunks(node_in, node_out):
+        return
 
-            t_sens[trk_sens_order] = trk
-            trk_writer(t_sens)
+    chunk_rows = node_in.chunkshape[0]
+    step       = max(1, buffer_size // (node_in.rowsize * chunk_rows)) * chunk_rows
+    for start in range(0, node_in.nrows, step):
+        rows = node_in.read(start, start + step)
+        for col, offset in offsets.items():
+            rows[col] += offset
+        node_out.append(rows)
 
-            write_buffers.counter += 1
-    write_buffers.counter = 0
-    return write_buffers
 
+def output_parent(h5out: tb.file.File, node: tb.Leaf) -> tb.Group:
+    """
+    Group of h5out with the path of the
+    parent of node, created if needed.
+    """
+    path = node._v_parent._v_pathname
+    if path not in h5out:
+        h5out.create_group(*posixpath.split(path), createparents=True)
+    return h5out.get_node(path)
+
+
+def merge_buffer_files(file_names : List[str]             ,
+                       h5out      : tb.file.File          ,
+                       buffer_size:          int = 2**26  ,
+                       filters    :   tb.Filters =   None ) -> None:
+    """
+    Merges detsim buffer files, as written by
+    position_signal, into h5out in the given order.
+    The buffers, the Run/events rows (with the
+    event_number continuing the numbering), the
+    per event MC tables (with the extents pointing
+    to the merged rows) and any other table with an
+    evt_number column are appended by append_rows.
+    The remaining nodes are job constants, like
+    Run/runInfo, and are copied from the first file.
+
+    file_names  : List of strings
+                  The buffer files in merging order
+    h5out       : pytables file
+                  The open output file
+    buffer_size : int
+                  Approximate bytes read and appended at a time
+                  when the chunks can not be copied directly
+    filters     : tb.Filters
+                  Filters of the merged nodes, those of the
+                  first file if None
+    """
+    check_buffer_shapes(file_names)
+    mc_tables = ['/MC/' + name for name in extent_tables.values()]
+    copy_args = {} if filters is None else dict(filters = filters)
+    for file_name in file_names:
+        with tb.open_file(file_name, 'r') as h5in:
 
-def load_sensors(file_names: List[str],
-                 db_file   :      str ,
-                 run_no    :      int ) -> Generator:
+            evt_offset = 0
+            if '/Run/events' in h5out:
+                evt_offset = h5out.root.Run.events.nrows
+            row_offset = {col: h5out.get_node('/MC', name).nrows
+                          for col, name in extent_tables.items()
+                          if '/MC/' + name in h5out}
+            for node in h5in.walk_nodes('/', classname='Leaf'):
+                path = node._v_pathname
+                if   path == '/Run/events':
+                    offsets = dict(event_number = evt_offset)
+                elif path == '/MC/extents':
+                    offsets = row_offset
+                elif (isinstance(node, tb.EArray) or path in mc_tables or
+                      (isinstance(node, tb.Table) and 'evt_number' in node.colnames)):
+                    offsets = {}
+                elif path not in h5out:
+                    node._f_copy(output_parent(h5out, node), **copy_args)
+                    continue
+                else:
+                    continue
+
+                if path not in h5out:
+                    node._f_copy(output_parent(h5out, node), stop=0, **copy_args)
+                append_rows(node, h5out.get_node(path), buffer_size, offsets)
+            h5out.flush()
+
+
+def copy_mc_info(file_names: List[str]   ,
+                 h5out     : tb.file.File,
+                 evt_mask  :   np.ndarray) -> None:
+    """
+    Copies the MC info of the events of the files
+    with True in evt_mask (one entry per event of
+    all the files in order) into h5out with one
+    bulk read and append per table and file.
+    The tables written by mc_info_writer are copied:
+    the extents, the hits and particles of the events
+    (with the extents pointing to the copied rows) and
+    the generators rows of the events. The MC of the
+    events with False in evt_mask is not written.
+    Raises ValueError if evt_mask does not have one
+    entry per MC/extents row of the files.
+
+    file_names : List of strings
+                 The nexus input files in order
+    h5out      : pytables file
+                 The open output file
+    evt_mask   : np.ndarray
+                 Events to be kept, for example
+                 those with at least one buffer
+    """
+    evt_mask = np.asarray(evt_mask, bool)
+    n_evts   = 0
+    for file_name in file_names:
+        with tb.open_file(file_name, 'r') as h5in:
+            n_evts += h5in.root.MC.extents.nrows
+    if len(evt_mask) != n_evts:
+        raise ValueError(f"evt_mask has {len(evt_mask)} entries"
+                         f" for {n_evts} MC/extents rows")
+
+    first_evt = 0
+    for file_name in file_names:
+        with tb.open_file(file_name, 'r') as h5in:
+            extents    = h5in.root.MC.extents.read()
+            mask       = evt_mask[first_evt:first_evt + len(extents)]
+            first_evt += len(extents)
+
+            for col, table in mc_info_tables.items():
+                if col not in extents.dtype.names or '/MC/' + table not in h5in:
+                    continue
+                node     = h5in.get_node('/MC', table)
+                row_ends = extents[col].astype(int) + 1
+                n_rows   = np.diff(np.concatenate(([0], row_ends)))
+                if node._v_pathname not in h5out:
+                    node._f_copy(output_parent(h5out, node), stop=0)
+                node_out = h5out.get_node(node._v_pathname)
+
+                rows = node.read(stop=row_ends[-1] if len(row_ends) else 0)
+                rows = rows[np.repeat(mask, n_rows)]
+                extents[col][mask] = node_out.nrows + np.cumsum(n_rows[mask]) - 1
+                node_out.append(rows)
+
+            if '/MC/generators' in h5in:
+                node = h5in.root.MC.generators
+                if node._v_pathname not in h5out:
+                    node._f_copy(output_parent(h5out, node), stop=0)
+                rows = node.read()
+                h5out.root.MC.generators.append(
+                    rows[np.isin(rows['evt_number'], extents['evt_number'][mask])])
+
+            if '/MC/extents' not in h5out:
+                h5in.root.MC.extents._f_copy(output_parent(h5out, h5in.root.MC.extents),
+                                            stop=0)
+            h5out.root.MC.extents.append(extents[mask])
+    h5out.flush()
+
+
+def event_sensor_response(h5in       : tb.file.File,
+                          extents    :   np.ndarray,
+                          pmt_ids    :   np.ndarray,
+                          pmt_binwid :        float,
+                          sipm_binwid:        float,
+                          chunk_size :          int) -> Generator:
+    """
+    Reads the nexus sensor response (MC/waveforms)
+    in chunks of whole events of about chunk_size
+    rows using the row ranges in MC/extents.
+    The rows of each chunk are split into PMTs and
+    SiPMs once and (evt, pmt_wfs, sipm_wfs) are
+    yielded event by event with the waveforms as
+    DataFrames of time and charge indexed by sensor_id.
+
+    h5in        : pytables file
+                  The input nexus hdf5 file
+    extents     : np.ndarray
+                  The MC/extents table of the file
+    pmt_ids     : np.ndarray
+                  Sensor ids of the PMTs
+    pmt_binwid  : float
+                  Sampling width of the PMTs
+    sipm_binwid : float
+                  Sampling width of the SiPMs
+    chunk_size  : int
+                  Rows to be read at a time, an event
+                  with more rows is read on its own
+    """
+    evt_nums = extents['evt_number']
+    row_ends = extents['last_sns_data'].astype(int) + 1
+    row_ini  = np.concatenate(([0], row_ends[:-1]))
+
+    first = 0
+    while first < len(evt_nums):
+        last     = max(first + 1,
+                       np.searchsorted(row_ends, row_ini[first] + chunk_size, 'right'))
+        rows     = h5in.root.MC.waveforms.read(row_ini[first], row_ends[last - 1])
+
+        ids      = rows['sensor_id']
+        is_pmt   = np.isin(ids, pmt_ids)
+        times    = rows['time_bin'] * np.where(is_pmt, pmt_binwid, sipm_binwid)
+        sensors  = pd.DataFrame(dict(time = times, charge = rows['charge']),
+                                index = pd.Index(ids, name = 'sensor_id'))
+        pmts     = sensors[ is_pmt]
+        sipms    = sensors[~is_pmt]
+
+        ## Event limits in the chunk for each sensor type
+        bounds   = np.concatenate(([0], row_ends[first:last] - row_ini[first]))
+        pmt_lim  = np.concatenate(([0], np.cumsum(is_pmt)))[bounds]
+        sipm_lim = bounds - pmt_lim
+        for i, evt in enumerate(evt_nums[first:last]):
+            yield (evt,
+                   pmts .iloc[ pmt_lim[i]: pmt_lim[i + 1]],
+                   sipms.iloc[sipm_lim[i]:sipm_lim[i + 1]])
+        first = last
+
+
+def sensor_binning(file_name: str          ,
+                   cache_dir: Optional[str] = None) -> Tuple[float, float]:
+    """
+    (pmt, sipm) bin widths of the sensor response of
+    file_name. With cache_dir they are saved to and
+    read from a small json file there, keyed by the
+    path, size and modification time of the file, so
+    that repeated jobs do not parse the configuration.
+
+    file_name : str
+                nexus full simulation file
+    cache_dir : str
+                Directory of the cache files, no cache if None
     """
-    Loads the nexus MC sensor information into
-    a pandas DataFrame using the IC function
-    load_mcsensor_response_df.
+    from invisible_cities.io.mcinfo_io import get_sensor_binning
+
+    if cache_dir is None:
+        return get_sensor_binning(file_name)
+
+    stat       = os.stat(file_name)
+    file_key   = f'{os.path.abspath(file_name)}:{stat.st_size}:{stat.st_mtime_ns}'
+    cache_file = os.path.join(cache_dir, 'binning_' +
+                              hashlib.sha1(file_key.encode()).hexdigest() + '.json')
+    if os.path.exists(cache_file):
+        with open(cache_file) as cached:
+            return tuple(json.load(cached))
+
+    binning  = tuple(float(width) for width in get_sensor_binning(file_name))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f'{cache_file}.{os.getpid()}'
+    with open(tmp_file, 'w') as cache:
+        json.dump(binning, cache)
+    os.replace(tmp_file, cache_file)
+    return binning
+
+
+def load_sensors(file_names:     List[str]        ,
+                 db_file   :          str         ,
+                 run_no    :          int         ,
+                 chunk_size:          int = 100000,
+                 cache_dir : Optional[str] =   None) -> Generator:
+    """
+    Loads the nexus MC sensor information
+    event by event, reading the rows of
+    about chunk_size sensor samples at a time
+    with event_sensor_response so that memory
+    does not depend on the file size.
     Returns info event by event in as a
     generator in the structure expected by
     the dataflow.
@@ -175,65 +743,122 @@ def load_sensors(file_names: List[str],
                  Name of detector database to be used
     run_no     : int
                  Run number for database
+    chunk_size : int
+                 Sensor response rows read at a time
+    cache_dir  : str
+                 Directory of the geometry and binning caches
     """
 
-    pmt_ids  = DB.DataPMT (db_file, run_no).SensorID
-    sipm_ids = DB.DataSiPM(db_file, run_no).SensorID
+    pmt_ids = detector_geometry(db_file, run_no, cache_dir).pmt_ids
 
     for file_name in file_names:
 
-        (all_evt    ,
-         pmt_binwid ,
-         sipm_binwid,
-         all_wf     ) = load_mcsensor_response_df(file_name, db_file, run_no)
+        pmt_binwid, sipm_binwid = sensor_binning(file_name, cache_dir)
 
         with tb.open_file(file_name, 'r') as h5in:
 
-            mc_info = tbl.get_mc_info(h5in)
-
-            timestamps = event_timestamp(h5in)
+            info    = file_info(h5in)
+            evt_wfs = event_sensor_response(h5in, info.extents,
+                                            pmt_ids, pmt_binwid,
+                                            sipm_binwid, chunk_size)
 
-            for evt in all_evt:
-
-                pmt_wfs  = all_wf.loc[evt].loc[ pmt_ids]
-                sipm_wfs = all_wf.loc[evt].loc[sipm_ids]
+            for timestamp, (evt, pmt_wfs, sipm_wfs) in zip(info.timestamps, evt_wfs):
 
                 yield dict(evt         = evt         ,
-                           mc          = mc_info     ,
-                           timestamp   = timestamps(),
+                           mc          = info.mc_info,
+                           timestamp   = timestamp   ,
                            pmt_binwid  = pmt_binwid  ,
                            sipm_binwid = sipm_binwid ,
                            pmt_wfs     = pmt_wfs     ,
                            sipm_wfs    = sipm_wfs    )
 
 
+def load_sensor_blocks(file_names:     List[str]        ,
+                       db_file   :          str         ,
+                       run_no    :          int         ,
+                       batch_size:          int         ,
+                       chunk_size:          int = 100000,
+                       cache_dir : Optional[str] =   None) -> Generator:
+    """
+    As load_sensors but yielding blocks of up
+    to batch_size events of the same file so
+    that they can be binned together. The events
+    are read with event_sensor_response, about
+    chunk_size rows at a time, so that memory
+    depends on the block and chunk sizes and not
+    on the file size.
+    The waveforms of the block are DataFrames
+    indexed by (evt, sensor_id) and evt and
+    timestamp are arrays with one entry per event.
+
+    file_names : List of strings
+                 List of input file names to be read
+    db_file    : string
+                 Name of detector database to be used
+    run_no     : int
+                 Run number for database
+    batch_size : int
+                 Maximum number of events per block
+    chunk_size : int
+                 Sensor response rows read at a time
+    cache_dir  : str
+                 Directory of the geometry and binning caches
+    """
+
+    pmt_ids = detector_geometry(db_file, run_no, cache_dir).pmt_ids
+
+    def as_block(evts: np.ndarray, wfs: List[pd.DataFrame]) -> pd.DataFrame:
+        return pd.concat(wfs, keys=evts, names=('evt', 'sensor_id'))
+
+    for file_name in file_names:
+
+        pmt_binwid, sipm_binwid = sensor_binning(file_name, cache_dir)
+
+        with tb.open_file(file_name, 'r') as h5in:
+
+            info    = file_info(h5in)
+            evt_wfs = event_sensor_response(h5in, info.extents,
+                                            pmt_ids, pmt_binwid,
+                                            sipm_binwid, chunk_size)
+
+            for first in range(0, len(info.evt_numbers), batch_size):
+
+                evts, pmt_wfs, sipm_wfs = zip(*islice(evt_wfs, batch_size))
+                evts   = np.array(evts)
+                tstamp = info.timestamps[first:first + len(evts)]
+
+                yield dict(evt         = evts                    ,
+                           mc          = info.mc_info            ,
+                           timestamp   = tstamp                  ,
+                           pmt_binwid  = pmt_binwid              ,
+                           sipm_binwid = sipm_binwid             ,
+                           pmt_wfs     = as_block(evts,  pmt_wfs),
+                           sipm_wfs    = as_block(evts, sipm_wfs))
+
+
 def load_hits(file_names: List[str]) -> Generator:
     """
     Loads mc hit info into a pandas DataFrame
     using the IC function read_mchits_df.
-    Returns this information as well as timestamp
-    and general mc info in the generator format
-    expected by the dataflow.
+    Returns this information as well as timestamp,
+    general mc info and the file name in the
+    generator format expected by the dataflow.
 
     files_names : list of strings
                   List of nexus file names to be read.
     """
+    from invisible_cities.io.mcinfo_io import read_mchits_df
 
     for file_name in file_names:
         with tb.open_file(file_name) as h5in:
 
-            extents    = pd.read_hdf(file_name, 'MC/extents')
-
-            event_ids  = extents.evt_number
-
-            hits_df    = read_mchits_df(h5in, extents)
-
-            mc_info    = tbl.get_mc_info(h5in)
+            info    = file_info(h5in)
 
-            timestamps = event_timestamp(h5in)
+            hits_df = read_mchits_df(h5in, pd.DataFrame(info.extents))
 
-            for evt in event_ids:
+            for evt, timestamp in zip(info.evt_numbers, info.timestamps):
                 yield dict(evt       = evt             ,
-                           mc        = mc_info         ,
-                           timestamp = timestamps()    ,
+                           mc        = info.mc_info    ,
+                           timestamp = timestamp       ,
+                           file_name = file_name       ,
                            hits      = hits_df.loc[evt])
@@ -17,13 +17,22 @@ from invisible_cities.io  .mcinfo_io         import load_mcsensor_response_df
 from invisible_cities.io  .mcinfo_io         import        get_sensor_binning
 from invisible_cities.core.system_of_units_c import                     units
 
-from . hdf5_io import   buffer_writer
-from . hdf5_io import event_timestamp
-from . hdf5_io import       load_hits
-from . hdf5_io import    load_sensors
-from . hdf5_io import   save_run_info
-
-from ..simulation.buffer_functions import calculate_buffers
+from . hdf5_io import         buffer_writer
+from . hdf5_io import          copy_mc_info
+from . hdf5_io import       event_timestamp
+from . hdf5_io import event_sensor_response
+from . hdf5_io import             file_info
+from . hdf5_io import             load_hits
+from . hdf5_io import          load_sensors
+from . hdf5_io import    load_sensor_blocks
+from . hdf5_io import    merge_buffer_files
+from . hdf5_io import        output_filters
+from . hdf5_io import      zs_buffer_reader
+from . hdf5_io import         save_run_info
+from . hdf5_io import        sensor_binning
+
+from ..simulation.buffer_functions import  calculate_buffers
+from ..simulation.buffer_functions import bin_sensors_sparse
 from ..util      .util             import     trigger_times
 
 
@@ -62,6 +71,23 @@ def test_event_timestamp(fullsim_data):
             time_stamp()
 
 
+def test_file_info(fullsim_data):
+
+    extents = pd.read_hdf(fullsim_data, 'MC/extents')
+    with tb.open_file(fullsim_data) as data_in:
+        info = file_info(data_in)
+
+        ## Explicitly extract timestamps
+        first_hit  = 0
+        timestamps = []
+        for ext in data_in.root.MC.extents:
+            timestamps.append(data_in.root.MC.hits[first_hit][2])
+            first_hit = ext[2] + 1
+
+    assert np.all(info.evt_numbers == extents.evt_number)
+    assert np.all(info.timestamps  == timestamps)
+
+
 @fixture(scope = 'module')
 def event_definitions(fullsim_data):
     len_energy    = 100
@@ -151,6 +177,382 @@ def test_buffer_writer(config_tmpdir, event_definitions,
             assert np.all(file_sipm_sum == np.sum(sipmwf_[:, slice_], axis=1))
 
 
+def test_buffer_writer_sparse(config_tmpdir, event_definitions):
+    len_eng, len_trk, pmt_bins, sipm_bins, calc_buffers = event_definitions
+
+    n_pmt       =   12
+    n_sipm      = 1792
+    triggers    = [10, 1100]
+
+    sipm_ids    = np.arange(1000, 1100)
+    sipm_orders = sipm_ids - 1000 + 50
+    n_samp      = 5000
+    sipm_sparse = bin_sensors_sparse(np.random.choice(sipm_ids, n_samp)     ,
+                                     np.random.uniform(0, 2e6, n_samp)      ,
+                                     np.random.poisson(5, n_samp)           ,
+                                     sipm_bins                              )
+    sipm_dense  = pd.Series(list(sipm_sparse.to_dense()), sipm_sparse.ids)
+    pmt_wf      = pd.Series(np.random.poisson(5, (n_pmt, pmt_bins.shape[0])).tolist())
+
+    out_names = []
+    for i, sipm_wf in enumerate((sipm_dense, sipm_sparse)):
+        buffers  = calc_buffers(triggers, pmt_bins, pmt_wf, sipm_bins, sipm_wf)
+        out_name = os.path.join(config_tmpdir, f'test_buffers_sparse_{i}.h5')
+        with tb.open_file(out_name, 'w') as data_out:
+
+            buffer_writer_ = buffer_writer(data_out,
+                                           n_sens_eng =   n_pmt,
+                                           n_sens_trk =  n_sipm,
+                                           length_eng = len_eng,
+                                           length_trk = len_trk)
+
+            buffer_writer_(0, list(range(n_pmt)), sipm_orders,
+                           trigger_times(triggers, 0, pmt_bins), buffers)
+        out_names.append(out_name)
+
+    with tb.open_file(out_names[0]) as dense_out, \
+         tb.open_file(out_names[1]) as sparse_out:
+
+        assert np.all(sparse_out.root.pmtrd [:] == dense_out.root.pmtrd [:])
+        assert np.all(sparse_out.root.sipmrd[:] == dense_out.root.sipmrd[:])
+
+
+def test_buffer_writer_detector_order(config_tmpdir):
+
+    n_pmt, n_sipm     = 12, 1792
+    len_eng, len_trk  = 100, 10
+    timestamps        = [0, 1000]
+    buffers           = [(np.random.poisson(5, ( n_pmt, len_eng)),
+                          np.random.poisson(5, (n_sipm, len_trk)))
+                         for _ in timestamps]
+
+    out_name = os.path.join(config_tmpdir, 'test_buffers_ordered.h5')
+    with tb.open_file(out_name, 'w') as data_out:
+
+        buffer_writer_ = buffer_writer(data_out,
+                                       n_sens_eng     =   n_pmt,
+                                       n_sens_trk     =  n_sipm,
+                                       length_eng     = len_eng,
+                                       length_trk     = len_trk,
+                                       detector_order =    True)
+
+        buffer_writer_(3, timestamps, buffers)
+
+    with tb.open_file(out_name) as data_out:
+
+        assert np.all(data_out.root.Run.events.col('event_number') == [0, 1])
+        assert np.all(data_out.root.Run.events.col('nexus_evt')    == [3, 3])
+        assert np.all(data_out.root.Run.events.col('timestamp')    == timestamps)
+        for i, (pmts, sipms) in enumerate(buffers):
+            assert np.all(data_out.root.pmtrd [i] ==  pmts)
+            assert np.all(data_out.root.sipmrd[i] == sipms)
+
+
+def test_sensor_binning_cache(config_tmpdir, fullsim_data):
+
+    cache_dir = os.path.join(config_tmpdir, 'binning_cache')
+    expected  = get_sensor_binning(fullsim_data)
+
+    assert sensor_binning(fullsim_data) == expected
+    assert sensor_binning(fullsim_data, cache_dir) == approx(expected)
+    assert len(os.listdir(cache_dir)) == 1
+    assert sensor_binning(fullsim_data, cache_dir) == approx(expected)
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_output_filters():
+
+    filters = output_filters('blosc:zstd-5')
+    assert filters.complib   == 'blosc:zstd'
+    assert filters.complevel == 5
+
+    with raises(ValueError):
+        output_filters('nolib-5')
+
+
+def test_buffer_writer_chunkshape(config_tmpdir):
+
+    out_name = os.path.join(config_tmpdir, 'test_chunkshape.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        buffer_writer(h5out, n_sens_eng=3, n_sens_trk=5,
+                      length_eng=10, length_trk=2,
+                      compression='blosc:lz4-1',
+                      chunks_eng=(2, 3, 5), chunks_trk=(4, 1, 2))
+
+    with tb.open_file(out_name) as data_out:
+        assert data_out.root.pmtrd .chunkshape == (2, 3, 5)
+        assert data_out.root.sipmrd.chunkshape == (4, 1, 2)
+        assert data_out.root.pmtrd .filters.complib == 'blosc:lz4'
+
+
+@mark.parametrize("sample_dtype", ('int16', 'uint16'))
+def test_buffer_writer_batched(config_tmpdir, sample_dtype):
+
+    out_name   = os.path.join(config_tmpdir, f'test_batched_{sample_dtype}.h5')
+    n_evt      = 7
+    timestamps = list(range(n_evt))
+    buffers    = [(randint(0, 40000, (3, 10)), randint(0, 30000, (5, 2)))
+                  for _ in range(n_evt)]
+    with tb.open_file(out_name, 'w') as h5out:
+        writer = buffer_writer(h5out, n_sens_eng=3, n_sens_trk=5,
+                               length_eng=10, length_trk=2,
+                               detector_order=True, batch_size=3,
+                               sample_dtype=sample_dtype)
+        if sample_dtype == 'int16':
+            with raises(ValueError):
+                writer(2, timestamps, buffers)
+            return
+
+        writer(2, timestamps, buffers)
+        assert len(h5out.root.Run.events) == 6
+        writer.flush()
+
+    with tb.open_file(out_name) as data_out:
+        assert data_out.root.pmtrd.dtype == np.uint16
+        assert np.all(data_out.root.Run.events.col('event_number') == np.arange(n_evt))
+        assert np.all(data_out.root.Run.events.col('timestamp'   ) == timestamps)
+        for i, (pmts, sipms) in enumerate(buffers):
+            assert np.all(data_out.root.pmtrd [i] ==  pmts)
+            assert np.all(data_out.root.sipmrd[i] == sipms)
+
+
+@fixture(scope = 'function')
+def zs_buffers():
+    buffers = []
+    for _ in range(5):
+        sipms = np.zeros((20, 4), int)
+        sipms[randint(0, 20, 3)] = randint(0, 10, (3, 4))
+        buffers.append((randint(0, 10, (3, 10)), sipms))
+    buffers.append((randint(0, 10, (3, 10)), np.zeros((20, 4), int)))
+    return buffers
+
+
+def write_zs_buffers(file_name: str, buffers: list, batch_size: int) -> None:
+    with tb.open_file(file_name, 'w') as h5out:
+        save_run_info(h5out, -6400)
+        writer = buffer_writer(h5out, n_sens_eng=3, n_sens_trk=20,
+                               length_eng=10, length_trk=4,
+                               detector_order=True, batch_size=batch_size,
+                               zs_trk=True, trk_ids=np.arange(1000, 1020))
+        writer(1, list(range(len(buffers))), buffers)
+        writer.flush()
+
+
+@mark.parametrize("batch_size", (1, 4))
+def test_buffer_writer_zs_trk(config_tmpdir, zs_buffers, batch_size):
+
+    out_name = os.path.join(config_tmpdir, f'test_zs_{batch_size}.h5')
+    write_zs_buffers(out_name, zs_buffers, batch_size)
+
+    with tb.open_file(out_name) as data_out:
+        assert 'sipmrd' not in data_out.root
+        n_stored = sum(np.count_nonzero(sipms.any(axis=1)) for _, sipms in zs_buffers)
+        assert len(data_out.root.sipmrd_zs.samples) == n_stored
+        assert np.all(data_out.root.sipmrd_zs.sensor_ids[:] == np.arange(1000, 1020))
+        assert np.all(np.isin(data_out.root.sipmrd_zs.sensors[:], np.arange(1000, 1020)))
+
+        read_buffer = zs_buffer_reader(data_out)
+        assert read_buffer.n_buffers == len(zs_buffers)
+        for i, (pmts, sipms) in enumerate(zs_buffers):
+            assert np.all(data_out.root.pmtrd[i] == pmts)
+            assert np.all(read_buffer(i)         == sipms)
+
+
+def test_merge_zs_buffers(config_tmpdir, zs_buffers):
+
+    file_names = [os.path.join(config_tmpdir, f'test_zs_merge_{i}.h5')
+                  for i in range(2)]
+    write_zs_buffers(file_names[0], zs_buffers[:2], 1)
+    write_zs_buffers(file_names[1], zs_buffers[2:], 2)
+
+    out_name = os.path.join(config_tmpdir, 'test_zs_merged.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        merge_buffer_files(file_names, h5out)
+
+    with tb.open_file(out_name) as h5merged:
+        read_buffer = zs_buffer_reader(h5merged)
+        assert read_buffer.n_buffers == len(zs_buffers)
+        for i, (_, sipms) in enumerate(zs_buffers):
+            assert np.all(read_buffer(i) == sipms)
+
+
+def test_buffer_writer_zs_trk_needs_ids(config_tmpdir):
+
+    out_name = os.path.join(config_tmpdir, 'test_zs_no_ids.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        with raises(ValueError):
+            buffer_writer(h5out, n_sens_eng=3, n_sens_trk=20,
+                          length_eng=10, length_trk=4, zs_trk=True)
+
+
+def test_merge_zs_buffers_n_sensors(config_tmpdir, zs_buffers):
+
+    file_names = [os.path.join(config_tmpdir, f'test_zs_nsens_{i}.h5')
+                  for i in range(2)]
+    write_zs_buffers(file_names[0], zs_buffers[:2], 1)
+    write_zs_buffers(file_names[1], zs_buffers[2:], 1)
+    with tb.open_file(file_names[1], 'a') as h5in:
+        h5in.root.sipmrd_zs.sensors.attrs.n_sensors = 19
+
+    out_name = os.path.join(config_tmpdir, 'test_zs_nsens_merged.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        with raises(ValueError):
+            merge_buffer_files(file_names, h5out)
+
+
+def test_merge_buffer_files(config_tmpdir):
+
+    class Extents(tb.IsDescription):
+        evt_number = tb.Int32Col(pos=0)
+        last_hit   = tb.Int64Col(pos=1)
+
+    class Hits(tb.IsDescription):
+        hit_time = tb.Float64Col(pos=0)
+
+    class Generators(tb.IsDescription):
+        evt_number    = tb.Int32Col(pos=0)
+        atomic_number = tb.Int32Col(pos=1)
+
+    class Configuration(tb.IsDescription):
+        param_key   = tb.StringCol(20, pos=0)
+        param_value = tb.StringCol(20, pos=1)
+
+    n_evts     = [3, 1, 2]
+    file_names = []
+    buffers    = []
+    for i, n_evt in enumerate(n_evts):
+        file_name = os.path.join(config_tmpdir, f'test_merge_{i}.h5')
+        file_names.append(file_name)
+        with tb.open_file(file_name, 'w') as h5out:
+            save_run_info(h5out, -6400)
+            writer = buffer_writer(h5out, n_sens_eng=3, n_sens_trk=5,
+                                   length_eng=10, length_trk=2,
+                                   detector_order=True)
+            for evt in range(n_evt):
+                evt_buffers = [(randint(0, 10, (3, 10)), randint(0, 10, (5, 2)))]
+                writer(10 * i + evt, [evt], evt_buffers)
+                buffers.extend(evt_buffers)
+
+            mc_group = h5out.create_group(h5out.root, 'MC')
+            extents  = h5out.create_table(mc_group, 'extents', Extents)
+            hits     = h5out.create_table(mc_group, 'hits'   , Hits   )
+            extents.append([(10 * i + evt, 2 * evt + 1) for evt in range(n_evt)])
+            hits   .append([(t,) for t in range(2 * n_evt)])
+            h5out.create_table(mc_group, 'generators', Generators).append(
+                [(10 * i + evt, 2) for evt in range(n_evt)])
+            h5out.create_table(mc_group, 'configuration', Configuration).append(
+                [('file', f'{i}')])
+
+    out_name = os.path.join(config_tmpdir, 'test_merged.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        merge_buffer_files(file_names, h5out, buffer_size=64)
+
+    with tb.open_file(out_name) as h5merged:
+        events = h5merged.root.Run.events
+        assert len(h5merged.root.Run.runInfo) == 1
+        assert np.all(events.col('event_number') == np.arange(sum(n_evts)))
+        assert np.all(events.col('nexus_evt'   ) == [0, 1, 2, 10, 20, 21])
+        assert np.all(events.col('timestamp'   ) == [0, 1, 2,  0,  0,  1])
+        for i, (pmts, sipms) in enumerate(buffers):
+            assert np.all(h5merged.root.pmtrd [i] ==  pmts)
+            assert np.all(h5merged.root.sipmrd[i] == sipms)
+
+        last_hits = h5merged.root.MC.extents.col('last_hit')
+        assert np.all(last_hits == np.arange(1, 2 * sum(n_evts), 2))
+        assert len(h5merged.root.MC.hits) == 2 * sum(n_evts)
+
+        ## Per event tables from all files, constants from the first
+        assert np.all(h5merged.root.MC.generators.col('evt_number') ==
+                      [0, 1, 2, 10, 20, 21])
+        assert len(h5merged.root.MC.configuration) == 1
+
+
+def test_merge_buffer_files_shape_mismatch(config_tmpdir):
+
+    file_names = []
+    for i, n_sipm in enumerate((5, 6)):
+        file_name = os.path.join(config_tmpdir, f'test_merge_shape_{i}.h5')
+        file_names.append(file_name)
+        with tb.open_file(file_name, 'w') as h5out:
+            buffer_writer(h5out, n_sens_eng=3, n_sens_trk=n_sipm,
+                          length_eng=10, length_trk=2)
+
+    out_name = os.path.join(config_tmpdir, 'test_merged_shape.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        with raises(ValueError):
+            merge_buffer_files(file_names, h5out)
+
+
+def test_copy_mc_info(config_tmpdir):
+
+    class Extents(tb.IsDescription):
+        evt_number    = tb.Int32Col(pos=0)
+        last_sns_data = tb.Int64Col(pos=1)
+        last_hit      = tb.Int64Col(pos=2)
+        last_particle = tb.Int64Col(pos=3)
+
+    class Hits(tb.IsDescription):
+        hit_time = tb.Float64Col(pos=0)
+
+    class Particles(tb.IsDescription):
+        particle_indx = tb.Int32Col(pos=0)
+
+    class Waveforms(tb.IsDescription):
+        sensor_id = tb.Int32Col(pos=0)
+
+    class Generators(tb.IsDescription):
+        evt_number = tb.Int32Col(pos=0)
+        atomic_number = tb.Int32Col(pos=1)
+
+    n_hits     = [[2, 3, 1], [4, 2]]
+    n_parts    = [[1, 2, 2], [3, 1]]
+    n_sns      = [[4, 1, 2], [2, 3]]
+    file_names = []
+    for i, (hits, parts, sns) in enumerate(zip(n_hits, n_parts, n_sns)):
+        file_name = os.path.join(config_tmpdir, f'test_mc_copy_{i}.h5')
+        file_names.append(file_name)
+        evts = 10 * i + np.arange(len(hits))
+        with tb.open_file(file_name, 'w') as h5out:
+            mc_group = h5out.create_group(h5out.root, 'MC')
+            h5out.create_table(mc_group, 'extents'   , Extents   ).append(
+                list(zip(evts, np.cumsum(sns) - 1,
+                         np.cumsum(hits) - 1, np.cumsum(parts) - 1)))
+            h5out.create_table(mc_group, 'hits'      , Hits      ).append(
+                [(h,) for h in np.repeat(evts, hits)])
+            h5out.create_table(mc_group, 'particles' , Particles ).append(
+                [(p,) for p in np.repeat(evts, parts)])
+            h5out.create_table(mc_group, 'waveforms' , Waveforms ).append(
+                [(s,) for s in np.repeat(evts, sns)])
+            h5out.create_table(mc_group, 'generators', Generators).append(
+                [(evt, 2) for evt in evts])
+
+    evt_mask = [True, False, True, False, True]
+    out_name = os.path.join(config_tmpdir, 'test_mc_copied.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        copy_mc_info(file_names, h5out, evt_mask)
+
+    kept_evts = [0, 2, 11]
+    kept_hits = [2, 1, 2]
+    kept_part = [1, 2, 1]
+    with tb.open_file(out_name) as h5copy:
+        extents = h5copy.root.MC.extents
+        assert np.all(extents.col('evt_number'   ) == kept_evts)
+        assert np.all(extents.col('last_hit'     ) == np.cumsum(kept_hits) - 1)
+        assert np.all(extents.col('last_particle') == np.cumsum(kept_part) - 1)
+        ## Sensor waveforms left in the nexus files
+        assert '/MC/waveforms' not in h5copy
+        assert np.all(h5copy.root.MC.hits.col('hit_time') ==
+                      np.repeat(kept_evts, kept_hits))
+        assert np.all(h5copy.root.MC.particles.col('particle_indx') ==
+                      np.repeat(kept_evts, kept_part))
+        assert np.all(h5copy.root.MC.generators.col('evt_number') == kept_evts)
+
+    ## One mask entry per extents row of all the files
+    with tb.open_file(out_name, 'w') as h5out:
+        with raises(ValueError):
+            copy_mc_info(file_names, h5out, evt_mask[:-1])
+
+
 def test_load_sensors(fullsim_data):
 
     #Get basic info about the file
@@ -179,6 +581,90 @@ def test_load_sensors(fullsim_data):
         assert data_nwfs == n_wfs[i]
 
 
+@mark.parametrize("chunk_size", (1, 5, 100000))
+def test_load_sensors_equals_response_df(fullsim_data, chunk_size):
+
+    evts, _, _, all_wf = load_mcsensor_response_df(fullsim_data, 'new', -6400)
+
+    evt_gen = load_sensors((fullsim_data,), 'new', -6400, chunk_size)
+
+    for evt, evt_dict in zip(evts, evt_gen):
+        assert evt_dict['evt'] == evt
+
+        read_wfs = pd.concat((evt_dict['pmt_wfs'], evt_dict['sipm_wfs']))
+        expected = all_wf.loc[evt]
+        assert np.all(read_wfs.sort_index(kind='stable').values ==
+                      expected.sort_index(kind='stable').values)
+
+
+@mark.parametrize("chunk_size", (1, 3, 7, 1000))
+def test_event_sensor_response(config_tmpdir, chunk_size):
+
+    class Extents(tb.IsDescription):
+        evt_number    = tb.Int32Col(pos=0)
+        last_sns_data = tb.Int64Col(pos=1)
+
+    class SensorResponse(tb.IsDescription):
+        sensor_id = tb.Int32Col(pos=0)
+        time_bin  = tb.Int64Col(pos=1)
+        charge    = tb.Int32Col(pos=2)
+
+    n_rows   = [4, 1, 6, 2]
+    pmt_ids  = np.arange(3)
+    sns_ids  = np.array([0, 1000, 2, 1001, 1, 1002, 1003, 0, 1, 2, 1000, 1001, 2])
+    out_name = os.path.join(config_tmpdir, 'test_sns_response.h5')
+    with tb.open_file(out_name, 'w') as h5out:
+        mc_group = h5out.create_group(h5out.root, 'MC')
+        extents  = h5out.create_table(mc_group, 'extents'  , Extents)
+        sns_resp = h5out.create_table(mc_group, 'waveforms', SensorResponse)
+        extents .append(list(zip([10, 11, 13, 20], np.cumsum(n_rows) - 1)))
+        sns_resp.append(list(zip(sns_ids, np.arange(len(sns_ids)),
+                                 np.arange(len(sns_ids)) + 1)))
+
+    with tb.open_file(out_name) as h5in:
+        evt_gen = event_sensor_response(h5in, h5in.root.MC.extents.read(),
+                                        pmt_ids, 25, 1000, chunk_size)
+        first   = 0
+        for i, (evt, pmt_wfs, sipm_wfs) in enumerate(evt_gen):
+            rows   = np.arange(first, first + n_rows[i])
+            is_pmt = sns_ids[rows] < 1000
+            assert evt == [10, 11, 13, 20][i]
+            assert np.all(pmt_wfs .index == sns_ids[rows[ is_pmt]])
+            assert np.all(sipm_wfs.index == sns_ids[rows[~is_pmt]])
+            assert np.all(pmt_wfs .time   == rows[ is_pmt] *   25)
+            assert np.all(sipm_wfs.time   == rows[~is_pmt] * 1000)
+            assert np.all(pmt_wfs .charge == rows[ is_pmt] +    1)
+            first += n_rows[i]
+        assert i == len(n_rows) - 1
+
+
+@mark.parametrize("batch_size chunk_size".split(),
+                  ((1, 100000), (2, 100000), (2, 5), (1000, 100000)))
+def test_load_sensor_blocks(fullsim_data, batch_size, chunk_size):
+
+    source = partial(load_sensors, db_file = 'new', run_no = -6400)
+    evt_by_evt = list(source((fullsim_data,)))
+
+    blocks = load_sensor_blocks((fullsim_data,), 'new', -6400,
+                                batch_size, chunk_size)
+
+    n_evt = 0
+    for block in blocks:
+        assert len(block['evt']) <= batch_size
+        assert len(block['evt']) == len(block['timestamp'])
+
+        for evt, timestamp in zip(block['evt'], block['timestamp']):
+            evt_dict = evt_by_evt[n_evt]
+            assert evt       == evt_dict['evt']
+            assert timestamp == evt_dict['timestamp']
+            assert np.all(block[ 'pmt_wfs'].loc[evt].values ==
+                          evt_dict[ 'pmt_wfs'].values)
+            assert np.all(block['sipm_wfs'].loc[evt].values ==
+                          evt_dict['sipm_wfs'].values)
+            n_evt += 1
+    assert n_evt == len(evt_by_evt)
+
+
 def test_load_hits(fullsim_data):
 
     #Get basic info about the file
@@ -187,7 +673,7 @@ def test_load_hits(fullsim_data):
         hit_end = [ext[2] for ext in h5info.root.MC.extents]
         n_hits  = np.diff([0] + hit_end) + 1
 
-    expected_keys = ['evt', 'mc', 'timestamp', 'hits']
+    expected_keys = ['evt', 'mc', 'timestamp', 'file_name', 'hits']
 
     evt_gen = load_hits((fullsim_data,))
 
@@ -0,0 +1,57 @@
+"""
+Merges detsim buffer files, as written by position_signal,
+into a single file for the IC cities. The buffers, Run/events
+and per event MC tables are appended in blocks of whole chunks
+with the event_number renumbered on the fly.
+
+usage: python detsim/merge_buffers.py -o merged.h5 [-c ZLIB4] [-b MB] files_in ...
+"""
+
+import   os
+import  sys
+import argparse
+
+import tables as tb
+
+from glob   import glob
+from typing import List
+
+from detsim.io.hdf5_io import merge_buffer_files
+from detsim.io.hdf5_io import     output_filters
+
+
+def merge_buffers(files_in   : List[str]         ,
+                  file_out   :      str          ,
+                  compression:      str = 'ZLIB4',
+                  buffer_mb  :      int =      64) -> None:
+    """
+    Merges files_in, in the given order, into file_out.
+
+    files_in    : List of strings
+                  Buffer files or glob patterns (sorted)
+    file_out    : string
+                  Name of the merged file
+    compression : string
+                  Compression of the merged file, as for output_filters
+    buffer_mb   : int
+                  Approximate MB read and appended at a time
+    """
+    file_names = [name for pattern in files_in
+                  for name in sorted(glob(os.path.expandvars(pattern)))]
+    if not file_names:
+        raise ValueError(f"No input files in {files_in}")
+
+    filters = output_filters(compression)
+    with tb.open_file(file_out, "w", filters=filters) as h5out:
+        merge_buffer_files(file_names, h5out, buffer_mb * 2**20, filters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Merge detsim buffer files")
+    parser.add_argument('files_in', nargs='+')
+    parser.add_argument('-o', '--file-out'   , required=True)
+    parser.add_argument('-c', '--compression', default='ZLIB4')
+    parser.add_argument('-b', '--buffer-mb'  , default=64, type=int)
+    args = parser.parse_args(sys.argv[1:])
+
+    merge_buffers(args.files_in, args.file_out, args.compression, args.buffer_mb)
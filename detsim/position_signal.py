@@ -5,34 +5,47 @@ and simple 'trigger' conditions which allow for the positioning of
 the signal within the buffers.
 """
 
-import   os
-import json
-import  sys
+import       os
+import      sys
 
 import numpy  as np
 import pandas as pd
 import tables as tb
 
-from glob      import    glob
-from functools import partial
-from functools import   wraps
-
-from detsim.io        .hdf5_io          import        buffer_writer
-from detsim.io        .hdf5_io          import         load_sensors
-from detsim.io        .hdf5_io          import        save_run_info
-from detsim.simulation.buffer_functions import    calculate_buffers
-from detsim.simulation.buffer_functions import        signal_finder
-from detsim.simulation.buffer_functions import            wf_binner
-from detsim.util      .util             import first_and_last_times
-from detsim.util      .util             import       get_no_sensors
-from detsim.util      .util             import         sensor_order
-from detsim.util      .util             import        trigger_times
-
-from invisible_cities.core.configure         import          configure
-from invisible_cities.core.system_of_units_c import              units
-from invisible_cities.io  .mcinfo_io         import get_sensor_binning
-from invisible_cities.io  .mcinfo_io         import     mc_info_writer
-from invisible_cities.reco                   import      tbl_functions as tbl
+from glob      import       glob
+from copy      import       copy
+from functools import    partial
+from functools import      wraps
+from typing    import   Callable
+from typing    import  Generator
+from typing    import   Iterable
+from typing    import       List
+from typing    import NamedTuple
+from typing    import   Optional
+from typing    import      Tuple
+
+from detsim.io        .hdf5_io          import           buffer_writer
+from detsim.io        .hdf5_io          import            copy_mc_info
+from detsim.io        .hdf5_io          import            load_sensors
+from detsim.io        .hdf5_io          import      load_sensor_blocks
+from detsim.io        .hdf5_io          import          output_filters
+from detsim.io        .hdf5_io          import           save_run_info
+from detsim.io        .hdf5_io          import          sensor_binning
+from detsim.simulation.buffer_functions import               bin_edges
+from detsim.simulation.buffer_functions import            block_binner
+from detsim.simulation.buffer_functions import       calculate_buffers
+from detsim.simulation.buffer_functions import  calculate_lazy_buffers
+from detsim.simulation.buffer_functions import           signal_finder
+from detsim.simulation.buffer_functions import        summed_wf_binner
+from detsim.simulation.buffer_functions import     time_ordered_chunks
+from detsim.simulation.buffer_functions import streaming_signal_finder
+from detsim.simulation.buffer_functions import               wf_binner
+from detsim.util      .util             import       detector_geometry
+from detsim.util      .util             import    first_and_last_times
+from detsim.util      .util             import            sensor_order
+from detsim.util      .util             import           trigger_times
+
+from invisible_cities.core.system_of_units_c import          units
 
 from invisible_cities.dataflow          import dataflow as fl
 from invisible_cities.dataflow.dataflow import     fork
@@ -40,6 +53,131 @@ from invisible_cities.dataflow.dataflow import     pipe
 from invisible_cities.dataflow.dataflow import     push
 
 
+def binned_events(blocks: Iterable, bin_block: Callable) -> Generator:
+    """
+    Bins each block of events from load_sensor_blocks
+    in one pass and yields the events one by one in
+    the structure given by the binning stages of the
+    event by event dataflow.
+    """
+    for block in blocks:
+        binned = bin_block(block['evt'     ]                    ,
+                           block[ 'pmt_wfs'], block[ 'pmt_binwid'],
+                           block['sipm_wfs'], block['sipm_binwid'])
+        for evt, timestamp, (pmt_bins ,  pmt_wfs,
+                             sipm_bins, sipm_wfs) in zip(block['evt'      ],
+                                                         block['timestamp'],
+                                                         binned            ):
+            yield dict(evt          = evt       ,
+                       mc           = block['mc'],
+                       timestamp    = timestamp ,
+                       pmt_bins     = pmt_bins  ,
+                       pmt_bin_wfs  = pmt_wfs   ,
+                       sipm_bins    = sipm_bins ,
+                       sipm_bin_wfs = sipm_wfs  )
+
+
+def streamed_triggers(find_signal: Callable,
+                      max_buffer :    float,
+                      chunk_size :      int) -> Callable:
+    """
+    Event PMT bins and triggers found by a
+    streaming_signal_finder from the PMT samples
+    given chunk_size at a time in time order,
+    without binning the PMTs.
+    """
+    def bins_and_triggers(pmt_wfs: pd.DataFrame, pmt_binwid: float) -> Tuple:
+        bins   = bin_edges(pmt_binwid, pmt_wfs.time.min(),
+                           pmt_wfs.time.max(), max_buffer)
+        pulses = list(find_signal(time_ordered_chunks(pmt_wfs, chunk_size)))
+        return bins, pulses
+    return bins_and_triggers
+
+
+def event_recorder() -> Tuple[Callable, List]:
+    """
+    Function recording in order whether each
+    event gave buffers and the list of records.
+    """
+    has_buffers = []
+    def record(evt_times: List) -> None:
+        has_buffers.append(len(evt_times) > 0)
+    return record, has_buffers
+
+
+class JobSetup(NamedTuple):
+    npmt      : int
+    nsipm     : int
+    pmt_wid   : float
+    sipm_wid  : float
+    nsamp_pmt : int
+    nsamp_sipm: int
+
+
+def job_setup(detector_db  : str          ,
+              run_number   : int          ,
+              file_name    : str          ,
+              buffer_length: float        ,
+              cache_dir    : Optional[str] = None) -> JobSetup:
+    """
+    Constants of the job: sensor numbers from the
+    (memoised) detector geometry, sensor binning of the
+    first input file and buffer lengths in samples.
+    With cache_dir the geometry and binning are kept
+    on disk for later jobs.
+    """
+    geometry          = detector_geometry(detector_db, run_number, cache_dir)
+    pmt_wid, sipm_wid = sensor_binning(file_name, cache_dir)
+    return JobSetup(npmt       = geometry.n_pmt ,
+                    nsipm      = geometry.n_sipm,
+                    pmt_wid    =         pmt_wid,
+                    sipm_wid   =        sipm_wid,
+                    nsamp_pmt  = int(buffer_length * units.mus /  pmt_wid),
+                    nsamp_sipm = int(buffer_length * units.mus / sipm_wid))
+
+
+def shard_position_signal(conf, file_in: str, file_out: str) -> str:
+    """
+    Serial position_signal of one input
+    file into the shard file_out.
+    """
+    shard_conf          = copy(conf)
+    shard_conf.files_in = file_in
+    shard_conf.file_out = file_out
+    shard_conf.workers  = 1
+    position_signal(shard_conf)
+    return file_out
+
+
+def parallel_position_signal(conf              ,
+                             files_in: List[str],
+                             file_out:      str ,
+                             workers :      int ) -> None:
+    """
+    Runs position_signal for each input file
+    in a pool of workers processes, each writing
+    a shard, and merges the shards in the input
+    order into file_out as the serial job would
+    have written it.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools          import              repeat
+    from detsim.io.hdf5_io  import  merge_buffer_files
+
+    shards = [f"{file_out}.shard{i}" for i in range(len(files_in))]
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(shard_position_signal, repeat(conf), files_in, shards))
+
+        with tb.open_file(file_out, "w",
+                          filters=output_filters(conf.compression)) as h5out:
+            merge_buffer_files(shards, h5out)
+    finally:
+        for shard in shards:
+            if os.path.exists(shard):
+                os.remove(shard)
+
+
 def position_signal(conf):
 
     files_in      = glob(os.path.expandvars(conf.files_in))
@@ -51,11 +189,45 @@ def position_signal(conf):
     pre_trigger   =                   float(conf.pre_trigger)
     trg_threshold =                   float(conf.trg_threshold)
     compression   =                         conf.compression
+    sparse_sipm   =            bool(getattr(conf, 'sparse_sipm', False))
+    batch_size    =             int(getattr(conf,  'batch_size',     0))
+    lazy_binning  =           bool(getattr(conf, 'lazy_binning', False))
+    trigger_chunk =             int(getattr(conf, 'trigger_chunk',    0))
+    read_chunk    =             int(getattr(conf,    'read_chunk', 100000))
+    workers       =             int(getattr(conf,       'workers',      1))
+    event_workers =             int(getattr(conf, 'event_workers',      1))
+    max_in_flight =             int(getattr(conf, 'max_in_flight',      0))
+    write_batch   =             int(getattr(conf,   'write_batch',      1))
+    sample_dtype  =                 getattr(conf,  'sample_dtype', 'int16')
+    zs_sipm       =            bool(getattr(conf,       'zs_sipm',  False))
+    pmt_chunks    =                 getattr(conf,    'pmt_chunks',   None)
+    sipm_chunks   =                 getattr(conf,   'sipm_chunks',   None)
+    blosc_threads =             int(getattr(conf, 'blosc_threads',      0))
+    bulk_mc       =            bool(getattr(conf,       'bulk_mc',  False))
+    setup_cache   =                 getattr(conf,   'setup_cache',   None)
+    trg_algorithm =                 getattr(conf, 'trg_algorithm', 'threshold')
+    trg_window    =                 getattr(conf, 'trg_window'   ,        None)
+    trg_min_pmts  =             int(getattr(conf, 'trg_min_pmts' ,           1))
+
+    if lazy_binning and batch_size > 0:
+        raise ValueError("lazy_binning can not be used with batch_size > 0")
+    if lazy_binning and sparse_sipm:
+        raise ValueError("lazy_binning bins the SiPMs in the buffers, "
+                         "sparse_sipm can not be used with it")
+    if lazy_binning and trg_algorithm == 'coincidence':
+        raise ValueError("lazy_binning only has the PMT sum for the trigger")
+    if trigger_chunk > 0 and trg_algorithm != 'threshold':
+        raise ValueError("trigger_chunk streaming only for the threshold trigger")
+    if event_workers > 1 and (lazy_binning or batch_size > 0):
+        raise ValueError("event_workers only for the event by event binning")
+
+    if workers > 1 and len(files_in) > 1:
+        return parallel_position_signal(conf, files_in, file_out, workers)
 
-    npmt, nsipm        = get_no_sensors(detector_db, run_number)
-    pmt_wid, sipm_wid  = get_sensor_binning(files_in[0])
-    nsamp_pmt          = int(buffer_length * units.mus /  pmt_wid)
-    nsamp_sipm         = int(buffer_length * units.mus / sipm_wid)
+    (npmt     , nsipm     ,
+     pmt_wid  , sipm_wid  ,
+     nsamp_pmt, nsamp_sipm) = job_setup(detector_db, run_number, files_in[0],
+                                        buffer_length, setup_cache)
 
     bin_calculation    = wf_binner(max_time)
     bin_pmt_wf         = fl.map(bin_calculation,
@@ -66,19 +238,24 @@ def position_signal(conf):
                                 args = "pmt_bins",
                                 out  = ("min_time", "max_time"))
 
-    bin_sipm_wf        = fl.map(bin_calculation,
+    sipm_bin_calc      = wf_binner(max_time, sparse = sparse_sipm)
+    bin_sipm_wf        = fl.map(sipm_bin_calc,
                                 args = ("sipm_wfs", "sipm_binwid",
                                         "min_time",    "max_time") ,
                                 out  = ("sipm_bins", "sipm_bin_wfs"))
 
-    sensor_order_      = fl.map(partial(sensor_order,
-                                        detector_db = detector_db,
-                                        run_number  =  run_number),
+    order_sensors      = partial(sensor_order,
+                                 detector_db = detector_db,
+                                 run_number  =  run_number)
+    sensor_order_      = fl.map(order_sensors,
                                 args = ("pmt_bin_wfs", "sipm_bin_wfs"),
                                 out  = ("pmt_ord", "sipm_ord"))
 
-    signal_finder_     = fl.map(signal_finder(buffer_length,
-                                              pmt_wid, trg_threshold),
+    find_signal        = signal_finder(buffer_length, pmt_wid, trg_threshold,
+                                       algorithm     = trg_algorithm,
+                                       window        = trg_window   ,
+                                       n_coincidence = trg_min_pmts )
+    signal_finder_     = fl.map(find_signal,
                                 args = "pmt_bin_wfs",
                                 out  = "pulses")
 
@@ -86,39 +263,169 @@ def position_signal(conf):
                                 args = ("pulses", "timestamp", "pmt_bins"),
                                 out  = "evt_times")
 
-    calculate_buffers_ = fl.map(calculate_buffers(buffer_length, pre_trigger,
-                                                  pmt_wid      ,    sipm_wid),
+    buffer_calc        = calculate_buffers(buffer_length, pre_trigger,
+                                           pmt_wid      ,    sipm_wid,
+                                           npmt         ,       nsipm)
+    calculate_buffers_ = fl.map(buffer_calc,
                                 args = ("pulses",
                                         "pmt_bins" ,  "pmt_bin_wfs",
-                                        "sipm_bins", "sipm_bin_wfs"),
+                                        "sipm_bins", "sipm_bin_wfs",
+                                        "pmt_ord"  ,     "sipm_ord"),
                                 out  = "buffers")
 
-    with tb.open_file(file_out, "w", filters=tbl.filters(compression)) as h5out:
+    ## Event parallel: the stages from the binning to the
+    ## buffers run as one operation by a pool of processes.
+    event_stages       = ((bin_calculation     , ("pmt_wfs", "pmt_binwid"),
+                                                 ("pmt_bins", "pmt_bin_wfs")),
+                          (first_and_last_times, "pmt_bins",
+                                                 ("min_time", "max_time")),
+                          (sipm_bin_calc       , ("sipm_wfs", "sipm_binwid",
+                                                  "min_time",    "max_time"),
+                                                 ("sipm_bins", "sipm_bin_wfs")),
+                          (order_sensors       , ("pmt_bin_wfs", "sipm_bin_wfs"),
+                                                 ("pmt_ord", "sipm_ord")),
+                          (find_signal         , "pmt_bin_wfs", "pulses"),
+                          (trigger_times       , ("pulses", "timestamp", "pmt_bins"),
+                                                 "evt_times"),
+                          (buffer_calc         , ("pulses",
+                                                  "pmt_bins" ,  "pmt_bin_wfs",
+                                                  "sipm_bins", "sipm_bin_wfs",
+                                                  "pmt_ord"  ,     "sipm_ord"),
+                                                 "buffers"))
+    event_args         = ("pmt_wfs", "pmt_binwid", "sipm_wfs", "sipm_binwid", "timestamp")
+
+    ## Lazy binning: triggers from the binned PMT sum then
+    ## binning of the raw samples inside the buffers only.
+    bin_pmt_sum        = fl.map(summed_wf_binner(max_time),
+                                args = ("pmt_wfs" , "pmt_binwid"),
+                                out  = ("pmt_bins",    "pmt_sum"))
+
+    raw_sensor_order   = fl.map(order_sensors,
+                                args = ("pmt_wfs", "sipm_wfs"),
+                                out  = ("pmt_ord", "sipm_ord"))
+
+    sum_signal_finder  = fl.map(find_signal,
+                                args = "pmt_sum",
+                                out  = "pulses")
+
+    stream_triggers    = fl.map(streamed_triggers(streaming_signal_finder(buffer_length,
+                                                                          pmt_wid      ,
+                                                                          trg_threshold,
+                                                                          max_time     ),
+                                                  max_time, trigger_chunk),
+                                args = ("pmt_wfs" , "pmt_binwid"),
+                                out  = ("pmt_bins",     "pulses"))
 
-        write_mc       = fl.sink(mc_info_writer(h5out),
+    lazy_buffers       = fl.map(calculate_lazy_buffers(buffer_length, pre_trigger,
+                                                       pmt_wid      ,    sipm_wid,
+                                                       npmt         ,       nsipm),
+                                args = ("pulses" , "pmt_bins",
+                                        "pmt_wfs", "sipm_wfs",
+                                        "pmt_ord", "sipm_ord"),
+                                out  = "buffers")
+
+    if lazy_binning and trigger_chunk > 0:
+        buffer_stages = (stream_triggers  ,
+                         raw_sensor_order ,
+                         event_times      ,
+                         lazy_buffers     )
+    elif lazy_binning:
+        buffer_stages = (bin_pmt_sum      ,
+                         raw_sensor_order ,
+                         sum_signal_finder,
+                         event_times      ,
+                         lazy_buffers     )
+    elif event_workers > 1:
+        buffer_stages = ()
+    else:
+        buffer_stages = (sensor_order_     ,
+                         signal_finder_    ,
+                         event_times       ,
+                         calculate_buffers_)
+
+    if blosc_threads > 0:
+        tb.set_blosc_max_threads(blosc_threads)
+
+    sipm_ids = detector_geometry(detector_db, run_number, setup_cache).sipm_ids
+    with tb.open_file(file_out, "w", filters=output_filters(compression)) as h5out:
+
+        if bulk_mc:
+            ## MC info copied per file after the events, only
+            ## for those with buffers, while mc_info_writer
+            ## writes the MC of every event.
+            record_evt, has_buffers = event_recorder()
+            write_mc   = fl.sink(record_evt, args = "evt_times")
+        else:
+            from invisible_cities.io.mcinfo_io import mc_info_writer
+            write_mc   = fl.sink(mc_info_writer(h5out),
                                  args = ("mc", "evt"))
-        buffer_writer_ = fl.sink(buffer_writer(h5out                  ,
-                                               n_sens_eng = npmt      ,
-                                               n_sens_trk = nsipm     ,
-                                               length_eng = nsamp_pmt ,
-                                               length_trk = nsamp_sipm),
-                                 args = ("evt", "pmt_ord", "sipm_ord",
-                                         "evt_times", "buffers"))
+        write_buffers  = buffer_writer(h5out                        ,
+                                       n_sens_eng     = npmt        ,
+                                       n_sens_trk     = nsipm       ,
+                                       length_eng     = nsamp_pmt   ,
+                                       length_trk     = nsamp_sipm  ,
+                                       detector_order = True        ,
+                                       batch_size     = write_batch ,
+                                       compression    = compression ,
+                                       sample_dtype   = sample_dtype,
+                                       zs_trk         = zs_sipm     ,
+                                       trk_ids        = sipm_ids    ,
+                                       chunks_eng     = pmt_chunks  ,
+                                       chunks_trk     = sipm_chunks )
+        buffer_writer_ = fl.sink(write_buffers,
+                                 args = ("evt", "evt_times", "buffers"))
+
+        if batch_size > 0:
+            ## Binning done per block in the source
+            blocks  = load_sensor_blocks(files_in, detector_db, run_number,
+                                         batch_size, read_chunk, setup_cache)
+            source  = binned_events(blocks,
+                                    block_binner(max_time, sparse_sipm))
+            binning = ()
+        elif lazy_binning:
+            source  = load_sensors(files_in, detector_db, run_number,
+                                   read_chunk, setup_cache)
+            binning = ()
+        elif event_workers > 1:
+            from detsim.util.parallel import   chain_maps
+            from detsim.util.parallel import parallel_map
+            source  = load_sensors(files_in, detector_db, run_number,
+                                   read_chunk, setup_cache)
+            binning = parallel_map(chain_maps(event_stages, event_args,
+                                              ("evt_times", "buffers")),
+                                   args          = event_args,
+                                   out           = ("evt_times", "buffers"),
+                                   workers       = event_workers,
+                                   max_in_flight = max_in_flight),
+        else:
+            source  = load_sensors(files_in, detector_db, run_number,
+                                   read_chunk, setup_cache)
+            binning = bin_pmt_wf, extract_minmax, bin_sipm_wf
 
         save_run_info(h5out, run_number)
-        return push(source = load_sensors(files_in, detector_db, run_number),
-                    pipe   = pipe(bin_pmt_wf          ,
-                                  extract_minmax      ,
-                                  bin_sipm_wf         ,
-                                  sensor_order_       ,
-                                  signal_finder_      ,
-                                  event_times         ,
-                                  calculate_buffers_  ,
-                                  fork(buffer_writer_,
-                                       write_mc      )))
+        result = push(source = source,
+                      pipe   = pipe(*binning            ,
+                                    *buffer_stages      ,
+                                    fork(buffer_writer_,
+                                         write_mc      )))
+        write_buffers.flush()
+        if bulk_mc:
+            copy_mc_info(files_in, h5out, has_buffers)
+        return result
 
 
 
 if __name__ == "__main__":
-    conf = configure(sys.argv).as_namespace
+    import argparse
+    from invisible_cities.core.configure import configure
+
+    ## --workers is not a city option so it
+    ## is taken out before the configuration.
+    parser     = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--workers', type=int)
+    args, argv = parser.parse_known_args(sys.argv[1:])
+
+    conf = configure(sys.argv[:1] + argv).as_namespace
+    if args.workers is not None:
+        conf.workers = args.workers
     position_signal(conf)
@@ -1,4 +1,5 @@
 import os
+import shutil
 
 import numpy  as np
 import pandas as pd
@@ -63,3 +64,55 @@ def test_position_signal_neut(config_tmpdir, neut_fullsim,
 
          assert sipm_out.shape == sipm_test.shape
          assert_tables_equality(sipm_out, sipm_test)
+
+
+def test_position_signal_workers(config_tmpdir, fullsim_data, test_config):
+
+    ## Two input files from copies of the test file
+    for i in range(2):
+        shutil.copy(fullsim_data,
+                    os.path.join(config_tmpdir, f'workers_in_{i}.sim.h5'))
+    files_in = os.path.join(config_tmpdir, 'workers_in_*.sim.h5')
+
+    outputs = {}
+    for workers in (1, 2):
+        outputs[workers] = os.path.join(config_tmpdir,
+                                        f'workers_{workers}.buffers.h5')
+        conf = configure(['dummy', test_config])
+        conf.update(dict(files_in = files_in         ,
+                         file_out = outputs[workers],
+                         workers  = workers          ))
+        position_signal(conf.as_namespace)
+
+    with tb.open_file(outputs[1], mode='r') as h5serial, \
+         tb.open_file(outputs[2], mode='r') as h5parallel:
+
+        ## Every node of the serial output, and only those
+        serial_nodes   = {node._v_pathname: node for node in
+                          h5serial  .walk_nodes('/', classname='Leaf')}
+        parallel_nodes = {node._v_pathname: node for node in
+                          h5parallel.walk_nodes('/', classname='Leaf')}
+        assert serial_nodes.keys() == parallel_nodes.keys()
+        for path, node in serial_nodes.items():
+            assert_tables_equality(node, parallel_nodes[path])
+
+
+def test_position_signal_event_workers(config_tmpdir, neut_fullsim,
+                                       test_config  , neut_buffers):
+
+    PATH_OUT = os.path.join(config_tmpdir, 'neut_event_workers.buffers.h5')
+
+    conf = configure(['dummy', test_config])
+    conf.update(dict(files_in      = neut_fullsim,
+                     file_out      = PATH_OUT    ,
+                     event_workers = 2           ,
+                     max_in_flight = 2           ))
+
+    position_signal(conf.as_namespace)
+
+    with tb.open_file(neut_buffers, mode='r') as h5test, \
+         tb.open_file(PATH_OUT    , mode='r') as h5out:
+
+        for table in ('pmtrd', 'sipmrd', 'Run/events'):
+            assert_tables_equality(h5out .get_node('/' + table),
+                                   h5test.get_node('/' + table))
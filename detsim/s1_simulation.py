@@ -0,0 +1,156 @@
+"""
+Module simulating the S1 light of nexus hits in the PMTs.
+The detected photons of each hit and PMT are drawn from
+the S1 detection probability parametrisation and binned
+in time into one buffer per event, written in the
+position_signal output format.
+"""
+
+import os
+import sys
+
+import numpy  as np
+import pandas as pd
+import tables as tb
+
+from glob     import      glob
+from typing   import  Callable
+from typing   import      List
+
+from detsim.io        .hdf5_io                 import           buffer_writer
+from detsim.io        .hdf5_io                 import               load_hits
+from detsim.io        .hdf5_io                 import          output_filters
+from detsim.io        .hdf5_io                 import           save_run_info
+from detsim.simulation.scintillation_functions import            radial_rings
+from detsim.simulation.scintillation_functions import    relative_coordinates
+from detsim.simulation.scintillation_functions import   s1_probability_matrix
+from detsim.simulation.scintillation_functions import    s1_probability_table
+from detsim.simulation.scintillation_functions import            s1_waveforms
+from detsim.util      .rng                     import               event_rng
+from detsim.util      .util                    import       detector_geometry
+
+from invisible_cities.core.system_of_units_c import          units
+from invisible_cities.io  .mcinfo_io         import mc_info_writer
+
+from invisible_cities.dataflow          import dataflow as fl
+from invisible_cities.dataflow.dataflow import     fork
+from invisible_cities.dataflow.dataflow import     pipe
+from invisible_cities.dataflow.dataflow import     push
+
+
+def s1_buffers(binned_s1  : Callable  ,
+               sipm_buffer: np.ndarray) -> Callable:
+    """
+    One (pmt, sipm) buffer per event with the
+    binned S1 of the event hits and the SiPMs
+    empty, as the position_signal buffers.
+    The hit times are taken relative to the
+    first hit of the event, the buffer trigger.
+    """
+    def event_buffers(hits: pd.DataFrame, rng: np.random.Generator) -> List:
+        hit_times  = hits.time.values - hits.time.min()
+        pmt_buffer = binned_s1(hits.x     .values, hits.y     .values,
+                               hits.z     .values, hit_times         ,
+                               hits.energy.values, rng              )
+        return [(pmt_buffer, sipm_buffer)]
+    return event_buffers
+
+
+def s1_trigger_time(timestamp: float, hits: pd.DataFrame) -> List:
+    """
+    Time of the buffer of the event, its first hit,
+    as position_signal's trigger_times.
+    """
+    return [timestamp + hits.time.min()]
+
+
+def s1_simulation(conf):
+
+    files_in      =        glob(os.path.expandvars(conf.files_in))
+    file_out      =             os.path.expandvars(conf.file_out)
+    detector_db   =                                conf.detector_db
+    run_number    =                            int(conf.run_number)
+    buffer_length =                          float(conf.buffer_length)
+    pre_trigger   =                          float(conf.pre_trigger)
+    pmt_wid       =                          float(conf.pmt_bin_width) * units.ns
+    sipm_wid      =                          float(conf.sipm_bin_width) * units.ns
+    s1_params     =                                conf.s1_params
+    n_bins_phi    =                            int(conf.n_bins_phi)
+    seed          =                            int(conf.seed)
+    compression   =                                conf.compression
+    s1_grid       =            bool(getattr(conf,     's1_grid',   False))
+    grid_r_max    =           float(getattr(conf,  'grid_r_max',   1000))
+    grid_z_max    =           float(getattr(conf,  'grid_z_max',   1000))
+    hit_chunk     =             int(getattr(conf,   'hit_chunk',  10000))
+    photon_chunk  =             int(getattr(conf, 'photon_chunk', 1000000))
+    write_batch   =             int(getattr(conf, 'write_batch',      1))
+    sample_dtype  =                 getattr(conf, 'sample_dtype', 'int16')
+    setup_cache   =                 getattr(conf, 'setup_cache',   None)
+    zs_sipm       =            bool(getattr(conf,     'zs_sipm',  False))
+
+    geometry      = detector_geometry(detector_db, run_number, setup_cache)
+    nsamp_pmt     = int(buffer_length * units.mus /  pmt_wid)
+    nsamp_sipm    = int(buffer_length * units.mus / sipm_wid)
+    parameters    = np.load(os.path.expandvars(s1_params))
+    if s1_grid:
+        probability = s1_probability_table(n_bins_phi, parameters,
+                                           grid_r_max, grid_z_max,
+                                           cache_dir = setup_cache)
+    else:
+        probability = s1_probability_matrix(n_bins_phi, parameters)
+
+    binned_s1     = s1_waveforms(relative_coordinates(detector_db, run_number),
+                                 probability                                 ,
+                                 radial_rings(geometry.pmt_xy)               ,
+                                 pmt_wid, nsamp_pmt, -pre_trigger * units.mus,
+                                 hit_chunk    = hit_chunk                    ,
+                                 photon_chunk = photon_chunk                 )
+    sipm_buffer   = np.zeros((geometry.n_sipm, nsamp_sipm), int)
+
+    event_rng_    = fl.map(event_rng(seed),
+                           args = ("file_name", "evt"),
+                           out  = "rng")
+
+    simulate_s1   = fl.map(s1_buffers(binned_s1, sipm_buffer),
+                           args = ("hits", "rng"),
+                           out  = "buffers")
+
+    event_times   = fl.map(s1_trigger_time,
+                           args = ("timestamp", "hits"),
+                           out  = "evt_times")
+
+    with tb.open_file(file_out, "w", filters=output_filters(compression)) as h5out:
+
+        write_mc       = fl.sink(mc_info_writer(h5out),
+                                 args = ("mc", "evt"))
+        write_buffers  = buffer_writer(h5out                          ,
+                                       n_sens_eng     = geometry.n_pmt ,
+                                       n_sens_trk     = geometry.n_sipm,
+                                       length_eng     = nsamp_pmt      ,
+                                       length_trk     = nsamp_sipm     ,
+                                       detector_order = True           ,
+                                       batch_size     = write_batch    ,
+                                       compression    = compression    ,
+                                       sample_dtype   = sample_dtype   ,
+                                       zs_trk         = zs_sipm        ,
+                                       trk_ids        = geometry.sipm_ids)
+        buffer_writer_ = fl.sink(write_buffers,
+                                 args = ("evt", "evt_times", "buffers"))
+
+        save_run_info(h5out, run_number)
+        result = push(source = load_hits(files_in),
+                      pipe   = pipe(event_rng_    ,
+                                    simulate_s1   ,
+                                    event_times   ,
+                                    fork(buffer_writer_,
+                                         write_mc      )))
+        write_buffers.flush()
+        return result
+
+
+
+if __name__ == "__main__":
+    from invisible_cities.core.configure import configure
+
+    conf = configure(sys.argv).as_namespace
+    s1_simulation(conf)
@@ -0,0 +1,84 @@
+import os
+
+import numpy  as np
+import pandas as pd
+import tables as tb
+
+from pytest import fixture
+
+from invisible_cities.core.configure import configure
+
+from . s1_simulation                      import            s1_buffers
+from . s1_simulation                      import         s1_simulation
+from . s1_simulation                      import       s1_trigger_time
+from . simulation.scintillation_functions import                   WS_
+from . simulation.scintillation_functions import s1_probability_matrix
+from . simulation.scintillation_functions import          s1_waveforms
+
+
+@fixture(scope = 'session')
+def s1_test_config():
+    return os.path.join(os.environ['DETSIMDIR'], "config/s1_test_config.conf")
+
+
+@fixture(scope = 'session')
+def s1_params():
+    ## Constant probability for all PMTs, that of the example config
+    return os.path.join(os.environ['DETSIMDIR'], "test_data/s1_params.npy")
+
+
+def test_s1_simulation(config_tmpdir, fullsim_data, s1_test_config, s1_params):
+
+    outputs = []
+    for i in range(2):
+        PATH_OUT = os.path.join(config_tmpdir, f'Kr_fullsim_{i}.s1.h5')
+        outputs.append(PATH_OUT)
+
+        conf = configure(['dummy', s1_test_config])
+        conf.update(dict(files_in  = fullsim_data,
+                         file_out  =     PATH_OUT,
+                         s1_params =    s1_params))
+        s1_simulation(conf.as_namespace)
+
+    with tb.open_file(fullsim_data) as h5in, \
+         tb.open_file(outputs[0])   as h5out, \
+         tb.open_file(outputs[1])   as h5rep:
+
+        n_evt = len(h5in.root.MC.extents)
+        pmtrd = h5out.root.pmtrd
+        assert pmtrd.shape == (n_evt, 12, 800)
+        assert len(h5out.root.Run.events) == n_evt
+        assert h5out.root.sipmrd.shape == (n_evt, 1792, 20)
+        assert not np.any(h5out.root.sipmrd[:])
+        assert hasattr(h5out.root.MC, 'hits')
+
+        ## Light seen and reproducible with the same seed
+        assert pmtrd[:].sum() > 0
+        assert np.all(pmtrd[:] == h5rep.root.pmtrd[:])
+
+
+def test_s1_buffers_time_offset(s1_params):
+
+    n_pmts     = 4
+    rel_coords = lambda x, y: (np.hypot(x, y)[:, None] * np.ones(n_pmts),
+                               np.zeros((len(x), n_pmts)))
+    binned_s1  = s1_waveforms(rel_coords, s1_probability_matrix(10, np.load(s1_params)),
+                              np.array([0, 0, 1, 1]), 25, 400, -1000)
+    buffers    = s1_buffers(binned_s1, np.zeros((10, 20), int))
+
+    rng  = np.random.default_rng(5)
+    hits = pd.DataFrame(dict(x      = rng.uniform(-100, 100, 10),
+                             y      = rng.uniform(-100, 100, 10),
+                             z      = rng.uniform(   0, 500, 10),
+                             time   = 100 + rng.uniform(0, 50, 10),
+                             energy = np.full(10, 2e4 * WS_())))
+    late = hits.assign(time = hits.time + 1e9)
+
+    ((pmts     , _),) = buffers(hits, np.random.default_rng(6))
+    ((late_pmts, _),) = buffers(late, np.random.default_rng(6))
+    ## Same buffer for the event at a large time offset
+    assert pmts.sum() > 0
+    assert np.all(late_pmts == pmts)
+    ## Light from the pre-trigger of 1000 ns on
+    assert np.all(pmts[:, :1000 // 25] == 0)
+    assert s1_trigger_time(5e9, late) == [5e9 + late.time.min()]
@@ -1,31 +1,421 @@
 import numpy  as np
 import pandas as pd
 
-from invisible_cities.reco.peak_functions    import indices_and_wf_above_threshold
-from invisible_cities.reco.peak_functions    import                 split_in_peaks
-from invisible_cities.evm .event_model       import                       Waveform
-from invisible_cities.core.system_of_units_c import                          units
+from invisible_cities.reco.peak_functions    import split_in_peaks
+from invisible_cities.evm .event_model       import       Waveform
+from invisible_cities.core.system_of_units_c import          units
 
 from typing    import  Callable
 from typing    import Generator
+from typing    import  Iterable
 from typing    import      List
 from typing    import   Mapping
+from typing    import NamedTuple
 from typing    import     Tuple
 
 from functools import     wraps
 
+from detsim.util.util import first_and_last_times
+
+
+class SparseWaveforms(NamedTuple):
+    """
+    CSR-like binned waveforms which only keep the
+    non-empty bins. The samples of sensor ids[i] are
+    bin_indx[offsets[i]:offsets[i+1]] with charges
+    charges[offsets[i]:offsets[i+1]].
+    """
+    ids     : np.ndarray
+    offsets : np.ndarray
+    bin_indx: np.ndarray
+    charges : np.ndarray
+    n_bins  :        int
+
+    @property
+    def index(self) -> pd.Index:
+        return pd.Index(self.ids, name='sensor_id')
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.ids), self.n_bins
+
+    def to_dense(self, out: np.ndarray = None, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Expands into a dense (sensor, bin) array.
+
+        out  : np.ndarray
+               Array to be filled, by default a new
+               zeroed (n_sensors, n_bins) array
+        rows : np.ndarray
+               Row of out for each sensor, by default
+               the order of ids
+        """
+        if out  is None:
+            out  = np.zeros(self.shape, self.charges.dtype)
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        sensor_rows = np.repeat(np.asarray(rows), np.diff(self.offsets))
+        out[sensor_rows, self.bin_indx] = self.charges
+        return out
+
 
 @wraps(np.histogram)
 def weighted_histogram(data: pd.DataFrame, bins: np.ndarray) -> np.ndarray:
     return np.histogram(data.time, weights=data.charge, bins=bins)[0]
 
 
-def padder(sensors: np.ndarray, padding: Tuple) -> np.ndarray:
-    return np.apply_along_axis(np.pad, 1, sensors, padding, "constant")
+def bin_indices(times: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    """
+    Index of the bin containing each time for uniformly
+    spaced bin edges, following the np.histogram convention
+    of closing the last bin on the right.
+    Times below the first edge get -1 and those
+    above the last edge get len(bins) - 1. With
+    less than two edges there are no bins and
+    all times get -1.
+
+    times : np.ndarray
+            Times to be binned
+    bins  : np.ndarray
+            Uniformly spaced bin edges
+    """
+    n_bins   = len(bins) - 1
+    if n_bins < 1:
+        return np.full(len(times), -1)
+    width    = (bins[-1] - bins[0]) / n_bins
+    bin_indx = np.floor((times - bins[0]) / width).astype(int)
+    np.clip(bin_indx, 0, n_bins - 1, out=bin_indx)
+
+    ## Correct for rounding with respect to the actual edges
+    bin_indx -= times <  bins[bin_indx    ]
+    bin_indx += times >= bins[bin_indx + 1]
+    bin_indx[times == bins[-1]] = n_bins - 1
+    return bin_indx
+
+
+def bin_sensors(sensor_ids: np.ndarray,
+                times     : np.ndarray,
+                charges   : np.ndarray,
+                bins      : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bins the charge of all sensors at once.
+    Equivalent to a weighted np.histogram per sensor
+    (last bin closed on the right) but done as a single
+    accumulation over a flat (sensor, bin) index.
+
+    sensor_ids : np.ndarray
+                 Sensor id of each sample
+    times      : np.ndarray
+                 Time of each sample
+    charges    : np.ndarray
+                 Charge of each sample
+    bins       : np.ndarray
+                 Uniformly spaced bin edges common to all sensors
+
+    returns
+        ids : np.ndarray
+              Sorted ids of the sensors with samples
+        wfs : np.ndarray
+              (len(ids), len(bins) - 1) binned charge
+    """
+    ids, sns_indx = np.unique(sensor_ids, return_inverse=True)
+    n_bins        = max(len(bins) - 1, 0)
+
+    bin_indx      = bin_indices(times, bins)
+    in_range      = (bin_indx >= 0) & (bin_indx < n_bins)
+
+    flat_indx     = sns_indx[in_range] * n_bins + bin_indx[in_range]
+    wfs           = np.bincount(flat_indx                        ,
+                                weights   = charges[in_range]    ,
+                                minlength = len(ids) * n_bins    )
+    return ids, wfs.reshape(len(ids), n_bins).astype(charges.dtype, copy=False)
+
+
+def bin_sensors_sparse(sensor_ids: np.ndarray,
+                       times     : np.ndarray,
+                       charges   : np.ndarray,
+                       bins      : np.ndarray) -> SparseWaveforms:
+    """
+    As bin_sensors but only the non-empty
+    (sensor, bin) pairs are kept so no
+    dense array is allocated.
+    """
+    ids, sns_indx = np.unique(sensor_ids, return_inverse=True)
+    n_bins        = max(len(bins) - 1, 0)
+
+    bin_indx      = bin_indices(times, bins)
+    in_range      = (bin_indx >= 0) & (bin_indx < n_bins)
+
+    flat_indx     = sns_indx[in_range] * n_bins + bin_indx[in_range]
+    filled, indx  = np.unique(flat_indx, return_inverse=True)
+    flat_charge   = np.bincount(indx, weights=charges[in_range])
+
+    offsets       = np.searchsorted(filled // n_bins, np.arange(len(ids) + 1))
+    return SparseWaveforms(ids                                        ,
+                           offsets                                    ,
+                           filled % n_bins                            ,
+                           flat_charge.astype(charges.dtype, copy=False),
+                           n_bins                                     )
 
 
-def calculate_buffers(buffer_len: float, pre_trigger: float,
-                      pmt_binwid: float, sipm_binwid: float) -> Callable:
+def event_bin_indices(times      : np.ndarray,
+                      evt_indx   : np.ndarray,
+                      edges      : np.ndarray,
+                      edge_offset: np.ndarray) -> np.ndarray:
+    """
+    As bin_indices for the samples of several
+    events each with its own bin edges.
+
+    times       : np.ndarray
+                  Time of each sample
+    evt_indx    : np.ndarray
+                  Event position of each sample
+    edges       : np.ndarray
+                  Concatenated uniformly spaced bin edges of all events
+    edge_offset : np.ndarray
+                  Position in edges of the first edge of each event
+                  followed by the total number of edges
+    """
+    first    = edge_offset[:-1][evt_indx]
+    last     = edge_offset[1: ][evt_indx] - 1
+    n_bins   = last - first
+    width    = (edges[last] - edges[first]) / n_bins
+    bin_indx = np.floor((times - edges[first]) / width).astype(int)
+    np.clip(bin_indx, 0, n_bins - 1, out=bin_indx)
+
+    ## Correct for rounding with respect to the actual edges
+    bin_indx -= times <  edges[first + bin_indx    ]
+    bin_indx += times >= edges[first + bin_indx + 1]
+    at_last   = times == edges[last]
+    bin_indx[at_last] = n_bins[at_last] - 1
+    return bin_indx
+
+
+def bin_event_block(evt_indx  :         np.ndarray ,
+                    sensor_ids:         np.ndarray ,
+                    times     :         np.ndarray ,
+                    charges   :         np.ndarray ,
+                    bins      : List[np.ndarray]   ,
+                    sparse    :               bool = False) -> List[Tuple]:
+    """
+    bin_sensors (or bin_sensors_sparse) for several events
+    at once. The samples are accumulated on a flat
+    (event, sensor, bin) index so that the binned
+    waveforms of all events share one array.
+
+    evt_indx   : np.ndarray
+                 Event position (in bins) of each sample
+    sensor_ids : np.ndarray
+                 Sensor id of each sample
+    times      : np.ndarray
+                 Time of each sample
+    charges    : np.ndarray
+                 Charge of each sample
+    bins       : List of np.ndarray
+                 Bin edges for each event, events with
+                 less than two edges getting no bins
+    sparse     : bool
+                 Return SparseWaveforms instead of dense arrays
+
+    returns
+        List with (ids, wfs) for each event in the dense case,
+        wfs being a view of the block array, or SparseWaveforms.
+    """
+    n_evt       = len(bins)
+    n_edges     = np.array([len(evt_bins) for evt_bins in bins], int)
+    n_bins      = np.maximum(n_edges - 1, 0)
+    edge_offset = np.concatenate(([0], np.cumsum(n_edges)))
+
+    ## Samples of events without bins are left out of range
+    has_bins    = n_bins[evt_indx] > 0
+    bin_indx    = np.full(len(times), -1)
+    bin_indx[has_bins] = event_bin_indices(times   [has_bins], evt_indx[has_bins],
+                                           np.concatenate(bins), edge_offset     )
+
+    ## Sensors of each event sorted by (event, sensor_id)
+    sensor_ids  = np.asarray(sensor_ids)
+    id_span     = np.max(sensor_ids, initial=0) + 1
+    pairs, row  = np.unique(evt_indx * id_span + sensor_ids,
+                            return_inverse=True)
+    pair_ids    = pairs % id_span
+    row_offset  = np.searchsorted(pairs // id_span, np.arange(n_evt + 1))
+    n_rows      = np.diff(row_offset)
+
+    data_offset = np.concatenate(([0], np.cumsum(n_rows * n_bins)))
+    in_range    = (bin_indx >= 0) & (bin_indx < n_bins[evt_indx])
+    evt_indx    = evt_indx[in_range]
+    flat_indx   = (data_offset[evt_indx]
+                   + (row[in_range] - row_offset[evt_indx]) * n_bins[evt_indx]
+                   + bin_indx[in_range])
+
+    evt_ids = [pair_ids[row_offset[i]:row_offset[i + 1]] for i in range(n_evt)]
+    if sparse:
+        filled, indx = np.unique(flat_indx, return_inverse=True)
+        flat_charge  = np.bincount(indx, weights=charges[in_range])
+        flat_charge  = flat_charge.astype(charges.dtype, copy=False)
+        evt_filled   = np.searchsorted(filled, data_offset)
+
+        binned = []
+        for i, ids in enumerate(evt_ids):
+            evt_slice = slice(evt_filled[i], evt_filled[i + 1])
+            local     = filled[evt_slice] - data_offset[i]
+            offsets   = np.searchsorted(local // n_bins[i],
+                                        np.arange(n_rows[i] + 1))
+            binned.append(SparseWaveforms(ids                    ,
+                                          offsets                ,
+                                          local % n_bins[i]      ,
+                                          flat_charge[evt_slice] ,
+                                          n_bins[i]              ))
+        return binned
+
+    flat_wfs = np.bincount(flat_indx                      ,
+                           weights   = charges[in_range]  ,
+                           minlength = data_offset[-1]    )
+    flat_wfs = flat_wfs.astype(charges.dtype, copy=False)
+    return [(ids, flat_wfs[data_offset[i]:data_offset[i + 1]].reshape(n_rows[i],
+                                                                      n_bins[i]))
+            for i, ids in enumerate(evt_ids)]
+
+
+def as_sensor_array(wfs: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the (n_sensors, n_bins) array of binned charge.
+    DataFrames from wf_binner are viewed without copy,
+    Series of per-sensor arrays or lists are stacked.
+    """
+    if isinstance(wfs, pd.Series):
+        return np.array(wfs.tolist())
+    return np.asarray(wfs)
+
+
+def dense_windows(charge: np.ndarray       ,
+                  starts: np.ndarray       ,
+                  length:        int       ,
+                  out   : np.ndarray = None,
+                  rows  : np.ndarray = None) -> np.ndarray:
+    """
+    Bins [start, start + length) of all sensors for each
+    start, zero where outside the binned range.
+    The windows are allocated at once as a
+    (len(starts), n_sensors, length) array and each is
+    filled with a single slice assignment.
+
+    charge : np.ndarray
+             (n_sensors, n_bins) binned charge
+    starts : np.ndarray
+             First bin of each window, can be negative
+    length : int
+             Number of bins in each window
+    out    : np.ndarray
+             Zeroed (len(starts), n_rows, length) array to
+             be filled instead of allocating the windows
+    rows   : np.ndarray
+             Row of out for each sensor, by default
+             the sensor order of charge
+    """
+    if out  is None:
+        out  = np.zeros((len(starts), charge.shape[0], length), charge.dtype)
+    if rows is None:
+        rows = slice(None)
+
+    n_bin = charge.shape[1]
+    for window, start in zip(out, starts):
+        first = max(0    , start         )
+        last  = min(n_bin, start + length)
+        if last > first:
+            window[rows, first - start:last - start] = charge[:, first:last]
+    return out
+
+
+def sparse_window(wfs: SparseWaveforms, start: int, length: int) -> SparseWaveforms:
+    """
+    A dense_windows window for SparseWaveforms, only
+    the samples inside the window are copied.
+    """
+    in_window = (wfs.bin_indx >= start) & (wfs.bin_indx < start + length)
+    n_in      = np.concatenate(([0], np.cumsum(in_window)))
+    return SparseWaveforms(wfs.ids                         ,
+                           n_in[wfs.offsets]               ,
+                           wfs.bin_indx[in_window] - start ,
+                           wfs.charges [in_window]         ,
+                           length                          )
+
+
+def buffer_starts(triggers   : np.ndarray,
+                  pmt_bins   : np.ndarray,
+                  sipm_bins  : np.ndarray,
+                  pmt_binwid :      float,
+                  pmt_pretrg :        int,
+                  sipm_pretrg:        int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    First PMT and SiPM bin of the buffer for each trigger.
+    The SiPM bins containing the triggers are found
+    together and the PMT pre-trigger is corrected for
+    the offset between the two binnings.
+    Raises ValueError for triggers before the first
+    SiPM bin edge, as the SiPM binning should start
+    at or before the first PMT bin.
+    """
+    trg_times = pmt_bins[triggers]
+    sipm_trg  = np.searchsorted(sipm_bins, trg_times, side='right') - 1
+    if np.any(sipm_trg < 0):
+        raise ValueError(f"Triggers at {trg_times[sipm_trg < 0]} before "
+                         f"the first SiPM bin edge {sipm_bins[0]}")
+    bin_corr  = ((trg_times - sipm_bins[sipm_trg]) / pmt_binwid).astype(int)
+    return triggers - pmt_pretrg - bin_corr, sipm_trg - sipm_pretrg
+
+
+def binned_windows(sensor_ids: np.ndarray       ,
+                   times     : np.ndarray       ,
+                   charges   : np.ndarray       ,
+                   bins      : np.ndarray       ,
+                   starts    : np.ndarray       ,
+                   length    :        int       ,
+                   out       : np.ndarray = None,
+                   rows      : np.ndarray = None) -> np.ndarray:
+    """
+    Bins the raw samples only inside the windows
+    [start, start + length) of bins, giving the same as
+    bin_sensors followed by dense_windows without binning
+    the rest of the event.
+
+    sensor_ids : np.ndarray
+                 Sensor id of each sample
+    times      : np.ndarray
+                 Time of each sample
+    charges    : np.ndarray
+                 Charge of each sample
+    bins       : np.ndarray
+                 Uniformly spaced bin edges of the whole event
+    starts     : np.ndarray
+                 First bin of each window, can be negative
+    length     : int
+                 Number of bins in each window
+    out, rows  : As for dense_windows
+    """
+    ids, sns_indx = np.unique(sensor_ids, return_inverse=True)
+    n_bins        = max(len(bins) - 1, 0)
+    bin_indx      = bin_indices(times, bins)
+
+    if out  is None:
+        out  = np.zeros((len(starts), len(ids), length), charges.dtype)
+    if rows is None:
+        rows = slice(None)
+
+    for window, start in zip(out, starts):
+        in_window = ((bin_indx >= max(0     , start         )) &
+                     (bin_indx <  min(n_bins, start + length)))
+        flat_indx = sns_indx[in_window] * length + bin_indx[in_window] - start
+        binned    = np.bincount(flat_indx                          ,
+                                weights   = charges[in_window]     ,
+                                minlength = len(ids) * length      )
+        window[rows] = binned.reshape(len(ids), length)
+    return out
+
+
+def calculate_buffers(buffer_len: float      , pre_trigger: float      ,
+                      pmt_binwid: float      , sipm_binwid: float      ,
+                      n_sens_eng:   int = None, n_sens_trk :   int = None) -> Callable:
     """
     Calculates the output buffers for all sensors
     based on a configured buffer length and pretrigger.
@@ -38,83 +428,160 @@ def calculate_buffers(buffer_len: float, pre_trigger: float,
                   Width in mus of PMT sample integration
     sipm_binwid : float
                   Width in mus of SiPM sample integration
+    n_sens_eng  : int
+                  Number of energy plane sensors in the detector.
+                  If given with n_sens_trk the buffers are filled
+                  directly as full detector arrays in detector
+                  order, using the sensor orders given by
+                  sensor_order as extra arguments.
+    n_sens_trk  : int
+                  Number of tracking plane sensors in the detector
     """
 
     pmt_buffer_samples  = int(buffer_len * units.mus /  pmt_binwid)
     sipm_buffer_samples = int(buffer_len * units.mus / sipm_binwid)
     sipm_pretrg         = int(pre_trigger * units.mus / sipm_binwid)
-    sipm_postrg         = sipm_buffer_samples - sipm_pretrg
     pmt_pretrg_         = int(pre_trigger * units.mus / pmt_binwid)
-    pmt_postrg_         = pmt_buffer_samples - pmt_pretrg_
 
 
-    def sipm_trg_bin(sipm_bins: np.ndarray,
-                     pmt_bins : np.ndarray) -> Callable[[int], int]:
-        def get_sipm_bin(trigger: int) -> int:
-            return np.where(sipm_bins <= pmt_bins[trigger])[0][-1]
-        return get_sipm_bin
+    def position_signal(triggers   :         List      ,
+                        pmt_bins   :   np.ndarray      ,
+                        pmt_charge : pd.DataFrame      ,
+                        sipm_bins  :   np.ndarray      ,
+                        sipm_charge: pd.DataFrame      ,
+                        pmt_ord    :   np.ndarray = None,
+                        sipm_ord   :   np.ndarray = None) -> List:
+        """
+        SiPM charge can be given as SparseWaveforms in which
+        case the SiPM buffers are also sparse unless they
+        are filled as full detector arrays.
+        """
 
+        triggers    = np.asarray(triggers, int)
+        pmt_starts, sipm_starts = buffer_starts(triggers  , pmt_bins   , sipm_bins  ,
+                                                pmt_binwid, pmt_pretrg_, sipm_pretrg)
 
-    def slice_generator(pmt_bins   : np.ndarray,
-                        pmt_charge : np.ndarray,
-                        sipm_bins  : np.ndarray,
-                        sipm_charge: np.ndarray) -> Generator:
+        if n_sens_eng is None or n_sens_trk is None:
+            pmt_out  = sipm_out  = None
+            pmt_rows = sipm_rows = None
+        else:
+            pmt_out   = np.zeros((len(triggers), n_sens_eng,  pmt_buffer_samples), int)
+            sipm_out  = np.zeros((len(triggers), n_sens_trk, sipm_buffer_samples), int)
+            pmt_rows  = np.asarray( pmt_ord)
+            sipm_rows = np.asarray(sipm_ord)
+
+        pmt_buffers = dense_windows(as_sensor_array(pmt_charge),
+                                    pmt_starts, pmt_buffer_samples,
+                                    pmt_out   , pmt_rows          )
+        if isinstance(sipm_charge, SparseWaveforms):
+            sipm_buffers = [sparse_window(sipm_charge, start, sipm_buffer_samples)
+                            for start in sipm_starts]
+            if sipm_out is not None:
+                for buffer, window in zip(sipm_out, sipm_buffers):
+                    window.to_dense(buffer, sipm_rows)
+                sipm_buffers = sipm_out
+        else:
+            sipm_buffers = dense_windows(as_sensor_array(sipm_charge),
+                                         sipm_starts, sipm_buffer_samples,
+                                         sipm_out   , sipm_rows          )
+        return list(zip(pmt_buffers, sipm_buffers))
+    return position_signal
 
-        npmt_bin  = len(pmt_bins)
-        nsipm_bin = len(sipm_bins)
-        sipm_trg  = sipm_trg_bin(sipm_bins, pmt_bins)
 
-        def generate_slices(triggers: List) -> Tuple:
+def calculate_lazy_buffers(buffer_len: float      , pre_trigger: float      ,
+                           pmt_binwid: float      , sipm_binwid: float      ,
+                           n_sens_eng:   int = None, n_sens_trk :   int = None) -> Callable:
+    """
+    As calculate_buffers but taking the raw sensor
+    samples instead of the binned event. Only the
+    samples inside the buffer windows are binned so the
+    cost scales with the buffer length rather than with
+    the event time span. Used with summed_wf_binner,
+    which finds the triggers from the raw PMT samples,
+    this avoids binning the full event.
+    """
 
-            for trg in triggers:
-                trg_bin    = sipm_trg(trg)
+    pmt_buffer_samples  = int(buffer_len * units.mus /  pmt_binwid)
+    sipm_buffer_samples = int(buffer_len * units.mus / sipm_binwid)
+    sipm_pretrg         = int(pre_trigger * units.mus / sipm_binwid)
+    pmt_pretrg_         = int(pre_trigger * units.mus / pmt_binwid)
 
-                bin_corr   = (pmt_bins[trg] - sipm_bins[trg_bin]) / pmt_binwid
-                pmt_pretrg = pmt_pretrg_ + int(bin_corr)
-                pmt_postrg = pmt_postrg_ - int(bin_corr)
 
-                pmt_pre    = 0       , trg - pmt_pretrg
-                pmt_pos    = npmt_bin, trg + pmt_postrg
-                pmt_sl     = slice(max(pmt_pre), min(pmt_pos))
-                pmt_pad    = (int(-min(pmt_pre)),
-                              int( max(0, pmt_pos[1] - npmt_bin + 1)))
+    def position_signal(triggers:         List      ,
+                        pmt_bins:   np.ndarray      ,
+                        pmt_wfs : pd.DataFrame      ,
+                        sipm_wfs: pd.DataFrame      ,
+                        pmt_ord :   np.ndarray = None,
+                        sipm_ord:   np.ndarray = None) -> List:
 
-                sipm_pre   = 0        , trg_bin - sipm_pretrg
-                sipm_pos   = nsipm_bin, trg_bin + sipm_postrg
-                sipm_sl    = slice(max(sipm_pre), min(sipm_pos))
-                sipm_pad   = (int(-min(sipm_pre)),
-                              int( max(0, sipm_pos[1] - nsipm_bin + 1)))
+        sipm_bins   = bin_edges(sipm_binwid, *first_and_last_times(pmt_bins))
+        triggers    = np.asarray(triggers, int)
+        pmt_starts, sipm_starts = buffer_starts(triggers  , pmt_bins   , sipm_bins  ,
+                                                pmt_binwid, pmt_pretrg_, sipm_pretrg)
 
-                yield ((pmt_charge [:,  pmt_sl],  pmt_pad),
-                       (sipm_charge[:, sipm_sl], sipm_pad))
-        return generate_slices
+        if n_sens_eng is None or n_sens_trk is None:
+            pmt_out  = sipm_out  = None
+            pmt_rows = sipm_rows = None
+        else:
+            pmt_out   = np.zeros((len(triggers), n_sens_eng,  pmt_buffer_samples), int)
+            sipm_out  = np.zeros((len(triggers), n_sens_trk, sipm_buffer_samples), int)
+            pmt_rows  = np.asarray( pmt_ord)
+            sipm_rows = np.asarray(sipm_ord)
+
+        pmt_buffers  = binned_windows(pmt_wfs .index.get_level_values('sensor_id'),
+                                      pmt_wfs .time  .values                     ,
+                                      pmt_wfs .charge.values                     ,
+                                      pmt_bins, pmt_starts, pmt_buffer_samples   ,
+                                      pmt_out , pmt_rows                         )
+        sipm_buffers = binned_windows(sipm_wfs.index.get_level_values('sensor_id'),
+                                      sipm_wfs.time  .values                     ,
+                                      sipm_wfs.charge.values                     ,
+                                      sipm_bins, sipm_starts, sipm_buffer_samples,
+                                      sipm_out , sipm_rows                       )
+        return list(zip(pmt_buffers, sipm_buffers))
+    return position_signal
 
 
-    def position_signal(triggers   :       List,
-                        pmt_bins   : np.ndarray,
-                        pmt_charge :  pd.Series,
-                        sipm_bins  : np.ndarray,
-                        sipm_charge:  pd.Series) -> List:
+def bin_edges(bin_width : float       ,
+              t_min     : float       ,
+              t_max     : float       ,
+              max_buffer: float = None) -> np.ndarray:
+    """
+    Bin edges covering [t_min, t_max] aligned to bin_width.
 
-        slice_and_pad = slice_generator(pmt_bins                      ,
-                                        np.array(pmt_charge .tolist()),
-                                        sipm_bins                     ,
-                                        np.array(sipm_charge.tolist()))
+    max_buffer : float
+        When given the edges are those of the sensors
+        with first and last samples t_min and t_max,
+        the range being limited to max_buffer. Otherwise
+        t_min and t_max are taken as already binned limits
+        as for SiPMs binned with the PMT limits in NEW.
+    """
+    if max_buffer is not None:
+        max_time = min(t_max, t_min + max_buffer)
+        min_bin  = np.floor(t_min    / bin_width) * bin_width
+        max_bin  = np.floor(max_time / bin_width) * bin_width
+        max_bin += bin_width
+    else:
+        ## Adjust according to bin_width
+        min_bin  = np.floor(t_min / bin_width) * bin_width
+        max_bin  = np.ceil (t_max / bin_width) * bin_width
 
-        return [(padder(*pmts), padder(*sipms))
-                for pmts, sipms in slice_and_pad(triggers)]
-    return position_signal
+    return np.arange(min_bin, max_bin, bin_width)
 
 
-def wf_binner(max_buffer: int) -> Callable:
+def wf_binner(max_buffer: int, sparse: bool = False) -> Callable:
     """
     Returns a function to be used to convert the raw
     input Waveforms into data binned according to
     the bin width stored in the Waveforms, effectively
     padding with zeros inbetween the separate signals.
+    All sensors are binned together with bin_sensors
+    and returned as a (sensor_id, bin) DataFrame.
 
     max_buffer : float
         Maximum event time to be considered in nanoseconds
+    sparse     : bool
+        Return SparseWaveforms instead of a dense DataFrame
     """
     def bin_data(sensors  : pd.Series   ,
                  bin_width: float       ,
@@ -134,33 +601,185 @@ def wf_binner(max_buffer: int) -> Callable:
             As t_min but the maximum to be used
         """
         if t_min is None or t_max is None:
-            min_time = sensors.time.min()
-            max_time = min(sensors.time.max()   ,
-                           min_time + max_buffer)
-            min_bin  = np.floor(min_time / bin_width) * bin_width
-            max_bin  = np.floor(max_time / bin_width) * bin_width
-            max_bin += bin_width
+            bins = bin_edges(bin_width, sensors.time.min(),
+                             sensors.time.max(), max_buffer)
         else:
-            ## Adjust according to bin_width
-            min_bin  = np.floor(t_min / bin_width) * bin_width
-            max_bin  = np.ceil (t_max / bin_width) * bin_width
+            bins = bin_edges(bin_width, t_min, t_max)
+
+        sensor_data = (sensors.index.get_level_values('sensor_id'),
+                       sensors.time  .values                     ,
+                       sensors.charge.values                     ,
+                       bins                                      )
+        if sparse:
+            return bins, bin_sensors_sparse(*sensor_data)
+
+        ids, wfs = bin_sensors(*sensor_data)
+        return bins, pd.DataFrame(wfs, index=pd.Index(ids, name='sensor_id'),
+                                  copy=False)
+    return bin_data
 
-        bins = np.arange(min_bin, max_bin, bin_width)
 
-        bin_sensors = sensors.groupby('sensor_id').apply(weighted_histogram,
-                                                         bins              )
-        return bins, bin_sensors
-    return bin_data
+def summed_wf_binner(max_buffer: float) -> Callable:
+    """
+    Returns a function binning only the sum over
+    sensors of the raw samples with the binning of
+    wf_binner. The sum is returned as a (1, n_bins)
+    array so that it can be given to signal_finder
+    in place of the binned sensors.
+
+    max_buffer : float
+        Maximum event time to be considered in nanoseconds
+    """
+    def bin_sum(sensors: pd.DataFrame, bin_width: float) -> Tuple:
+        bins     = bin_edges(bin_width, sensors.time.min(),
+                             sensors.time.max(), max_buffer)
+        n_bins   = max(len(bins) - 1, 0)
+        charges  = sensors.charge.values
+
+        bin_indx = bin_indices(sensors.time.values, bins)
+        in_range = (bin_indx >= 0) & (bin_indx < n_bins)
+        wf_sum   = np.bincount(bin_indx[in_range]           ,
+                               weights   = charges[in_range],
+                               minlength = n_bins           )
+        return bins, wf_sum.astype(charges.dtype, copy=False)[np.newaxis]
+    return bin_sum
+
+
+def block_binner(max_buffer: float, sparse: bool = False) -> Callable:
+    """
+    Returns a function which bins the PMTs and SiPMs
+    of a block of events as wf_binner does event by
+    event, but with one pass over all the samples of
+    the block for each sensor type.
+
+    max_buffer : float
+        Maximum event time to be considered in nanoseconds
+    sparse     : bool
+        Return the SiPMs as SparseWaveforms
+    """
+    def bin_block(evts       :   np.ndarray,
+                  pmt_wfs    : pd.DataFrame,
+                  pmt_binwid :        float,
+                  sipm_wfs   : pd.DataFrame,
+                  sipm_binwid:        float) -> List[Tuple]:
+        """
+        evts     : np.ndarray
+            Event numbers of the block
+        pmt_wfs  : pd.DataFrame
+            PMT samples indexed by (event, sensor_id)
+        sipm_wfs : pd.DataFrame
+            As pmt_wfs for the SiPMs
+
+        returns
+            List with pmt_bins, pmt_wfs, sipm_bins, sipm_wfs
+            for each event as given by wf_binner. The binned
+            waveforms are views of one array for the block.
+            Events without PMT samples have empty bins and
+            waveforms with no bins.
+        """
+        evt_index = pd.Index(evts)
+        pmt_evt   = evt_index.get_indexer(pmt_wfs .index.get_level_values(0))
+        sipm_evt  = evt_index.get_indexer(sipm_wfs.index.get_level_values(0))
+
+        ## Events without PMT samples get no bins
+        t_range   = pmt_wfs.time.groupby(pmt_evt).agg(['min', 'max'])
+        t_range   = t_range.reindex(range(len(evts)))
+        pmt_bins  = [bin_edges(pmt_binwid, t_min, t_max, max_buffer)
+                     if not np.isnan(t_min) else np.empty(0)
+                     for t_min, t_max in zip(t_range['min'], t_range['max'])]
+        sipm_bins = [bin_edges(sipm_binwid, *first_and_last_times(bins))
+                     if len(bins) > 1 else np.empty(0)
+                     for bins in pmt_bins]
+
+        pmt_binned  = bin_event_block(pmt_evt                                   ,
+                                      pmt_wfs .index.get_level_values('sensor_id'),
+                                      pmt_wfs .time  .values                    ,
+                                      pmt_wfs .charge.values                    ,
+                                      pmt_bins                                  )
+        sipm_binned = bin_event_block(sipm_evt                                  ,
+                                      sipm_wfs.index.get_level_values('sensor_id'),
+                                      sipm_wfs.time  .values                    ,
+                                      sipm_wfs.charge.values                    ,
+                                      sipm_bins                                 ,
+                                      sparse                                    )
+
+        def as_frame(ids: np.ndarray, wfs: np.ndarray) -> pd.DataFrame:
+            return pd.DataFrame(wfs, index=pd.Index(ids, name='sensor_id'),
+                                copy=False)
+
+        if not sparse:
+            sipm_binned = [as_frame(*binned) for binned in sipm_binned]
+        return [(p_bins, as_frame(*p_binned), s_bins, s_binned)
+                for p_bins, p_binned, s_bins, s_binned in zip(pmt_bins   ,
+                                                              pmt_binned ,
+                                                              sipm_bins  ,
+                                                              sipm_binned)]
+    return bin_block
+
+
+def window_sums(wfs: np.ndarray, window_bins: int) -> np.ndarray:
+    """
+    Sums of the last window_bins bins (those up to and
+    including each bin) along the last axis of wfs
+    using one cumulative sum.
+    """
+    csum = np.cumsum(wfs, axis=-1)
+    sums = csum.copy()
+    sums[..., window_bins:] -= csum[..., :-window_bins]
+    return sums
+
+
+def threshold_trigger(bin_threshold: float, **kwds) -> Callable:
+    """
+    Bins where the PMT sum is above bin_threshold.
+    """
+    def above_threshold(wfs: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(wfs.sum(0) > bin_threshold)
+    return above_threshold
+
+
+def window_trigger(bin_threshold: float, window_bins: int = 1, **kwds) -> Callable:
+    """
+    Bins where the integral of the PMT sum over
+    the last window_bins bins is above bin_threshold.
+    """
+    def window_above_threshold(wfs: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(window_sums(wfs.sum(0), window_bins) > bin_threshold)
+    return window_above_threshold
+
+
+def coincidence_trigger(bin_threshold: float    ,
+                        window_bins  :   int = 1,
+                        n_coincidence:   int = 1,
+                        **kwds                  ) -> Callable:
+    """
+    Bins where at least n_coincidence PMTs have an
+    integral over the last window_bins bins above
+    bin_threshold.
+    """
+    def pmts_in_coincidence(wfs: np.ndarray) -> np.ndarray:
+        n_above = np.count_nonzero(window_sums(wfs, window_bins) > bin_threshold,
+                                   axis=0)
+        return np.flatnonzero(n_above >= n_coincidence)
+    return pmts_in_coincidence
+
+
+trigger_algorithms = dict(threshold   =   threshold_trigger,
+                          window      =      window_trigger,
+                          coincidence = coincidence_trigger)
 
 
 ## !! to-do: clarify for non-pmt versions of next
-def signal_finder(buffer_len   : float,
-                  bin_width    : float,
-                  bin_threshold:   int) -> Callable:
+def signal_finder(buffer_len   : float              ,
+                  bin_width    : float              ,
+                  bin_threshold:   int              ,
+                  algorithm    :   str = 'threshold',
+                  window       : float = None       ,
+                  n_coincidence:   int = 1          ) -> Callable:
     """
     Decides where there is signal-like
     charge according to the configuration
-    and the PMT sum in order to give
+    and the PMT waveforms in order to give
     a useful position for buffer selection
 
     buffer_len    : float
@@ -169,17 +788,188 @@ def signal_finder(buffer_len   : float,
                     Sampling width for sensors
     bin_threshold : int
                     PE threshold for selection
+    algorithm     : str
+                    Name of the trigger in trigger_algorithms
+    window        : float
+                    Integration window in ns for the
+                    window and coincidence triggers
+    n_coincidence : int
+                    Minimum number of PMTs above threshold
+                    for the coincidence trigger
     """
-
-    stand_off = int(buffer_len * units.mus / bin_width)
-    def find_signal(wfs: pd.Series) -> List[int]:
-
-        eng_sum = wfs.sum(0)
-        indices = indices_and_wf_above_threshold(eng_sum,
-                                                 bin_threshold).indices
-        ## Just using this and the stand_off for now
-        ## taking first above sum threshold.
-        ## !! To-do: make more robust with min int? or similar
+    if algorithm not in trigger_algorithms:
+        raise ValueError(f"Unknown trigger algorithm {algorithm}, "
+                         f"options are {list(trigger_algorithms)}")
+
+    stand_off   = int(buffer_len * units.mus / bin_width)
+    window_bins = 1 if window is None else max(1, int(round(window / bin_width)))
+    trigger     = trigger_algorithms[algorithm](bin_threshold                ,
+                                                window_bins   =   window_bins,
+                                                n_coincidence = n_coincidence)
+    def find_signal(wfs: pd.DataFrame) -> List[int]:
+
+        indices = trigger(np.asarray(wfs))
+        if len(indices) == 0:
+            return []
+        ## Taking the first trigger bin of each
+        ## group separated by more than stand_off.
         all_indx = split_in_peaks(indices, stand_off)
         return [pulse[0] for pulse in all_indx]
     return find_signal
+
+
+def time_ordered_chunks(sensors   : pd.DataFrame,
+                        chunk_size:          int) -> Generator:
+    """
+    Yields (times, charges) of the samples of all
+    sensors in time order, about chunk_size samples
+    at a time (more only for samples at equal times).
+    The samples of each sensor are contiguous and in
+    time order as read, so the sensors are merged chunk
+    by chunk and only the samples of a chunk are sorted.
+    Samples not in that order are first sorted by
+    (sensor, time) with one lexsort over all of them.
+    """
+    ids     = np.asarray(sensors.index.get_level_values('sensor_id'))
+    times   = sensors.time  .values
+    charges = sensors.charge.values
+    if len(times) == 0:
+        return
+
+    def sensor_bounds(ids: np.ndarray) -> np.ndarray:
+        return np.concatenate(([0], np.flatnonzero(ids[1:] != ids[:-1]) + 1, [len(ids)]))
+
+    bounds   = sensor_bounds(ids)
+    in_order = (len(np.unique(ids[bounds[:-1]])) == len(bounds) - 1 and
+                all(np.all(times[first + 1:last] >= times[first:last - 1])
+                    for first, last in zip(bounds[:-1], bounds[1:])))
+    if not in_order:
+        order   = np.lexsort((times, ids))
+        ids     = ids    [order]
+        times   = times  [order]
+        charges = charges[order]
+        bounds  = sensor_bounds(ids)
+
+    cursor = bounds[:-1].copy()
+    ends   = bounds[1: ]
+    while True:
+        active = np.flatnonzero(cursor < ends)
+        if len(active) == 0:
+            return
+        ## Up to the first time at which a sensor
+        ## reaches its share of the chunk
+        step   = max(1, chunk_size // len(active))
+        t_last = min(times[min(cursor[sns] + step, ends[sns]) - 1] for sns in active)
+        pieces = []
+        for sns in active:
+            stop = cursor[sns] + np.searchsorted(times[cursor[sns]:ends[sns]],
+                                                 t_last, side='right')
+            pieces.append(slice(cursor[sns], stop))
+            cursor[sns] = stop
+        chunk_times   = np.concatenate([times  [piece] for piece in pieces])
+        chunk_charges = np.concatenate([charges[piece] for piece in pieces])
+        order         = np.argsort(chunk_times, kind='stable')
+        yield chunk_times[order], chunk_charges[order]
+
+
+def streaming_signal_finder(buffer_len   : float,
+                            bin_width    : float,
+                            bin_threshold:   int,
+                            max_buffer   : float) -> Callable:
+    """
+    Streaming version of signal_finder working on the
+    raw samples of the triggering sensors. The samples
+    are consumed in time order keeping only a running
+    sum for the bins which can still receive charge
+    and each trigger is yielded as soon as it is final.
+    The bins are those of wf_binner so the triggers
+    are the same as those of signal_finder on the
+    binned sensors.
+
+    buffer_len    : float
+                    Configured buffer length in mus
+    bin_width     : float
+                    Sampling width for sensors
+    bin_threshold : int
+                    PE threshold for selection
+    max_buffer    : float
+                    Maximum event time to be considered in nanoseconds
+    """
+
+    stand_off = int(buffer_len * units.mus / bin_width)
+    def find_signal(sample_chunks: Iterable[Tuple]) -> Generator:
+        """
+        sample_chunks : Iterable of (times, charges)
+            The samples of the event in time order,
+            as given by time_ordered_chunks
+
+        yields
+            Trigger bin indices in the event bins
+        """
+        min_bin    = None
+        base       = 0
+        pending    = np.zeros(0)
+        on_edge    = np.zeros(0)
+        last_above = -stand_off - 1
+
+        def edges(indx: np.ndarray) -> np.ndarray:
+            ## The values np.arange gives for bin_edges
+            return np.where(indx == 1, min_bin + bin_width, min_bin + indx * delta)
+
+        def n_edges(max_time: float) -> int:
+            max_bin = np.floor(max_time / bin_width) * bin_width + bin_width
+            return int(np.ceil((max_bin - min_bin) / bin_width))
+
+        def triggers(sums: np.ndarray) -> np.ndarray:
+            nonlocal last_above
+            above = np.flatnonzero(sums > bin_threshold) + base
+            if len(above) == 0:
+                return above
+            previous   = np.concatenate(([last_above], above[:-1]))
+            last_above = above[-1]
+            return above[above - previous > stand_off]
+
+        for times, charges in sample_chunks:
+            if len(times) == 0:
+                continue
+            if min_bin is None:
+                t_first  = times[0]
+                min_bin  = np.floor(t_first / bin_width) * bin_width
+                delta    = (min_bin + bin_width) - min_bin
+                n_cut    = n_edges(t_first + max_buffer)
+            t_last       = times[-1]
+
+            bin_indx  = np.floor((times - min_bin) / delta).astype(int)
+            bin_indx -= times <  edges(bin_indx    )
+            bin_indx += times >= edges(bin_indx + 1)
+            exact     = times == edges(bin_indx)
+
+            keep      = bin_indx < n_cut
+            if not np.any(keep):
+                continue
+            local     = bin_indx[keep] - base
+            n_local   = max(len(pending), local[-1] + 1)
+            pending   = (np.pad(pending, (0, n_local - len(pending))) +
+                         np.bincount(local, charges[keep], n_local))
+            on_edge   = (np.pad(on_edge, (0, n_local - len(on_edge))) +
+                         np.bincount(local[exact[keep]],
+                                     charges[keep][exact[keep]], n_local))
+
+            ## Bins before the one previous to the last sample are final.
+            ## That one can still get charge on the last edge of the event.
+            n_final   = max(0, local[-1] - 1)
+            yield from triggers(pending[:n_final])
+            pending   = pending[n_final:]
+            on_edge   = on_edge[n_final:]
+            base     += n_final
+
+        if min_bin is None:
+            return
+
+        ## Charge on the last edge goes into the last bin
+        ## and anything after the last edge is not binned.
+        last_bin = n_edges(min(t_last, t_first + max_buffer)) - 2 - base
+        if 0 <= last_bin < len(pending) - 1:
+            pending[last_bin] += on_edge[last_bin + 1]
+        yield from triggers(pending[:max(0, last_bin + 1)])
+    return find_signal
@@ -1,16 +1,30 @@
-import numpy as np
+import numpy  as np
+import pandas as pd
 
 from pytest import fixture
 from pytest import    mark
+from pytest import  raises
 
 import invisible_cities.database.load_db as DB
 
 from invisible_cities.io  .mcinfo_io         import load_mcsensor_response_df
 from invisible_cities.core.system_of_units_c import                     units
 
-from . buffer_functions import         wf_binner
-from . buffer_functions import calculate_buffers
-from . buffer_functions import     signal_finder
+from . buffer_functions import             bin_indices
+from . buffer_functions import             bin_sensors
+from . buffer_functions import           buffer_starts
+from . buffer_functions import      bin_sensors_sparse
+from . buffer_functions import               wf_binner
+from . buffer_functions import            block_binner
+from . buffer_functions import       calculate_buffers
+from . buffer_functions import           dense_windows
+from . buffer_functions import        summed_wf_binner
+from . buffer_functions import  calculate_lazy_buffers
+from . buffer_functions import           signal_finder
+from . buffer_functions import      trigger_algorithms
+from . buffer_functions import     time_ordered_chunks
+from . buffer_functions import streaming_signal_finder
+from . buffer_functions import      weighted_histogram
 
 
 @fixture(scope="module")
@@ -73,6 +87,230 @@ def test_wf_binner(mc_waveforms, pmt_ids, sipm_ids, binned_waveforms):
     assert sipm_wf.sum().sum() == sipm_sum
 
 
+def test_bin_indices():
+
+    bins  = np.arange(100, 200, 10.)
+    times = np.array([ 99, 100, 105, 110, 189.9, 190, 191])
+
+    assert np.all(bin_indices(times, bins) == [-1, 0, 0, 1, 8, 8, 9])
+
+
+@mark.parametrize("bins", (np.empty(0), np.array([100.])))
+def test_bin_indices_no_bins(bins):
+
+    ids   = np.array([1, 1, 2])
+    times = np.array([99, 100, 105])
+
+    assert np.all(bin_indices(times, bins) == -1)
+    sns_ids, wfs = bin_sensors(ids, times, np.ones(3, int), bins)
+    assert np.all(sns_ids == [1, 2])
+    assert wfs.shape == (2, 0)
+    assert bin_sensors_sparse(ids, times, np.ones(3, int), bins).shape == (2, 0)
+
+
+def test_bin_sensors_equals_histogram():
+
+    n_samp  = 5000
+    ids     = np.random.choice([3, 10, 22, 1001], n_samp)
+    times   = np.random.uniform(0, 2000, n_samp)
+    charges = np.random.poisson(3, n_samp)
+    bins    = np.arange(100, 1800, 25.)
+
+    sensors = pd.DataFrame(dict(time = times, charge = charges),
+                           index = pd.Index(ids, name = 'sensor_id'))
+    grouped = sensors.groupby('sensor_id').apply(weighted_histogram, bins)
+
+    sns_ids, wfs = bin_sensors(ids, times, charges, bins)
+
+    assert np.all(sns_ids == grouped.index)
+    assert wfs.shape      == (len(grouped), len(bins) - 1)
+    assert np.all(wfs     == np.array(grouped.tolist()))
+
+
+def test_buffer_starts():
+
+    pmt_bins  = np.arange(1000, 2000, 25.)
+    sipm_bins = np.arange(1000, 3000, 1000.)
+    triggers  = np.array([0, 10, 39])
+
+    pmt_starts, sipm_starts = buffer_starts(triggers, pmt_bins, sipm_bins, 25, 4, 1)
+    assert np.all(sipm_starts == -1)
+    assert np.all(pmt_starts  == [-4, -4, -4])
+
+    with raises(ValueError):
+        buffer_starts(triggers, pmt_bins, sipm_bins + 100, 25, 4, 1)
+
+
+@mark.parametrize("starts", ([0], [-5, 3], [17, 40, 95]))
+def test_dense_windows(starts):
+
+    length  = 20
+    charge  = np.random.poisson(5, (12, 100))
+    padded  = np.pad(charge, ((0, 0), (length, length)), "constant")
+
+    windows = dense_windows(charge, starts, length)
+
+    assert windows.shape == (len(starts), 12, length)
+    for window, start in zip(windows, starts):
+        assert np.all(window == padded[:, start + length:start + 2 * length])
+
+
+@mark.parametrize("sparse", (False, True))
+def test_block_binner_equals_wf_binner(mc_waveforms, pmt_ids, sparse):
+
+    max_buffer = 10 * units.minute
+    evts, pmt_binwid, sipm_binwid, all_wfs = mc_waveforms
+
+    sensor_ids = all_wfs.index.get_level_values('sensor_id')
+    is_pmt     = sensor_ids.isin(pmt_ids)
+    binned     = block_binner(max_buffer, sparse)(evts                         ,
+                                                  all_wfs[ is_pmt],  pmt_binwid,
+                                                  all_wfs[~is_pmt], sipm_binwid)
+
+    pmt_binner  = wf_binner(max_buffer)
+    sipm_binner = wf_binner(max_buffer, sparse)
+    for evt, (pmt_bins, pmt_wf, sipm_bins, sipm_wf) in zip(evts, binned):
+        wfs = all_wfs.loc[evt]
+        exp_pmt_bins ,  exp_pmt_wf = pmt_binner(wfs[ wfs.index.isin(pmt_ids)],
+                                                pmt_binwid)
+        exp_sipm_bins, exp_sipm_wf = sipm_binner(wfs[~wfs.index.isin(pmt_ids)],
+                                                 sipm_binwid, pmt_bins[0],
+                                                 pmt_bins[-1] + np.diff(pmt_bins)[-1])
+
+        assert np.all(pmt_bins  == exp_pmt_bins )
+        assert np.all(sipm_bins == exp_sipm_bins)
+        assert np.all(pmt_wf.index  == exp_pmt_wf.index)
+        assert np.all(pmt_wf.values == exp_pmt_wf.values)
+        if sparse:
+            assert np.all(sipm_wf.to_dense() == exp_sipm_wf.to_dense())
+        else:
+            assert np.all(sipm_wf.values == exp_sipm_wf.values)
+
+
+@mark.parametrize("sparse", (False, True))
+def test_block_binner_events_without_pmt_samples(sparse):
+
+    max_buffer  = 10 * units.minute
+    pmt_binwid  = 25 * units.ns
+    sipm_binwid =  1 * units.mus
+    evts        = np.array([3, 5, 8, 13])
+
+    ## Event 5 has only SiPM samples and event 8 none
+    def samples(evt_sensors, t_max):
+        index = [(evt, sns) for evt, sensors in evt_sensors for sns in sensors]
+        return pd.DataFrame(dict(time   = np.random.uniform(0, t_max, len(index)),
+                                 charge = np.random.poisson(5, len(index)) + 1   ),
+                            index = pd.MultiIndex.from_tuples(index,
+                                                              names=('evt', 'sensor_id')))
+    pmt_wfs  = samples([(3, [0, 1, 2]), (13, [0, 2])]          , 5 * units.mus)
+    sipm_wfs = samples([(3, [1000, 1010]), (5, [1001, 1002]),
+                        (13, [1000])]                           , 5 * units.mus)
+
+    binned = block_binner(max_buffer, sparse)(evts, pmt_wfs, pmt_binwid,
+                                              sipm_wfs, sipm_binwid)
+    assert len(binned) == len(evts)
+
+    pmt_binner  = wf_binner(max_buffer)
+    sipm_binner = wf_binner(max_buffer, sparse)
+    for evt, (pmt_bins, pmt_wf, sipm_bins, sipm_wf) in zip(evts, binned):
+        if evt in (5, 8):
+            assert len(pmt_bins) == 0 and len(sipm_bins) == 0
+            assert pmt_wf .shape[1] == 0
+            assert sipm_wf.shape[1] == 0
+            continue
+        exp_pmt_bins ,  exp_pmt_wf = pmt_binner(pmt_wfs.loc[evt], pmt_binwid)
+        exp_sipm_bins, exp_sipm_wf = sipm_binner(sipm_wfs.loc[evt], sipm_binwid,
+                                                 pmt_bins[0],
+                                                 pmt_bins[-1] + np.diff(pmt_bins)[-1])
+        assert np.all(pmt_bins  == exp_pmt_bins )
+        assert np.all(sipm_bins == exp_sipm_bins)
+        assert np.all(pmt_wf.index  == exp_pmt_wf.index)
+        assert np.all(pmt_wf.values == exp_pmt_wf.values)
+        if sparse:
+            assert np.all(sipm_wf.to_dense() == exp_sipm_wf.to_dense())
+        else:
+            assert np.all(sipm_wf.values == exp_sipm_wf.values)
+
+
+@fixture(scope="function")
+def sparse_sensor_samples():
+    n_samp  = 2000
+    ids     = np.random.choice(np.arange(1000, 1100), n_samp)
+    times   = np.random.uniform(0, 1e5, n_samp)
+    charges = np.random.poisson(3, n_samp) + 1
+    bins    = np.arange(0, 1e5 + 1000, 1000.)
+    return ids, times, charges, bins
+
+
+def test_bin_sensors_sparse(sparse_sensor_samples):
+
+    ids, wfs   = bin_sensors       (*sparse_sensor_samples)
+    sparse_wfs = bin_sensors_sparse(*sparse_sensor_samples)
+
+    assert np.all(sparse_wfs.ids   == ids)
+    assert sparse_wfs.shape        == wfs.shape
+    assert len(sparse_wfs.charges) == np.count_nonzero(wfs)
+    assert np.all(sparse_wfs.to_dense() == wfs)
+
+
+def test_calculate_buffers_sparse_sipm(sparse_sensor_samples):
+
+    *_, sipm_bins = sparse_sensor_samples
+    pmt_bins      = np.arange(300, 1e5, 100.)
+    pmt_wf        = pd.DataFrame(np.random.poisson(1, (12, len(pmt_bins) - 1)))
+    ids, sipm_wf  = bin_sensors       (*sparse_sensor_samples)
+    sparse_wf     = bin_sensors_sparse(*sparse_sensor_samples)
+
+    buffer_calculator = calculate_buffers(10, 5, 100, 1000)
+    triggers          = [10, 500]
+
+    dense_buffers  = buffer_calculator(triggers, pmt_bins, pmt_wf,
+                                       sipm_bins, pd.DataFrame(sipm_wf))
+    sparse_buffers = buffer_calculator(triggers, pmt_bins, pmt_wf,
+                                       sipm_bins, sparse_wf)
+
+    for (pmt_d, sipm_d), (pmt_s, sipm_s) in zip(dense_buffers, sparse_buffers):
+        assert np.all(pmt_s             ==  pmt_d)
+        assert np.all(sipm_s.to_dense() == sipm_d)
+
+
+@mark.parametrize("sparse", (False, True))
+def test_calculate_buffers_detector_order(sparse_sensor_samples, sparse):
+
+    *_, sipm_bins = sparse_sensor_samples
+    pmt_bins      = np.arange(300, 1e5, 100.)
+    pmt_wf        = pd.DataFrame(np.random.poisson(1, (3, len(pmt_bins) - 1)))
+    ids, sipm_wf  = bin_sensors(*sparse_sensor_samples)
+    if sparse:
+        sipm_wf   = bin_sensors_sparse(*sparse_sensor_samples)
+    else:
+        sipm_wf   = pd.DataFrame(sipm_wf)
+
+    n_pmt, n_sipm = 12, 1792
+    pmt_ord       = [2, 5, 7]
+    sipm_ord      = ids - 1000 + 300
+    triggers      = [10, 500]
+
+    buffers          = calculate_buffers(10, 5, 100, 1000)(triggers,
+                                                           pmt_bins , pmt_wf ,
+                                                           sipm_bins, sipm_wf)
+    detector_buffers = calculate_buffers(10, 5, 100, 1000,
+                                         n_pmt, n_sipm)(triggers,
+                                                        pmt_bins , pmt_wf ,
+                                                        sipm_bins, sipm_wf,
+                                                        pmt_ord  , sipm_ord)
+
+    for (pmts, sipms), (det_pmts, det_sipms) in zip(buffers, detector_buffers):
+        if sparse:
+            sipms = sipms.to_dense()
+        assert det_pmts .shape == (n_pmt ,  pmts.shape[1])
+        assert det_sipms.shape == (n_sipm, sipms.shape[1])
+        assert np.all(det_pmts [ pmt_ord] ==  pmts)
+        assert np.all(det_sipms[sipm_ord] == sipms)
+        assert det_pmts .sum() ==  pmts.sum()
+        assert det_sipms.sum() == sipms.sum()
+
+
 @mark.parametrize("signal_thresh", (2, 10))
 def test_signal_finder(binned_waveforms, signal_thresh):
 
@@ -91,6 +329,93 @@ def test_signal_finder(binned_waveforms, signal_thresh):
     assert np.all(pmt_sum[pulses] > signal_thresh)
 
 
+@mark.parametrize("window_bins", (1, 4, 25))
+def test_trigger_algorithms(window_bins):
+    rng       = np.random.default_rng(42)
+    wfs       = rng.poisson(0.3, (12, 2000))
+    threshold = 3
+
+    sums      = np.array([[wfs[i, max(0, j - window_bins + 1):j + 1].sum()
+                           for j in range(wfs.shape[1])]
+                          for i in range(wfs.shape[0])])
+    expected  = dict(threshold   =              wfs .sum(0) > threshold ,
+                     window      =              sums.sum(0) > threshold ,
+                     coincidence = np.sum(sums > threshold, axis=0) >= 3)
+
+    for name, algorithm in trigger_algorithms.items():
+        trigger = algorithm(threshold, window_bins=window_bins, n_coincidence=3)
+        assert np.all(trigger(wfs) == np.flatnonzero(expected[name]))
+
+
+@mark.parametrize("algorithm", tuple(trigger_algorithms))
+def test_signal_finder_algorithms(algorithm):
+    bin_width = 25 * units.ns
+    wfs       = np.zeros((12, 100000), int)
+    wfs[:, [ 1000, 1010]] = 5
+    wfs[:, [80000, 90000]] = 5
+
+    find_signal = signal_finder(800, bin_width, 4, algorithm,
+                                window = 100 * units.ns, n_coincidence = 12)
+
+    assert find_signal(wfs) == [1000, 80000]
+    assert find_signal(np.zeros_like(wfs)) == []
+
+
+@mark.parametrize("chunk_size", (1, 7, 100, 10000))
+def test_time_ordered_chunks(chunk_size):
+    rng     = np.random.default_rng(4321)
+    ids     = np.repeat(np.arange(12), rng.integers(0, 500, 12))
+    times   = np.round(rng.uniform(0, 1e4, len(ids)))
+    sensors = pd.DataFrame({'time'  : times,
+                            'charge': np.arange(len(ids))},
+                           index = pd.Index(ids, name = 'sensor_id'))
+    ## Time ordered per sensor as read and shuffled
+    in_order = sensors.reset_index().sort_values(['sensor_id', 'time'],
+                                                 kind='stable').set_index('sensor_id')
+    for wfs in (in_order, sensors):
+        chunks  = list(time_ordered_chunks(wfs, chunk_size))
+        t_all   = np.concatenate([t for t, _ in chunks])
+        q_all   = np.concatenate([q for _, q in chunks])
+
+        assert np.all(np.diff(t_all) >= 0)
+        assert np.all(np.sort(q_all) == np.arange(len(ids)))
+        assert np.all(times[q_all] == t_all)
+    ## Chunks only exceed chunk_size with samples at their last time
+    for t, _ in time_ordered_chunks(in_order, chunk_size):
+        assert np.count_nonzero(t < t[-1]) < chunk_size
+
+
+@mark.parametrize("chunk_size", (1, 7, 100, 10000))
+def test_streaming_signal_finder(chunk_size):
+    rng        = np.random.default_rng(1234)
+    n_samp     = 3000
+    bin_width  = 25 * units.ns
+    max_buffer = 1.5 * units.ms
+    ## Pulses of charge and exact bin edges in the times.
+    times      = np.concatenate((rng.normal(100 * units.mus, 2 * units.mus, n_samp),
+                                 rng.normal(1.2 * units.ms , 2 * units.mus, n_samp),
+                                 rng.uniform(0, 2 * units.ms, n_samp)))
+    times[::50] = np.round(times[::50] / bin_width) * bin_width
+    pmt_wfs    = pd.DataFrame({'time'  : times,
+                               'charge': rng.integers(1, 5, len(times))},
+                              index = pd.MultiIndex.from_arrays(
+                                  (np.zeros(len(times), int),
+                                   rng.integers(0, 12, len(times))),
+                                  names = ('evt', 'sensor_id')))
+
+    buffer_length = 800
+    signal_thresh = 20
+    pmt_bins, pmt_wf = wf_binner(max_buffer)(pmt_wfs.loc[0], bin_width)
+    expected      = signal_finder(buffer_length, bin_width, signal_thresh)(pmt_wf)
+
+    find_signal   = streaming_signal_finder(buffer_length, bin_width,
+                                            signal_thresh, max_buffer)
+    pulses        = list(find_signal(time_ordered_chunks(pmt_wfs, chunk_size)))
+
+    assert len(expected) > 1
+    assert np.all(pulses == expected)
+
+
 @mark.parametrize("pre_trigger signal_thresh".split(),
                   ((100,  2),
                    (400, 10)))
@@ -127,3 +452,44 @@ def test_calculate_buffers(mc_waveforms, binned_waveforms,
         assert sipm_wf.shape[0] == evt[1].shape[0]
         assert evt[0] .shape[1] == int(buffer_length * units.mus / pmt_binwid)
         assert np.sum(evt[0], axis=0)[pre_trg_samp] == pmt_sum[pulses[i]]
+
+
+def test_summed_wf_binner(mc_waveforms, pmt_ids, binned_waveforms):
+
+    pmt_bins, pmt_wf, *_ = binned_waveforms
+
+    evts, pmt_binwid, _, all_wfs = mc_waveforms
+    pmts = all_wfs.loc[evts[0]].loc[pmt_ids]
+
+    sum_bins, pmt_sum = summed_wf_binner(10 * units.minute)(pmts, pmt_binwid)
+
+    assert pmt_sum.shape == (1, pmt_wf.shape[1])
+    assert np.all(sum_bins   == pmt_bins)
+    assert np.all(pmt_sum[0] == pmt_wf.sum())
+
+
+@mark.parametrize("pre_trigger", (100, 400))
+def test_calculate_lazy_buffers(mc_waveforms, pmt_ids, sipm_ids,
+                                binned_waveforms, pre_trigger):
+
+    evts, pmt_binwid, sipm_binwid, all_wfs = mc_waveforms
+    pmt_bins, pmt_wf, sipm_bins, sipm_wf = binned_waveforms
+
+    wfs   = all_wfs.loc[evts[0]]
+    pmts  = wfs.loc[ pmt_ids]
+    sipms = wfs.loc[sipm_ids]
+
+    buffer_length = 800
+    pulses        = signal_finder(buffer_length, pmt_binwid, 2)(pmt_wf)
+
+    buffers       = calculate_buffers     (buffer_length, pre_trigger,
+                                           pmt_binwid   , sipm_binwid)(pulses,
+                                                                       *binned_waveforms)
+    lazy_buffers  = calculate_lazy_buffers(buffer_length, pre_trigger,
+                                           pmt_binwid   , sipm_binwid)(pulses  , pmt_bins,
+                                                                       pmts    ,    sipms)
+
+    assert len(lazy_buffers) == len(buffers)
+    for (pmt_buf, sipm_buf), (lazy_pmt, lazy_sipm) in zip(buffers, lazy_buffers):
+        assert np.all(lazy_pmt  ==  pmt_buf)
+        assert np.all(lazy_sipm == sipm_buf)
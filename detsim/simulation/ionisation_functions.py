@@ -0,0 +1,152 @@
+import math
+
+import numpy as np
+
+from typing import Callable
+from typing import    Tuple
+
+from invisible_cities.core.system_of_units_c import units
+
+
+def WI_() -> float:
+    return 22.4 * units.eV
+
+
+def num_electrons(hit_energies : np.ndarray                ,
+                  fano_factor  : float               = 0.15,
+                  rng          : np.random.Generator = None) -> np.ndarray:
+    """
+    Number of ionisation electrons of each hit energy,
+    gaussian with variance fano_factor times the mean,
+    from rng or from the global numpy state if None.
+    """
+    rng  = np.random if rng is None else rng
+    n_ie = hit_energies / WI_()
+    n_ie = rng.normal(n_ie, np.sqrt(fano_factor * n_ie))
+    return np.round(n_ie).clip(0).astype(int)
+
+
+def cloud_cells(n_cells : int, n_sigma : float) -> Tuple:
+    """
+    Probabilities and positions, in sigmas, of n_cells
+    uniform cells of a unit gaussian in [-n_sigma, n_sigma],
+    the tails in the end cells. The positions are the means
+    of the gaussian in each cell scaled so that the cells
+    keep the unit variance.
+    """
+    edges  = np.linspace(-n_sigma, n_sigma, n_cells + 1)
+    cdf    = np.array([0.5 * (1 + math.erf(u / math.sqrt(2))) for u in edges[1:-1]])
+    pdf    = np.exp(-edges[1:-1]**2 / 2) / math.sqrt(2 * np.pi)
+    cdf    = np.concatenate(([0], cdf, [1]))
+    pdf    = np.concatenate(([0], pdf, [0]))
+    prob   = np.diff(cdf)
+    ## Conditional mean of the gaussian in each cell, scaled
+    ## to add back the variance within the cells
+    centre = -np.diff(pdf) / prob
+    centre = centre / np.sqrt(np.sum(prob * centre**2))
+    return prob, centre
+
+
+def electron_clouds(drift_velocity : float                         ,
+                    lifetime       : float                         ,
+                    diff_trans     : float                         ,
+                    diff_long      : float                         ,
+                    fano_factor    : float =                   0.15,
+                    n_cells        : int   =                      5,
+                    n_sigma        : float =                    2.5,
+                    min_cloud      : int   =                    125,
+                    hit_batch      : int   =                  10000) -> Callable:
+    """
+    Ionisation, drift, lifetime attenuation and
+    diffusion of the electrons of the event hits.
+    Clouds of at least min_cloud electrons are binned
+    in n_cells per axis cells of their (x, y, t) gaussian
+    in [-n_sigma, n_sigma] sigmas, the electrons of the
+    cloud shared among the cells with one multinomial
+    draw, so that the electrons are not sampled one by
+    one. The cells are placed at the mean position of
+    the gaussian inside them, scaled to keep the variance
+    of the cloud, the tails in the end cells.
+    Smaller clouds are sampled electron by electron.
+    The hits are processed hit_batch at a time so memory
+    stays bounded by hit_batch * max(n_cells**3, min_cloud).
+
+    drift_velocity : float
+                     Electron drift velocity
+    lifetime       : float
+                     Electron lifetime
+    diff_trans     : float
+                     Transverse diffusion, sigma per sqrt(cm) of drift
+    diff_long      : float
+                     Longitudinal diffusion, sigma per sqrt(cm) of drift
+    fano_factor    : float
+                     Fano factor of the number of electrons
+    n_cells        : int
+                     Cells per axis of the binned clouds
+    n_sigma        : float
+                     Half width in sigmas of the binned clouds
+    min_cloud      : int
+                     Minimum electrons for a binned cloud
+    hit_batch      : int
+                     Number of hits processed at a time
+    """
+    cell_prob, cell_pos = cloud_cells(n_cells, n_sigma)
+    ## (x, y, t) cell probabilities and positions
+    prob   = np.einsum('i,j,k->ijk', cell_prob, cell_prob, cell_prob).ravel()
+    prob  /= prob.sum()
+    pos_x, pos_y, pos_t = (pos.ravel() for pos in np.meshgrid(cell_pos, cell_pos,
+                                                              cell_pos, indexing='ij'))
+
+    def drift(z    : np.ndarray         ,
+              n_e  : np.ndarray         ,
+              rng  : np.random.Generator) -> Tuple:
+        drift_z    = np.clip(z, 0, None)
+        drift_time = drift_z / drift_velocity
+        n_e        = rng.binomial(n_e, np.exp(-drift_time / lifetime))
+        sqrt_z     = np.sqrt(drift_z / units.cm)
+        return (drift_time, n_e, diff_trans * sqrt_z,
+                diff_long * sqrt_z / drift_velocity)
+
+    def binned_clouds(x, y, t, sig_xy, sig_t, n_e, rng) -> Tuple:
+        n_cell = rng.multinomial(n_e, prob)
+        hit, cell = np.nonzero(n_cell)
+        return (x[hit] + pos_x[cell] * sig_xy[hit],
+                y[hit] + pos_y[cell] * sig_xy[hit],
+                t[hit] + pos_t[cell] * sig_t [hit],
+                n_cell[hit, cell]                 )
+
+    def single_electrons(x, y, t, sig_xy, sig_t, n_e, rng) -> Tuple:
+        hit = np.repeat(np.arange(len(n_e)), n_e)
+        return (x[hit] + rng.standard_normal(len(hit)) * sig_xy[hit],
+                y[hit] + rng.standard_normal(len(hit)) * sig_xy[hit],
+                t[hit] + rng.standard_normal(len(hit)) * sig_t [hit],
+                np.ones(len(hit), int)                              )
+
+    def clouds(x      : np.ndarray         ,
+               y      : np.ndarray         ,
+               z      : np.ndarray         ,
+               time   : np.ndarray         ,
+               energy : np.ndarray         ,
+               rng    : np.random.Generator) -> Tuple:
+        """
+        Returns the x, y, arrival time at the end of
+        the drift and number of electrons of the clouds
+        and electrons of the hits, empty cells dropped.
+        """
+        batches = []
+        for start in range(0, len(x), hit_batch):
+            hits = slice(start, start + hit_batch)
+            n_e  = num_electrons(energy[hits], fano_factor, rng)
+            drift_time, n_e, sig_xy, sig_t = drift(z[hits], n_e, rng)
+            hit_info = (x[hits], y[hits], time[hits] + drift_time, sig_xy, sig_t)
+
+            is_cloud = n_e >= min_cloud
+            for sampler, mask in ((binned_clouds   ,  is_cloud),
+                                  (single_electrons, ~is_cloud)):
+                batches.append(sampler(*(info[mask] for info in hit_info),
+                                       n_e[mask], rng))
+
+        if not batches:
+            return tuple(np.empty(0, dtype) for dtype in (float, float, float, int))
+        return tuple(np.concatenate(column) for column in zip(*batches))
+    return clouds
@@ -0,0 +1,85 @@
+import numpy as np
+
+from pytest import approx
+from pytest import   mark
+
+from invisible_cities.core.system_of_units_c import units
+
+from . ionisation_functions import             WI_
+from . ionisation_functions import     cloud_cells
+from . ionisation_functions import electron_clouds
+from . ionisation_functions import   num_electrons
+
+
+def test_num_electrons():
+
+    energies = np.full(10000, 1e4 * WI_())
+    n_e      = num_electrons(energies, 0.15, np.random.default_rng(20))
+
+    assert np.mean(n_e) == approx(1e4, rel=1e-3)
+    assert np.var (n_e) == approx(0.15 * 1e4, rel=0.1)
+    assert np.all(n_e == num_electrons(energies, 0.15, np.random.default_rng(20)))
+
+
+def test_cloud_cells():
+
+    prob, centre = cloud_cells(5, 2.5)
+
+    assert np.sum(prob) == approx(1)
+    assert np.allclose(prob, prob[::-1])
+    assert np.allclose(centre, -centre[::-1])
+    ## Mean and variance of the unit gaussian kept
+    assert np.sum(prob * centre) == approx(0, abs=1e-12)
+    assert np.sum(prob * centre**2) == approx(1)
+
+
+@mark.parametrize("min_cloud hit_batch".split(),
+                  ((125, 10000), (125, 3), (10**9, 10000)))
+def test_electron_clouds(min_cloud, hit_batch):
+
+    drift_velocity = 1 * units.mm / units.mus
+    lifetime       = 5 * units.ms
+    diff_trans     = 1 * units.mm
+    diff_long      = 0.3 * units.mm
+    clouds = electron_clouds(drift_velocity, lifetime, diff_trans, diff_long,
+                             min_cloud = min_cloud, hit_batch = hit_batch)
+
+    n_hits = 20
+    x      = np.linspace(-100, 100, n_hits)
+    y      = np.zeros(n_hits)
+    z      = np.full(n_hits, 400 * units.mm)
+    time   = np.full(n_hits, 1 * units.mus)
+    energy = np.full(n_hits, 5000 * WI_())
+
+    xe, ye, te, n_e = clouds(x, y, z, time, energy, np.random.default_rng(21))
+
+    assert len(xe) == len(ye) == len(te) == len(n_e)
+    assert np.all(n_e > 0)
+    assert np.all([np.all(a == b) for a, b in
+                   zip((xe, ye, te, n_e),
+                       clouds(x, y, z, time, energy, np.random.default_rng(21)))])
+
+    ## Attenuation by the lifetime
+    drift_time = 400 * units.mm / drift_velocity
+    expected   = n_hits * 5000 * np.exp(-drift_time / lifetime)
+    assert n_e.sum() == approx(expected, rel=0.01)
+
+    ## Clouds centred at the hits with the diffusion spread
+    sigma_xy = diff_trans * np.sqrt(40)
+    sigma_t  = diff_long  * np.sqrt(40) / drift_velocity
+    assert np.average(ye, weights=n_e) == approx(0, abs=0.1)
+    assert np.average(te, weights=n_e) == approx(1 * units.mus + drift_time, rel=1e-4)
+    assert np.sqrt(np.average(ye**2, weights=n_e)) == approx(sigma_xy, rel=0.01)
+    assert np.sqrt(np.average((te - te.mean())**2, weights=n_e)) == approx(sigma_t, rel=0.01)
+
+    ## Binned clouds keep at most n_cells**3 entries per hit
+    if min_cloud < 5000:
+        assert len(xe) <= n_hits * 5**3
+
+
+def test_electron_clouds_empty():
+
+    clouds = electron_clouds(1, 1, 1, 1)
+    xe, ye, te, n_e = clouds(*(np.empty(0) for _ in range(5)),
+                             np.random.default_rng(22))
+    assert len(xe) == len(n_e) == 0
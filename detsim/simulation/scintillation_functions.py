@@ -1,14 +1,20 @@
+import      os
+import hashlib
+
 import numpy as np
 
-from numpy.polynomial.polynomial import polyval
+from numpy.polynomial.polynomial import    polyval
+from numpy.polynomial.polynomial import polyvander
 
 from functools import  partial
 
 from typing    import Callable
+from typing    import Optional
 from typing    import    Tuple
 
 from invisible_cities.core.system_of_units_c import   units
-from invisible_cities.database               import load_db as DB
+
+from detsim.util.util import detector_geometry
 
 
 def WS_() -> float:
@@ -36,30 +42,87 @@ def xenon_scintillation_time(time_range : np.ndarray = np.arange(500)) -> Callab
                    p = raw_dist / sum(raw_dist))
 
 
-def photon_times(hit_times : np.ndarray,
-                 sampler   : Callable = xenon_scintillation_time()) -> np.ndarray:
-    return hit_times + sampler(size = len(hit_times))
+def scintillation_sampler(fast_amp : float,
+                          fast_tau : float,
+                          slow_amp : float,
+                          slow_tau : float) -> Callable:
+    """
+    Continuous photon emission times for the
+    scintillation_time distribution sampled as the
+    mixture of its exponential components, the fast
+    one with probability fast_amp * fast_tau over the
+    total integral, without any binning or cut off.
+    """
+    fast_prob = fast_amp * fast_tau / (fast_amp * fast_tau + slow_amp * slow_tau)
+    def sample(size : int, rng : np.random.Generator = None) -> np.ndarray:
+        rng     = np.random if rng is None else rng
+        is_fast = rng.random(size) < fast_prob
+        return rng.standard_exponential(size) * np.where(is_fast, fast_tau, slow_tau)
+    return sample
+
+
+def inverse_cdf_sampler(time_range : np.ndarray,
+                        density    : np.ndarray) -> Callable:
+    """
+    Continuous times for a tabulated density taken as
+    constant in each [time_range[i], time_range[i+1])
+    bin, the last bin as wide as the one before.
+    The CDF is built once and the times drawn by
+    interpolating it at uniform random numbers.
+    """
+    widths = np.diff(time_range, append = 2 * time_range[-1] - time_range[-2])
+    edges  = np.append(time_range, time_range[-1] + widths[-1])
+    cdf    = np.append(0, np.cumsum(density * widths))
+    cdf   /= cdf[-1]
+    def sample(size : int, rng : np.random.Generator = None) -> np.ndarray:
+        rng = np.random if rng is None else rng
+        return np.interp(rng.random(size), cdf, edges)
+    return sample
+
+
+def xenon_scintillation_sampler() -> Callable:
+    xenon_params = 0.1, 4.5, 0.9, 100
+    return scintillation_sampler(*xenon_params)
+
 
+def photon_times(hit_times : np.ndarray                                  ,
+                 sampler   : Callable            = xenon_scintillation_sampler(),
+                 rng       : np.random.Generator = None) -> np.ndarray:
+    """
+    Emission time of a photon per hit time. rng is only
+    passed to the sampler when given so that samplers
+    taking only size, as xenon_scintillation_time, work.
+    """
+    if rng is None:
+        return hit_times + sampler(size = len(hit_times))
+    return hit_times + sampler(size = len(hit_times), rng = rng)
 
-def num_photons(hit_energies : np.ndarray) -> np.ndarray:
+
+def num_photons(hit_energies : np.ndarray               ,
+                rng          : np.random.Generator = None) -> np.ndarray:
+    """
+    Poisson number of photons for each hit energy,
+    from rng or from the global numpy state if None.
+    """
     n_ws = hit_energies / WS_()
-    return np.random.poisson(n_ws)
+    rng  = np.random if rng is None else rng
+    return rng.poisson(n_ws)
 
 
 ## Will need to be generalised
 def relative_coordinates(detector_db : str,
                          run_number  : int) -> Callable:
-    pmt_xyphi = DB.DataPMT(detector_db, run_number)[['X', 'Y']]
-    pmt_xyphi['phi'] = np.arctan2(pmt_xyphi.loc[:, 'Y'],
-                                  pmt_xyphi.loc[:, 'X'])
+    pmt_x, pmt_y = detector_geometry(detector_db, run_number).pmt_xy.T
+    pmt_phi      = np.arctan2(pmt_y, pmt_x)
 
     def get_relative_coords(x : np.ndarray,
                             y : np.ndarray) -> Tuple:
 
-        rel_r   = np.sqrt((x - pmt_xyphi.X)**2 + (y - pmt_xyphi.Y)**2)
+        x, y    = np.asarray(x)[..., np.newaxis], np.asarray(y)[..., np.newaxis]
+        rel_r   = np.sqrt((x - pmt_x)**2 + (y - pmt_y)**2)
 
-        rel_phi = np.abs(np.arctan2(y, x) - pmt_xyphi.phi)
-        rel_phi[rel_phi > np.pi] = 2 * np.pi - rel_phi
+        rel_phi = np.abs(np.arctan2(y, x) - pmt_phi)
+        rel_phi = np.where(rel_phi > np.pi, 2 * np.pi - rel_phi, rel_phi)
         return rel_r, rel_phi
     return get_relative_coords
 
@@ -109,10 +172,254 @@ def s1_detection_probability(n_bins_phi :        int,
             np.ndarray of floats
             probability of detecting a photon at each sensor
         """
-        bin_gen    = (np.argmax(p < phibins) - 1 for p in phi)
-        phi_bin    = np.fromiter(bin_gen, np.int)
+        bin_gen    = (np.argmax(p < phi_bins) - 1 for p in phi)
+        phi_bin    = np.fromiter(bin_gen, int)
 
-        prob_tuple = map(scint_prob, r, z, parameters[ring, phi_bin])
+        prob_tuple = list(map(scint_prob, r, z, parameters[ring, phi_bin]))
 
         return np.array(prob_tuple).clip(0)
     return probability
+
+
+def s1_probability_matrix(n_bins_phi :        int,
+                          parameters : np.ndarray) -> Callable:
+    """
+    Batched version of s1_detection_probability
+    for many hits at once. The phi bins are found
+    with a sorted search and the polynomials are
+    evaluated as products of the z and r Vandermonde
+    matrices with the coefficient tensor.
+
+    n_bins_phi : int
+                 Number of phi bin edges in [0, pi]
+    parameters : np.ndarray
+                 (n_rings, n_phi_bins, num z powers, num r powers)
+                 polynomial coefficients
+    """
+    n_ring, n_phi, n_z, n_r = parameters.shape
+    phi_bins = np.linspace(0, np.pi, n_bins_phi)
+    ## (num z powers, (ring, phi bin, r power))
+    coeffs   = parameters.transpose(2, 0, 1, 3).reshape(n_z, -1)
+    def probability(r    : np.ndarray,
+                    phi  : np.ndarray,
+                    z    : np.ndarray,
+                    ring : np.ndarray) -> np.ndarray:
+        """
+        Returns the (n_hits, n_sensors) probability
+        of detection of a photon from each hit by
+        each of the sensors.
+
+        r    : np.ndarray of floats
+               (n_hits, n_sensors) relative radius
+        phi  : np.ndarray of floats
+               (n_hits, n_sensors) relative azimuthal angle
+        z    : np.ndarray of floats
+               (n_hits,) Z position of the hits
+        ring : np.ndarray of ints
+               (n_sensors,) ring of each sensor
+        """
+        ## Past the last edge is the last bin as in the scalar path
+        phi_bin = np.searchsorted(phi_bins, phi, side='right') - 1
+        phi_bin = np.where(phi_bin < n_bins_phi - 1, phi_bin, -1) % n_phi
+        sns_par = np.asarray(ring) * n_phi + phi_bin
+
+        ## r polynomial coefficients of each (hit, ring, phi bin)
+        r_coefs = (polyvander(z, n_z - 1) @ coeffs).reshape(len(z), -1, n_r)
+        r_coefs = np.take_along_axis(r_coefs, sns_par[..., np.newaxis], axis=1)
+
+        prob    = np.einsum('hsj,hsj->hs', polyvander(r, n_r - 1), r_coefs)
+        return prob.clip(0)
+    return probability
+
+
+def s1_probability_grid(parameters : np.ndarray          ,
+                        r_bins     : np.ndarray          ,
+                        z_bins     : np.ndarray          ,
+                        cache_dir  : Optional[str] = None) -> np.ndarray:
+    """
+    Dense (ring, phi bin, r, z) detection probability
+    of the parametrisation at the r_bins and z_bins
+    grid points. With cache_dir the grid is saved as
+    a .npy file named by the hash of the parameters
+    and the grid and later memory mapped from it.
+
+    parameters : np.ndarray
+                 (n_rings, n_phi_bins, num z powers, num r powers)
+                 polynomial coefficients
+    r_bins     : np.ndarray
+                 Uniformly spaced r grid points
+    z_bins     : np.ndarray
+                 Uniformly spaced z grid points
+    cache_dir  : str
+                 Directory of the cached grids, no cache if None
+    """
+    parameters = np.ascontiguousarray(parameters, np.float64)
+    r_bins     = np.ascontiguousarray(r_bins    , np.float64)
+    z_bins     = np.ascontiguousarray(z_bins    , np.float64)
+
+    cache_file = None
+    if cache_dir is not None:
+        key = hashlib.sha1()
+        for array in (parameters, r_bins, z_bins):
+            key.update(str(array.shape).encode())
+            key.update(array.tobytes())
+        cache_file = os.path.join(cache_dir, f's1_grid_{key.hexdigest()}.npy')
+        if os.path.exists(cache_file):
+            return np.load(cache_file, mmap_mode='r')
+
+    n_z, n_r = parameters.shape[2:]
+    grid     = np.einsum('zi,kpij,rj->kprz'               ,
+                         polyvander(z_bins, n_z - 1), parameters,
+                         polyvander(r_bins, n_r - 1)            ).clip(0)
+
+    if cache_file is not None:
+        ## Renamed once written so that concurrent
+        ## jobs never map a partial file.
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f'{cache_file[:-4]}.{os.getpid()}.npy'
+        np.save(tmp_file, grid)
+        os.replace(tmp_file, cache_file)
+        return np.load(cache_file, mmap_mode='r')
+    return grid
+
+
+def s1_probability_table(n_bins_phi : int                 ,
+                         parameters : np.ndarray          ,
+                         r_max      : float               ,
+                         z_max      : float               ,
+                         n_r        : int           =  401,
+                         n_z        : int           =  401,
+                         cache_dir  : Optional[str] = None) -> Callable:
+    """
+    Lookup table version of s1_probability_matrix.
+    The probability is bilinearly interpolated in (r, z)
+    from the s1_probability_grid of the parametrisation
+    in [0, r_max] x [0, z_max], positions outside are
+    taken at the closest edge. The returned function
+    has the same arguments as for s1_probability_matrix.
+
+    n_bins_phi : int
+                 Number of phi bin edges in [0, pi]
+    parameters : np.ndarray
+                 (n_rings, n_phi_bins, num z powers, num r powers)
+                 polynomial coefficients
+    r_max      : float
+                 Maximum relative radius of the grid
+    z_max      : float
+                 Maximum z of the grid
+    n_r, n_z   : int
+                 Number of r and z grid points
+    cache_dir  : str
+                 Directory of the cached grids, no cache if None
+    """
+    n_phi    = parameters.shape[1]
+    phi_bins = np.linspace(0, np.pi, n_bins_phi)
+    r_bins   = np.linspace(0, r_max, n_r)
+    z_bins   = np.linspace(0, z_max, n_z)
+    grid     = s1_probability_grid(parameters, r_bins, z_bins, cache_dir)
+    flat     = grid.reshape(-1)
+
+    def grid_position(x: np.ndarray, bins: np.ndarray) -> Tuple:
+        pos  = np.clip((x - bins[0]) / (bins[1] - bins[0]), 0, len(bins) - 1)
+        indx = np.minimum(pos.astype(int), len(bins) - 2)
+        return indx, pos - indx
+
+    def probability(r    : np.ndarray,
+                    phi  : np.ndarray,
+                    z    : np.ndarray,
+                    ring : np.ndarray) -> np.ndarray:
+        phi_bin = np.searchsorted(phi_bins, phi, side='right') - 1
+        phi_bin = np.where(phi_bin < n_bins_phi - 1, phi_bin, -1) % n_phi
+
+        ir, fr  = grid_position(np.asarray(r), r_bins)
+        iz, fz  = grid_position(np.asarray(z), z_bins)
+        iz, fz  = iz[:, np.newaxis], fz[:, np.newaxis]
+
+        ## Flat index of the (ir, iz) corner of each (hit, sensor)
+        corner  = ((np.asarray(ring) * n_phi + phi_bin) * n_r + ir) * n_z + iz
+        return ((1 - fr) * ((1 - fz) * flat[corner      ] + fz * flat[corner       + 1]) +
+                     fr  * ((1 - fz) * flat[corner + n_z] + fz * flat[corner + n_z + 1]))
+    return probability
+
+
+def radial_rings(xy : np.ndarray, decimals : int = 0) -> np.ndarray:
+    """
+    Ring index of each sensor, rings in increasing
+    radius of the positions rounded to decimals.
+    """
+    radius = np.round(np.hypot(xy[:, 0], xy[:, 1]), decimals)
+    return np.unique(radius, return_inverse=True)[1]
+
+
+def s1_waveforms(rel_coords  : Callable                              ,
+                 probability : Callable                              ,
+                 rings       : np.ndarray                            ,
+                 bin_width   : float                                 ,
+                 n_bins      : int                                   ,
+                 start_time  : float                                 ,
+                 sampler     : Callable = xenon_scintillation_sampler(),
+                 hit_chunk   : int      = 10000                      ,
+                 photon_chunk: int      = 1000000                    ) -> Callable:
+    """
+    Binned S1 waveforms of the sensors for the hits
+    of an event. The detected photons of each (hit,
+    sensor) are drawn as Poisson with mean the number
+    of emitted photons times the detection probability,
+    equivalent to thinning the Poisson emission, and their
+    arrival times are histogrammed for all the sensors at
+    once. The hits are processed hit_chunk at a time and
+    their detected photons photon_chunk at a time, so that
+    the per pass arrays hold at most hit_chunk * n_sensors
+    (hit, sensor) pairs and photon_chunk photons, besides
+    the n_sensors * n_bins waveforms.
+
+    rel_coords  : Callable
+                  relative_coordinates of the sensors
+    probability : Callable
+                  s1_probability_matrix or s1_probability_table
+    rings       : np.ndarray
+                  ring of each sensor
+    bin_width   : float
+                  width of the waveform bins
+    n_bins      : int
+                  number of bins of the waveforms
+    start_time  : float
+                  time of the start of the first bin
+                  relative to the event
+    sampler     : Callable
+                  emission time sampler taking (size, rng)
+    hit_chunk   : int
+                  number of hits processed at a time
+    photon_chunk: int
+                  number of detected photons binned at a time
+    """
+    n_sensors = len(rings)
+    def binned_s1(x      : np.ndarray         ,
+                  y      : np.ndarray         ,
+                  z      : np.ndarray         ,
+                  time   : np.ndarray         ,
+                  energy : np.ndarray         ,
+                  rng    : np.random.Generator) -> np.ndarray:
+        """
+        Returns the (n_sensors, n_bins) detected photons.
+        """
+        wfs = np.zeros(n_sensors * n_bins, int)
+        for start in range(0, len(x), hit_chunk):
+            hits    = slice(start, start + hit_chunk)
+            rel_r, rel_phi = rel_coords(x[hits], y[hits])
+            mean    = (energy[hits] / WS_())[:, np.newaxis] * probability(rel_r, rel_phi,
+                                                                          z[hits], rings)
+            n_det   = np.cumsum(rng.poisson(mean).ravel())
+            hit_t   = time[hits]
+            for first in range(0, n_det[-1], photon_chunk):
+                ## (hit, sensor) pair of each detected photon
+                photons = np.arange(first, min(first + photon_chunk, n_det[-1]))
+                pair    = np.searchsorted(n_det, photons, side='right')
+                times   = hit_t[pair // n_sensors] + sampler(size = len(pair), rng = rng)
+
+                bins    = np.floor((times - start_time) / bin_width).astype(int)
+                in_wf   = (bins >= 0) & (bins < n_bins)
+                wfs    += np.bincount((pair[in_wf] % n_sensors) * n_bins + bins[in_wf],
+                                      minlength = n_sensors * n_bins)
+        return wfs.reshape(n_sensors, n_bins)
+    return binned_s1
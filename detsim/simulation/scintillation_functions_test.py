@@ -1,7 +1,186 @@
+import os
 
+import numpy as np
 
-from . scintillation_functions import scintillation_time
+from pytest import approx
+from pytest import   mark
+
+from . scintillation_functions import                        WS_
+from . scintillation_functions import        inverse_cdf_sampler
+from . scintillation_functions import                num_photons
+from . scintillation_functions import               radial_rings
+from . scintillation_functions import               photon_times
+from . scintillation_functions import   s1_detection_probability
+from . scintillation_functions import        s1_probability_grid
+from . scintillation_functions import      s1_probability_matrix
+from . scintillation_functions import       s1_probability_table
+from . scintillation_functions import               s1_waveforms
+from . scintillation_functions import      scintillation_sampler
+from . scintillation_functions import         scintillation_time
+from . scintillation_functions import   xenon_scintillation_time
 
 def test_scintillation_time():
 
     xenon_params = 0.1, 4.5, 0.9, 100
+
+
+@mark.parametrize("n_bins_phi", (10, 11))
+def test_s1_probability_matrix_equals_scalar(n_bins_phi):
+
+    rng        = np.random.default_rng(4)
+    n_hits     = 50
+    n_sensors  = 12
+    parameters = rng.normal(size = (2, 10, 3, 4))
+    ring       = np.repeat([0, 1], n_sensors // 2)
+
+    r   = rng.uniform(0, 500, (n_hits, n_sensors))
+    phi = rng.uniform(0, np.pi, (n_hits, n_sensors))
+    phi[0, :3] = 0, np.pi, np.pi / 2
+    z   = rng.uniform(0, 500, n_hits)
+
+    scalar_prob  = s1_detection_probability(n_bins_phi, parameters)
+    batched_prob = s1_probability_matrix   (n_bins_phi, parameters)
+
+    expected = np.array([scalar_prob(r_hit, phi_hit, np.full(n_sensors, z_hit), ring)
+                         for r_hit, phi_hit, z_hit in zip(r, phi, z)])
+    probs    = batched_prob(r, phi, z, ring)
+
+    assert probs.shape == (n_hits, n_sensors)
+    assert np.allclose(probs, expected)
+    assert np.all(probs >= 0)
+
+
+def test_s1_probability_table(config_tmpdir):
+
+    rng        = np.random.default_rng(5)
+    n_hits     = 200
+    n_sensors  = 12
+    ## Smooth positive parametrisation, quadratic in r and z
+    parameters = np.zeros((2, 10, 3, 3))
+    parameters[..., 0, 0] = rng.uniform(1e-3, 2e-3, (2, 10))
+    parameters[..., 0, 2] = -1e-9
+    parameters[..., 1, 0] = -1e-6
+    ring       = np.repeat([0, 1], n_sensors // 2)
+
+    r   = rng.uniform(0, 400, (n_hits, n_sensors))
+    phi = rng.uniform(0, np.pi, (n_hits, n_sensors))
+    z   = rng.uniform(0, 500, n_hits)
+
+    cache_dir = os.path.join(config_tmpdir, 's1_grid')
+    direct    = s1_probability_matrix(10, parameters)(r, phi, z, ring)
+    table     = s1_probability_table (10, parameters, 400, 500,
+                                      cache_dir = cache_dir)
+    assert np.allclose(table(r, phi, z, ring), direct, rtol=1e-4)
+
+    ## Exact at the grid points
+    r_grid = np.tile(np.linspace(0, 400, 401)[[0, 10, 400]], (2, 4))
+    z_grid = np.linspace(0, 500, 401)[[0, 200]]
+    assert np.allclose(table(r_grid, phi[:2], z_grid, ring),
+                       s1_probability_matrix(10, parameters)(r_grid, phi[:2], z_grid, ring))
+
+    ## The grid is cached and memory mapped
+    assert len(os.listdir(cache_dir)) == 1
+    cached = s1_probability_grid(parameters, np.linspace(0, 400, 401),
+                                 np.linspace(0, 500, 401), cache_dir)
+    assert isinstance(cached, np.memmap)
+    assert cached.shape == (2, 10, 401, 401)
+
+
+def test_scintillation_sampler():
+
+    fast_amp, fast_tau, slow_amp, slow_tau = 0.1, 4.5, 0.9, 100
+    sampler = scintillation_sampler(fast_amp, fast_tau, slow_amp, slow_tau)
+    times   = sampler(1000000, np.random.default_rng(6))
+
+    ## Mean and fraction before 10 ns of the normalised density
+    norm      = fast_amp * fast_tau + slow_amp * slow_tau
+    mean      = (fast_amp * fast_tau**2 + slow_amp * slow_tau**2) / norm
+    early     = (fast_amp * fast_tau * (1 - np.exp(-10 / fast_tau)) +
+                 slow_amp * slow_tau * (1 - np.exp(-10 / slow_tau))) / norm
+    assert np.mean(times) == approx(mean, rel=1e-2)
+    assert np.mean(times < 10) == approx(early, rel=1e-2)
+    assert np.any(times > 500)
+    assert np.all(sampler(100, np.random.default_rng(7)) ==
+                  sampler(100, np.random.default_rng(7)))
+
+
+def test_inverse_cdf_sampler():
+
+    time_range = np.arange(2000.)
+    density    = scintillation_time(time_range, 0, 1, 1, 100)
+    sampler    = inverse_cdf_sampler(time_range, density)
+    times      = sampler(1000000, np.random.default_rng(8))
+
+    assert np.all((times >= 0) & (times <= 2000))
+    assert np.mean(times != np.round(times)) > 0.99
+    ## Piecewise constant exponential: mean within half a bin
+    assert np.mean(times) == approx(100.5, abs=0.5)
+
+
+def test_photon_times():
+
+    hit_times = np.array([0., 1000., 2000.])
+    times     = photon_times(hit_times, rng = np.random.default_rng(9))
+
+    assert np.all(times >= hit_times)
+    assert np.all(times == photon_times(hit_times, rng = np.random.default_rng(9)))
+
+
+def test_photon_times_choice_sampler():
+
+    hit_times = np.array([0., 1000., 2000.])
+    times     = photon_times(hit_times, xenon_scintillation_time())
+
+    assert np.all(times >= hit_times)
+    assert np.all(times <  hit_times + 500)
+
+
+def test_num_photons_rng():
+
+    energies = np.full(1000, 0.01)
+    n_phot   = num_photons(energies, np.random.default_rng(10))
+
+    assert np.all(n_phot == num_photons(energies, np.random.default_rng(10)))
+    assert np.mean(n_phot) == approx(0.01 / WS_(), rel=0.05)
+
+
+def test_radial_rings():
+
+    xy = np.array([[0, 10], [10, 0], [-30, 40], [50, 0], [0, -10.2]])
+    assert np.all(radial_rings(xy) == [0, 0, 1, 1, 0])
+
+
+@mark.parametrize("hit_chunk photon_chunk".split(),
+                  ((1, 1000000), (7, 1000000), (10000, 1000000), (10000, 50)))
+def test_s1_waveforms(hit_chunk, photon_chunk):
+
+    n_sensors  = 4
+    n_hits     = 20
+    prob       = 2e-3
+    bin_width  = 25
+    n_bins     = 400
+    ## Constant probability for all sensors
+    parameters = np.zeros((2, 10, 1, 1))
+    parameters[..., 0, 0] = prob
+    rel_coords = lambda x, y: (np.hypot(x, y)[:, None] * np.ones(n_sensors),
+                               np.zeros((len(x), n_sensors)))
+    binned_s1  = s1_waveforms(rel_coords, s1_probability_matrix(10, parameters),
+                              np.array([0, 0, 1, 1]), bin_width, n_bins, -1000,
+                              hit_chunk = hit_chunk, photon_chunk = photon_chunk)
+
+    rng    = np.random.default_rng(11)
+    x, y   = rng.uniform(-100, 100, (2, n_hits))
+    z      = rng.uniform(0, 500, n_hits)
+    time   = np.full(n_hits, 100.)
+    energy = np.full(n_hits, 2e4 * WS_())
+    wfs    = binned_s1(x, y, z, time, energy, np.random.default_rng(12))
+
+    assert wfs.shape == (n_sensors, n_bins)
+    assert np.all(wfs == binned_s1(x, y, z, time, energy,
+                                   np.random.default_rng(12)))
+    ## Poisson total of mean 20 hits x 2e4 photons x prob
+    ## less the photons after the waveform end
+    expected = n_hits * 2e4 * prob
+    assert np.all(np.abs(wfs.sum(axis=1) - expected) < 6 * np.sqrt(expected))
+    ## Nothing before the hit time at 1100 ns from the start
+    assert np.all(wfs[:, :1100 // bin_width] == 0)
@@ -0,0 +1,114 @@
+import multiprocessing as mp
+
+from collections        import               deque
+from concurrent.futures import ProcessPoolExecutor
+
+from typing import  Callable
+from typing import Generator
+from typing import     Tuple
+from typing import     Union
+
+
+def as_tuple(names: Union[str, Tuple]) -> Tuple:
+    return (names,) if isinstance(names, str) else tuple(names)
+
+
+def chain_maps(stages:      Tuple[Tuple],
+               args  : Union[str, Tuple],
+               out   : Union[str, Tuple]) -> Callable:
+    """
+    Single function equivalent to the chain of
+    dataflow maps fl.map(op, args=a, out=o) for
+    each (op, a, o) in stages. It takes the values
+    of args and returns those of out, so that the
+    whole chain can be run as one operation.
+    """
+    args, out = as_tuple(args), as_tuple(out)
+    def chained(*values):
+        data = dict(zip(args, values))
+        for op, op_args, op_out in stages:
+            op_out = as_tuple(op_out)
+            result = op(*(data[arg] for arg in as_tuple(op_args)))
+            data.update(zip(op_out, result if len(op_out) > 1 else (result,)))
+        if len(out) == 1:
+            return data[out[0]]
+        return tuple(data[name] for name in out)
+    return chained
+
+
+## The operation of the pool workers. Set when the workers
+## are forked so that closures do not need to be pickled.
+_worker_op = None
+
+
+def _set_worker_op(op: Callable) -> None:
+    global _worker_op
+    _worker_op = op
+
+
+def _run_worker_op(*args):
+    return _worker_op(*args)
+
+
+def parallel_map(op           : Callable          , *,
+                 args         : Union[str, Tuple] ,
+                 out          : Union[str, Tuple] ,
+                 workers      : int               ,
+                 max_in_flight: int = None        ) -> Callable:
+    """
+    As the dataflow map fl.map(op, args=args, out=out)
+    but with op run for each event by a pool of worker
+    processes. The events are passed on in the input
+    order and at most max_in_flight (default twice the
+    number of workers) are kept waiting for results so
+    that memory stays bounded.
+    The workers are forked so op can be any callable
+    and only its arguments and results are pickled.
+
+    op            : Callable
+                    The operation, usually from chain_maps
+    args          : str or tuple of str
+                    Names of the arguments of op in the event
+    out           : str or tuple of str
+                    Names in the event for the results of op
+    workers       : int
+                    Number of worker processes
+    max_in_flight : int
+                    Maximum number of events being processed
+    """
+    args, out     = as_tuple(args), as_tuple(out)
+    max_in_flight = max_in_flight or 2 * workers
+
+    def parallel_loop(target: Generator) -> Generator:
+        pool    = ProcessPoolExecutor(workers                              ,
+                                      mp_context  = mp.get_context('fork'),
+                                      initializer =         _set_worker_op,
+                                      initargs    =                  (op,))
+        pending = deque()
+
+        def send_first() -> None:
+            data, result = pending.popleft()
+            values       = result.result()
+            data.update(zip(out, values if len(out) > 1 else (values,)))
+            target.send(data)
+
+        try:
+            while True:
+                data = yield
+                pending.append((data, pool.submit(_run_worker_op,
+                                                  *(data[arg] for arg in args))))
+                while (len(pending) >= max_in_flight or
+                       (pending and pending[0][1].done())):
+                    send_first()
+        except GeneratorExit:
+            while pending:
+                send_first()
+        finally:
+            pool.shutdown()
+            target.close()
+
+    def parallel_stage(target: Generator) -> Generator:
+        loop = parallel_loop(target)
+        next(loop)
+        return loop
+    return parallel_stage
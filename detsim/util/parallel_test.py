@@ -0,0 +1,51 @@
+import os
+import time
+
+import numpy as np
+
+from pytest import mark
+
+from .parallel import   chain_maps
+from .parallel import parallel_map
+
+
+def collect(results: list):
+    def collector():
+        while True:
+            results.append((yield))
+    sink = collector()
+    next(sink)
+    return sink
+
+
+def test_chain_maps():
+    stages  = ((lambda a, b: (a + b, a * b), ("a", "b"), ("sum", "prod")),
+               (lambda s, p: s - p         , ("sum", "prod"),     "diff"))
+    chained = chain_maps(stages, args=("a", "b"), out=("prod", "diff"))
+
+    assert chained(3, 4) == (12, -5)
+    assert chain_maps(stages, args=("a", "b"), out="sum")(3, 4) == 7
+
+
+@mark.parametrize("max_in_flight", (1, 3, None))
+def test_parallel_map_ordered(max_in_flight):
+    n_events = 20
+    delays   = np.random.default_rng(3).uniform(0, 0.02, n_events)
+
+    def slow_square(i, delay):
+        time.sleep(delay)
+        return i ** 2, os.getpid()
+
+    results = []
+    stage   = parallel_map(slow_square,
+                           args          = ("evt", "delay"),
+                           out           = ("square", "pid"),
+                           workers       = 3,
+                           max_in_flight = max_in_flight)(collect(results))
+    for evt, delay in enumerate(delays):
+        stage.send(dict(evt = evt, delay = delay))
+    stage.close()
+
+    assert [data["evt"   ] for data in results] == list(range(n_events))
+    assert [data["square"] for data in results] == [i ** 2 for i in range(n_events)]
+    assert all(data["pid"] != os.getpid() for data in results)
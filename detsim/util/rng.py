@@ -0,0 +1,35 @@
+import os
+import hashlib
+
+import numpy as np
+
+from typing import Callable
+
+
+def file_key(file_name: str) -> int:
+    """
+    Stable 64 bit key of an input file from its base
+    name, the same whichever node or directory reads it.
+    """
+    digest = hashlib.sha1(os.path.basename(file_name).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def event_rng(seed: int) -> Callable:
+    """
+    Seed manager of a job. The generator of each
+    (file, event) is built from its own stream of
+    the job seed, spawned with np.random.SeedSequence
+    from the file key and the event number, so that
+    the random numbers of an event do not depend on
+    the order or the process in which it is simulated
+    and any event can be re-simulated alone.
+
+    seed : int
+           Job seed, the entropy of the SeedSequence
+    """
+    def rng(file_name: str, evt: int) -> np.random.Generator:
+        sequence = np.random.SeedSequence(seed, spawn_key = (file_key(file_name),
+                                                             int(evt)            ))
+        return np.random.Generator(np.random.PCG64(sequence))
+    return rng
@@ -0,0 +1,27 @@
+import numpy as np
+
+from .rng import event_rng
+from .rng import  file_key
+
+
+def test_file_key():
+
+    assert file_key('/data/a/nexus_0.sim.h5') == file_key('nexus_0.sim.h5')
+    assert file_key('nexus_0.sim.h5') != file_key('nexus_1.sim.h5')
+
+
+def test_event_rng_reproducible():
+
+    rng_job   = event_rng(1234)
+    draws     = {(f, evt): rng_job(f, evt).random(5)
+                 for f in ('nexus_0.sim.h5', 'nexus_1.sim.h5') for evt in range(3)}
+
+    ## Reversed order and a new manager give the same streams
+    rng_again = event_rng(1234)
+    for f, evt in reversed(list(draws)):
+        assert np.all(rng_again(f, evt).random(5) == draws[f, evt])
+
+    ## Streams of different events, files or seeds differ
+    assert len({tuple(d) for d in draws.values()}) == len(draws)
+    assert np.all(event_rng(4321)('nexus_0.sim.h5', 0).random(5) !=
+                  draws['nexus_0.sim.h5', 0])
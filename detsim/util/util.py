@@ -1,11 +1,13 @@
+import      os
+import hashlib
+
 import numpy  as np
 import pandas as pd
 
-from typing import  List
-from typing import Tuple
-
-from invisible_cities.database.load_db import  DataPMT
-from invisible_cities.database.load_db import DataSiPM
+from typing import       List
+from typing import NamedTuple
+from typing import   Optional
+from typing import      Tuple
 
 
 def trigger_times(trigger_indx: List[int] ,
@@ -21,18 +23,167 @@ def first_and_last_times(sensor_bin_times: np.ndarray) -> Tuple:
     return min_time, max_time
 
 
+class DetectorGeometry(NamedTuple):
+    pmt_ids  : np.ndarray
+    sipm_ids : np.ndarray
+    pmt_xy   : np.ndarray
+    sipm_xy  : np.ndarray
+    pmt_rows : np.ndarray
+    sipm_rows: np.ndarray
+
+    @property
+    def n_pmt(self) -> int:
+        return len(self.pmt_ids)
+
+    @property
+    def n_sipm(self) -> int:
+        return len(self.sipm_ids)
+
+
+def id_lookup(sensor_ids: np.ndarray) -> np.ndarray:
+    """
+    Dense array giving the database row of each
+    sensor id, -1 for ids not in the database.
+    """
+    rows             = np.full(sensor_ids.max() + 1, -1, np.int32)
+    rows[sensor_ids] = np.arange(len(sensor_ids), dtype=np.int32)
+    return rows
+
+
+## Geometries already loaded in this process
+_geometries = {}
+
+
+def detector_geometry(detector_db: str          ,
+                      run_number : int          ,
+                      cache_dir  : Optional[str] = None) -> DetectorGeometry:
+    """
+    Sensor ids, positions and id to row lookups
+    of the detector. The geometry is loaded once per
+    (detector_db, run_number) and the arrays are read
+    only as they are shared by all callers. A geometry
+    loaded before is saved to cache_dir if not there.
+
+    detector_db : str
+                  Name of the detector database
+    run_number  : int
+                  Run number for the database
+    cache_dir   : str
+                  Directory where the geometry is saved
+                  to and read from instead of the database
+                  by later jobs, no disk cache if None
+    """
+    key = detector_db, run_number
+    if key not in _geometries:
+        geometry = load_geometry(detector_db, run_number, cache_dir)
+        for array in geometry:
+            array.flags.writeable = False
+        _geometries[key] = geometry
+    elif cache_dir is not None:
+        ## Loaded before without disk cache
+        cache_file = geometry_cache_file(detector_db, run_number, cache_dir)
+        if not os.path.exists(cache_file):
+            save_geometry(_geometries[key], cache_file)
+    return _geometries[key]
+
+
+def database_file(detector_db: str) -> str:
+    """
+    Path of the sqlite file of detector_db
+    as given by the IC database module.
+    """
+    return os.path.join(os.environ['ICTDIR'], 'invisible_cities', 'database',
+                        f'localdb.{detector_db}.sqlite3')
+
+
+def load_geometry(detector_db: str          ,
+                  run_number : int          ,
+                  cache_dir  : Optional[str]) -> DetectorGeometry:
+    """
+    Geometry from the cache_dir file when it exists,
+    otherwise from the database, saving it to the
+    cache_dir file if given. The cache file is keyed
+    by the path, size and modification time of the
+    database file so that an updated database is read
+    again. The database modules are only imported
+    when it is read.
+    """
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = geometry_cache_file(detector_db, run_number, cache_dir)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return DetectorGeometry(**{name: cached[name]
+                                           for name in DetectorGeometry._fields})
+
+    from invisible_cities.database.load_db import  DataPMT
+    from invisible_cities.database.load_db import DataSiPM
+
+    pmts     = DataPMT (detector_db, run_number)
+    sipms    = DataSiPM(detector_db, run_number)
+    pmt_ids  =  pmts.SensorID.values
+    sipm_ids = sipms.SensorID.values
+    geometry = DetectorGeometry(pmt_ids   =                   pmt_ids ,
+                                sipm_ids  =                  sipm_ids ,
+                                pmt_xy    =  pmts[['X', 'Y']].values  ,
+                                sipm_xy   = sipms[['X', 'Y']].values  ,
+                                pmt_rows  = id_lookup( pmt_ids)       ,
+                                sipm_rows = id_lookup(sipm_ids)       )
+
+    if cache_file is not None:
+        save_geometry(geometry, cache_file)
+    return geometry
+
+
+def geometry_cache_file(detector_db: str,
+                        run_number : int,
+                        cache_dir  : str) -> str:
+    """
+    Geometry cache file in cache_dir, keyed by the
+    path, size and modification time of the database
+    file so that an updated database is read again.
+    """
+    db_file = database_file(detector_db)
+    stat    = os.stat(db_file)
+    db_key  = f'{os.path.abspath(db_file)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return os.path.join(cache_dir, f'geometry_{detector_db}_{run_number}_' +
+                        hashlib.sha1(db_key.encode()).hexdigest() + '.npz')
+
+
+def save_geometry(geometry: DetectorGeometry, cache_file: str) -> None:
+    ## Written under a process specific name and renamed
+    ## so that concurrent jobs never read a partial file.
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f'{cache_file[:-4]}.{os.getpid()}.npz'
+    np.savez(tmp_file, **geometry._asdict())
+    os.replace(tmp_file, cache_file)
+
+
+def sensor_rows(sensor_ids: np.ndarray, lookup: np.ndarray) -> np.ndarray:
+    """
+    Database rows of the distinct sensor ids in
+    increasing id order, the order in which the
+    sensors of an event are binned.
+    Raises ValueError for ids not in the lookup.
+    """
+    ids          = np.unique(sensor_ids)
+    known        = (ids >= 0) & (ids < len(lookup))
+    known[known] = lookup[ids[known]] >= 0
+    if not np.all(known):
+        raise ValueError(f"Sensor ids {ids[~known]} not in the detector database")
+    return lookup[ids]
+
+
 def sensor_order(pmt_wfs    : pd.Series,
                  sipm_wfs   : pd.Series,
                  detector_db:       str,
                  run_number :       int) -> Tuple:
-    pmts     = DataPMT (detector_db, run_number).SensorID
-    sipms    = DataSiPM(detector_db, run_number).SensorID
-    pmt_ord  = pmts [ pmts.isin( pmt_wfs.index.tolist())].index
-    sipm_ord = sipms[sipms.isin(sipm_wfs.index.tolist())].index
+    geometry = detector_geometry(detector_db, run_number)
+    pmt_ord  = sensor_rows( pmt_wfs.index.values, geometry. pmt_rows)
+    sipm_ord = sensor_rows(sipm_wfs.index.values, geometry.sipm_rows)
     return pmt_ord, sipm_ord
 
 
 def get_no_sensors(detector_db: str, run_number: int) -> Tuple:
-    npmt  = DataPMT (detector_db, run_number).shape[0]
-    nsipm = DataSiPM(detector_db, run_number).shape[0]
-    return npmt, nsipm
+    geometry = detector_geometry(detector_db, run_number)
+    return geometry.n_pmt, geometry.n_sipm
@@ -1,11 +1,23 @@
+import os
+
 import numpy  as np
 import pandas as pd
 
 from pytest import fixture
 from pytest import    mark
+from pytest import  raises
+
+from invisible_cities.database.load_db import  DataPMT
+from invisible_cities.database.load_db import DataSiPM
 
+from .     import                 util
+from .util import    detector_geometry
 from .util import first_and_last_times
+from .util import       get_no_sensors
+from .util import            id_lookup
+from .util import        load_geometry
 from .util import         sensor_order
+from .util import          sensor_rows
 
 
 def test_first_and_last_times():
@@ -44,3 +56,97 @@ def test_sensor_order(ids_and_orders, detector):
 
     assert np.all(pmt_ord  == ids_and_orders[detector][ 'pmt_ord'])
     assert np.all(sipm_ord == ids_and_orders[detector]['sipm_ord'])
+
+
+def test_id_lookup():
+
+    sensor_ids = np.array([1000, 1001, 1063, 5000, 28063])
+    lookup     = id_lookup(sensor_ids)
+
+    assert len(lookup) == sensor_ids.max() + 1
+    assert np.all(lookup[sensor_ids] == np.arange(len(sensor_ids)))
+    assert np.count_nonzero(lookup >= 0) == len(sensor_ids)
+
+    evt_ids = np.array([5000, 1001, 5000, 1001, 28063])
+    assert np.all(sensor_rows(evt_ids, lookup) == [1, 3, 4])
+
+
+@mark.parametrize("unknown_id", (1002, 30000))
+def test_sensor_rows_unknown_id(unknown_id):
+
+    sensor_ids = np.array([1000, 1001, 1063, 5000, 28063])
+    lookup     = id_lookup(sensor_ids)
+
+    evt_ids = np.array([1001, unknown_id, 5000])
+    with raises(ValueError):
+        sensor_rows(evt_ids, lookup)
+
+
+@mark.parametrize("detector", ('new', 'next100'))
+def test_detector_geometry(detector):
+
+    geometry = detector_geometry(detector, -1000)
+    pmts     = DataPMT (detector, -1000)
+    sipms    = DataSiPM(detector, -1000)
+
+    assert detector_geometry(detector, -1000) is geometry
+    assert get_no_sensors(detector, -1000) == (pmts.shape[0], sipms.shape[0])
+
+    assert np.all(geometry. pmt_ids ==  pmts.SensorID.values)
+    assert np.all(geometry.sipm_ids == sipms.SensorID.values)
+    assert np.allclose(geometry.sipm_xy, sipms[['X', 'Y']].values)
+    assert np.all(geometry.sipm_rows[sipms.SensorID.values] == sipms.index)
+
+
+def test_load_geometry_cache(config_tmpdir):
+
+    cache_dir  = os.path.join(config_tmpdir, 'geometry_cache')
+    from_db    = load_geometry('new', -1000, cache_dir)
+    cache_file = os.listdir(cache_dir)
+    assert len(cache_file) == 1
+    assert cache_file[0].startswith('geometry_new_-1000_')
+    assert cache_file[0].endswith  ('.npz')
+
+    from_cache = load_geometry('new', -1000, cache_dir)
+    assert os.listdir(cache_dir) == cache_file
+    for name in from_db._fields:
+        assert np.all(getattr(from_cache, name) == getattr(from_db, name))
+
+
+def test_load_geometry_cache_database_change(config_tmpdir, monkeypatch):
+
+    cache_dir = os.path.join(config_tmpdir, 'geometry_cache_db')
+    db_file   = os.path.join(config_tmpdir, 'localdb.fake.sqlite3')
+    with open(db_file, 'w') as db:
+        db.write('version 1')
+    monkeypatch.setattr(util, 'database_file', lambda detector_db: db_file)
+
+    load_geometry('new', -1000, cache_dir)
+    load_geometry('new', -1000, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    with open(db_file, 'a') as db:
+        db.write(', version 2')
+    load_geometry('new', -1000, cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_detector_geometry_saves_memoised(config_tmpdir, monkeypatch):
+
+    cache_dir = os.path.join(config_tmpdir, 'geometry_cache_memo')
+    db_file   = os.path.join(config_tmpdir, 'localdb.memo.sqlite3')
+    with open(db_file, 'w') as db:
+        db.write('version 1')
+    monkeypatch.setattr(util, 'database_file', lambda detector_db: db_file)
+
+    ids      = np.arange(3)
+    geometry = util.DetectorGeometry(ids, ids + 10, np.zeros((3, 2)), np.ones((3, 2)),
+                                     id_lookup(ids), id_lookup(ids + 10))
+    monkeypatch.setitem(util._geometries, ('memo', 1), geometry)
+
+    ## Loaded without cache_dir, saved on the first call with it
+    assert detector_geometry('memo', 1, cache_dir) is geometry
+    assert len(os.listdir(cache_dir)) == 1
+    from_cache = load_geometry('memo', 1, cache_dir)
+    for name in geometry._fields:
+        assert np.all(getattr(from_cache, name) == getattr(geometry, name))